@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark : normalisation des dates (parse_date, analyseur écrit à la main et mémoïsé) contre l'ancien
+code (split/int pour les dates numériques, dateutil en lecture floue pour les mois en toutes lettres).
+Débit en dates par seconde, sans cache et avec cache, et nombre de résultats différents.
+
+Usage : python benchmark_dates.py [--dates 20000] [--distinctes 500]
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime
+
+from dateutil import parser as dateutil_parser
+
+from function_app import DATE_CANDIDATE_RE, parse_date
+
+MOIS = ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août", "septembre", "octobre",
+        "novembre", "décembre", "oct", "déc", "fév"]
+
+
+def ancienne_version(date_str):
+    """Copie de l'ancien code : dates numériques par split/int, le reste par dateutil"""
+    try:
+        if DATE_CANDIDATE_RE.fullmatch(date_str):
+            day, month, year = date_str.replace('-', '/').split('/')
+            if len(year) == 2:
+                year = '20' + year
+            return datetime(int(year), int(month), int(day))
+        return dateutil_parser.parse(date_str, dayfirst=True, fuzzy=True)
+    except (ValueError, OverflowError):
+        return None
+
+
+def generer_dates(nombre, distinctes, graine=0):
+    """`nombre` dates tirées parmi `distinctes` chaînes (les mêmes dates reviennent d'un email à l'autre)"""
+    rnd = random.Random(graine)
+    modeles = []
+    for _ in range(distinctes):
+        jour, mois, annee = rnd.randint(1, 31), rnd.randint(1, 12), rnd.choice((2024, 2025, 2026))
+        forme = rnd.random()
+        if forme < 0.5:
+            modeles.append(f"{jour:02d}/{mois:02d}/{annee}")
+        elif forme < 0.7:
+            modeles.append(f"{jour}/{mois}/{annee % 100:02d}")
+        elif forme < 0.8:
+            modeles.append(f"{jour}-{mois}-{annee}")
+        else:
+            modeles.append(f"{jour} {rnd.choice(MOIS)} {annee}")
+    return [rnd.choice(modeles) for _ in range(nombre)]
+
+
+def debit(fonction, dates):
+    debut = time.perf_counter()
+    for date in dates:
+        fonction(date)
+    return len(dates) / (time.perf_counter() - debut)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dates", type=int, default=20000)
+    parser.add_argument("--distinctes", type=int, default=500)
+    args = parser.parse_args()
+
+    dates = generer_dates(args.dates, args.distinctes)
+    numeriques = [date for date in dates if DATE_CANDIDATE_RE.fullmatch(date)]
+    print(f"{len(dates)} dates ({len(set(dates))} distinctes, {len(numeriques)} numériques)\n")
+    print(f"{'jeu':<12} {'ancien (dates/s)':>17} {'sans cache':>12} {'cache chaud':>12}")
+    for nom, jeu in (("numériques", numeriques), ("toutes", dates)):
+        ancien = debit(ancienne_version, jeu)
+        sans_cache = debit(parse_date.__wrapped__, jeu)  # coût de l'analyseur seul
+        parse_date.cache_clear()
+        chaud = debit(parse_date, jeu)
+        print(f"{nom:<12} {ancien:>17,.0f} {sans_cache:>12,.0f} {chaud:>12,.0f}")
+
+    differents = [(date, ancienne_version(date), parse_date(date)) for date in sorted(set(dates))
+                  if ancienne_version(date) != parse_date(date)]
+    print(f"\nRésultats différents : {len(differents)}/{len(set(dates))} (mois en toutes lettres mal lus "
+          f"par dateutil, dates impossibles)")
+    for date, avant, apres in differents[:5]:
+        print(f"  {date!r:<22} {avant} -> {apres}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark : PDF envoyé en base64 dans le JSON (pdf_base64) contre partie binaire multipart/form-data.
+Compare la taille du corps de la requête et le temps d'ingestion (lecture du corps, puis décodage ou recopie
+du PDF jusqu'au document PyMuPDF ouvert), pour des BC de tailles croissantes.
+
+Usage : python benchmark_multipart.py [--repetitions 10]
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import statistics
+import time
+
+import azure.functions as func
+import fitz
+import httpx
+
+from benchmark_pipeline import creer_pdf_bc
+from function_app import decode_base64_pdf, read_multipart_request, read_pdf_part
+
+EMAIL = "Bonjour,\n\nVeuillez trouver ci-joint notre confirmation, livraison le 12/10/2025.\n\nCordialement"
+
+
+def pdf_de_taille(nb_pages, annexe):
+    """BC de nb_pages pages, alourdi d'une annexe incompressible de `annexe` octets (scan, image)"""
+    data = creer_pdf_bc("BSK2506CF0383", "IMPRIMERIE AJDIR", "23/06/2025", nb_pages, random.Random(0))
+    if not annexe:
+        return data
+    doc = fitz.open(stream=data, filetype="pdf")
+    doc.embfile_add("scan.bin", os.urandom(annexe))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def requete_json(pdf):
+    body = json.dumps({"email": EMAIL, "sender_email": "contact@ajdir.ma",
+                       "pdf_base64": base64.b64encode(pdf).decode()}).encode()
+    return func.HttpRequest(method="POST", url="/api/analyze_email_and_pdf",
+                            headers={"Content-Type": "application/json"}, body=body)
+
+
+def requete_multipart(pdf):
+    construite = httpx.Request("POST", "http://localhost/api/analyze_email_and_pdf",
+                               data={"email": EMAIL, "sender_email": "contact@ajdir.ma"},
+                               files=[("pdf", ("bc.pdf", pdf, "application/pdf"))])
+    return func.HttpRequest(method="POST", url="/api/analyze_email_and_pdf",
+                            headers={"Content-Type": construite.headers["Content-Type"]}, body=construite.read())
+
+
+def ingerer_json(req):
+    return decode_base64_pdf(req.get_json()["pdf_base64"])
+
+
+def ingerer_multipart(req):
+    _, attachments = read_multipart_request(req)
+    return read_pdf_part(attachments[0])
+
+
+def chronometrer(construire, ingerer, pdf, repetitions):
+    """Médiane (ms) de l'ingestion, sur une requête neuve à chaque fois ; taille du corps en octets"""
+    durees = []
+    for _ in range(repetitions):
+        req = construire(pdf)
+        debut = time.perf_counter()
+        document = ingerer(req)
+        durees.append((time.perf_counter() - debut) * 1000)
+        document.close()
+    return statistics.median(durees), len(req.get_body())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repetitions", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'PDF':>10} {'corps JSON':>12} {'multipart':>12} {'économie':>9} "
+          f"{'JSON (ms)':>10} {'multipart (ms)':>15} {'gain':>6}")
+    for nb_pages, annexe in ((1, 0), (5, 0), (20, 0), (5, 1024 ** 2), (5, 8 * 1024 ** 2)):
+        pdf = pdf_de_taille(nb_pages, annexe)
+        t_json, o_json = chronometrer(requete_json, ingerer_json, pdf, args.repetitions)
+        t_multi, o_multi = chronometrer(requete_multipart, ingerer_multipart, pdf, args.repetitions)
+        print(f"{len(pdf):>10,} {o_json:>12,} {o_multi:>12,} {1 - o_multi / o_json:>8.0%} "
+              f"{t_json:>10.2f} {t_multi:>15.2f} {t_json / t_multi:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
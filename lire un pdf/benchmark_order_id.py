@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark : moteur de recherche d'ID compilé (match_order_id) contre l'ancienne cascade de 11 regex.
+Compare la vitesse et les résultats sur des textes synthétiques de bons de commande.
+
+Usage : python benchmark_order_id.py [--repetitions 20]
+"""
+
+import argparse
+import random
+import re
+import time
+
+from function_app import ORDER_ID_PATTERNS, match_order_id
+
+
+def extract_order_id_cascade(full_text):
+    """Copie de l'ancienne implémentation : une recherche complète par pattern"""
+    for pattern in ORDER_ID_PATTERNS:
+        match = re.search(pattern, full_text)
+        if match:
+            return match.group(0)
+    return None
+
+
+MOTS = (
+    "le fournisseur s'engage à livrer la marchandise conformément aux conditions générales de vente "
+    "tout retard de paiement entraîne des pénalités selon l'article du code de commerce quantité prix "
+    "unitaire total désignation article remise montant hors taxes tva net à payer page"
+).split()
+
+IDS = [
+    "Commande N° BSK2506CF0383",
+    "BC : TAC ETAC60JDF",
+    "Bon de commande CMD20250001",
+    "Référence BC2025-001",
+    "PO 212011016",
+    "",  # aucun ID : pire cas pour la cascade
+]
+
+
+def generer_texte(nb_pages, identifiant, graine):
+    """Texte d'un BC de nb_pages pages, l'identifiant en première page"""
+    rnd = random.Random(graine)
+    pages = []
+    for numero in range(nb_pages):
+        lignes = [" ".join(rnd.choice(MOTS) for _ in range(12)) for _ in range(40)]
+        if numero == 0 and identifiant:
+            lignes.insert(3, identifiant)
+        pages.append("\n".join(lignes))
+    return "\n".join(pages)
+
+
+def chronometrer(fonction, texte, repetitions):
+    debut = time.perf_counter()
+    for _ in range(repetitions):
+        resultat = fonction(texte)
+    return (time.perf_counter() - debut) / repetitions, resultat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repetitions", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'pages':>5}  {'identifiant':<28} {'cascade (ms)':>12} {'moteur (ms)':>12} {'gain':>6}  résultats")
+    identiques = 0
+    total = 0
+    for nb_pages in (1, 10, 40):
+        for graine, identifiant in enumerate(IDS):
+            texte = generer_texte(nb_pages, identifiant, graine)
+            t_cascade, r_cascade = chronometrer(extract_order_id_cascade, texte, args.repetitions)
+            t_moteur, m = chronometrer(match_order_id, texte, args.repetitions)
+            r_moteur = m.value if m else None
+            total += 1
+            identiques += r_cascade == r_moteur
+            comparaison = "identiques" if r_cascade == r_moteur else f"{r_cascade!r} -> {r_moteur!r}"
+            print(f"{nb_pages:>5}  {identifiant or '(aucun)':<28} {t_cascade * 1000:>12.3f} "
+                  f"{t_moteur * 1000:>12.3f} {t_cascade / t_moteur:>5.1f}x  {comparaison}")
+    print(f"\nRésultats identiques : {identiques}/{total}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark des modes de sortie OpenAI : "texte" (LONG_INSTRUCTION, JSON libre) contre "schema"
+(instruction compacte, response_format json_schema, température 0, max_tokens serré).
+Le corpus de benchmark_pipeline est envoyé au stub local, extraction déterministe désactivée
+pour que chaque email passe par OpenAI.
+
+Le stub répond toujours en JSON valide : le taux d'échec de parsing réel se lit sur /api/metrics
+(section "sortie_openai") une fois le mode activé en production.
+
+Usage : python benchmark_output_mode.py
+"""
+
+import asyncio
+
+import httpx
+
+import function_app
+import stub_openai
+from benchmark_pipeline import generer_corpus
+from function_app import ResultCache, build_prompt_content
+
+
+async def analyser(corpus):
+    function_app._openai_client = httpx.AsyncClient(transport=stub_openai.transport())
+    function_app._openai_client_loop = asyncio.get_running_loop()
+    for cas in corpus:
+        user_content, _ = build_prompt_content(cas["email"], function_app.ParsedPdf(cas["pdf"]))
+        await function_app.analyze_user_content(user_content)
+    await function_app._openai_client.aclose()
+
+
+def main():
+    function_app.AZURE_OPENAI_ENDPOINT = "https://stub.openai.local"
+    function_app.DETERMINISTIC_TIER = False
+    corpus = generer_corpus()
+
+    print(f"{'mode':<8} {'réponses':>9} {'prompt (moy.)':>14} {'complétion (moy.)':>18} "
+          f"{'max_tokens':>11} {'échecs JSON':>12}")
+    resultats = {}
+    for mode in ("texte", "schema"):
+        function_app.OPENAI_OUTPUT_MODE = mode
+        function_app.RESULT_CACHE = ResultCache(maxsize=0)
+        asyncio.run(analyser(corpus))
+        stats = function_app.collect_metrics()["sortie_openai"][mode]
+        max_tokens = function_app.openai_request_options()[1]["max_tokens"]
+        resultats[mode] = stats
+        print(f"{mode:<8} {stats['reponses']:>9} {stats['prompt_tokens_moyens']:>14} "
+              f"{stats['completion_tokens_moyens']:>18} {max_tokens:>11} {stats['taux_echec_json']:>12.1%}")
+
+    gain = 1 - resultats["schema"]["prompt_tokens"] / resultats["texte"]["prompt_tokens"]
+    print(f"\nTokens de prompt économisés en mode schema : {gain:.1%}")
+
+
+if __name__ == "__main__":
+    main()
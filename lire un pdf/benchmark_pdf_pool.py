@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark : extraction du texte PDF séquentielle contre le pool de processus, selon le nombre de pages.
+
+Usage : python benchmark_pdf_pool.py [--workers 4] [--pages 10 50 200]
+"""
+
+import argparse
+import os
+import time
+
+import fitz
+
+import function_app
+from function_app import ParsedPdf, load_pdf_texts_parallel
+
+LIGNE = "Article {n} - Papier couché 135 g, format A4, quantité 500, prix unitaire 12,50 EUR, livraison prévue le 29/07/2025"
+
+
+def creer_pdf(nb_pages):
+    """PDF dense : une soixantaine de lignes de texte par page"""
+    doc = fitz.open()
+    for numero in range(nb_pages):
+        texte = "\n".join(LIGNE.format(n=numero * 60 + i) for i in range(60))
+        doc.new_page().insert_textbox(fitz.Rect(20, 20, 590, 830), texte, fontsize=6)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def sequentiel(data):
+    return ParsedPdf(data).full_text
+
+
+def parallele(data):
+    pdf = ParsedPdf(data)
+    load_pdf_texts_parallel([pdf])
+    return pdf.full_text
+
+
+def mesurer(fonction, data, repetitions=3):
+    meilleur = float("inf")
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction(data)
+        meilleur = min(meilleur, time.perf_counter() - debut)
+    return meilleur, resultat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200])
+    args = parser.parse_args()
+
+    function_app.PDF_POOL_WORKERS = args.workers
+    debut = time.perf_counter()
+    function_app.get_pdf_pool()
+    print(f"Pool de {args.workers} processus démarré en {time.perf_counter() - debut:.2f} s\n")
+
+    print(f"{'pages':>6} {'séquentiel (ms)':>16} {'pool (ms)':>10} {'accélération':>13}")
+    try:
+        for nb_pages in args.pages:
+            data = creer_pdf(nb_pages)
+            t_seq, texte_seq = mesurer(sequentiel, data)
+            t_par, texte_par = mesurer(parallele, data)
+            assert texte_seq == texte_par, "le texte extrait diffère"
+            print(f"{nb_pages:>6} {t_seq * 1000:>16.1f} {t_par * 1000:>10.1f} {t_seq / t_par:>12.2f}x")
+    finally:
+        function_app.shutdown_pdf_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de bout en bout : corpus synthétique de bons de commande (PDF PyMuPDF) et d'emails fournisseurs,
+chronométrage de chaque étape et du handler `main` branché sur le stub OpenAI local.
+
+Usage :
+    python benchmark_pipeline.py                                  # affiche les mesures
+    python benchmark_pipeline.py --enregistrer benchmark_baseline.json
+    python benchmark_pipeline.py --comparer benchmark_baseline.json [--tolerance 0.25]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import azure.functions as func
+import fitz
+import httpx
+
+import function_app
+import stub_openai
+from function_app import (
+    ParsedPdf,
+    ResultCache,
+    extract_delivery_date_intelligent,
+    extract_order_id_from_pdf,
+    extract_text_from_pdf,
+)
+
+FORMATS_ID = ["BSK2506CF{n:04d}", "TAC ETAC{n:02d}JDF", "CMD2025{n:04d}", "BC2025-{n:03d}", "PO 2120{n:05d}"]
+
+PHRASES_DATE = [
+    "La livraison est prévue pour le {date}.",
+    "Nous ne pourrons pas livrer avant le {date}.",
+    "Suite à un retard, la livraison est reportée au {date}.",
+    "La commande sera disponible le {date}.",
+    "Délai de livraison : {date}",
+    "Le colis sera expédié le {date}, merci de votre patience.",
+]
+
+FOURNISSEURS = ["IMPRIMERIE AJDIR", "PAPETERIE DU NORD", "ATLAS EMBALLAGE", "SOCIÉTÉ GÉNÉRALE D'IMPRESSION"]
+
+LIGNE_ARTICLE = "{n:>3}  Papier couché 135 g A4 - ramette de 500 feuilles   qté {q:>4}   PU 12,50   total {t:>8.2f}"
+
+PAGES = (1, 5, 20)
+ETAPES = ("extract_text_from_pdf", "extract_order_id_from_pdf", "extract_delivery_date_intelligent", "main")
+
+
+def creer_pdf_bc(id_commande, fournisseur, date_commande, nb_pages, rnd):
+    """Bon de commande de nb_pages pages : en-tête avec l'ID en première page, lignes d'articles ensuite"""
+    doc = fitz.open()
+    for numero in range(nb_pages):
+        lignes = []
+        if numero == 0:
+            lignes += [f"BON DE COMMANDE N° {id_commande}", f"Fournisseur : {fournisseur}",
+                       f"Date de commande : {date_commande}", ""]
+        for i in range(45):
+            q = rnd.randint(1, 500)
+            lignes.append(LIGNE_ARTICLE.format(n=numero * 45 + i + 1, q=q, t=q * 12.5))
+        lignes.append(f"Page {numero + 1}/{nb_pages} - Conditions générales de vente au verso")
+        doc.new_page().insert_textbox(fitz.Rect(30, 30, 580, 820), "\n".join(lignes), fontsize=7)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def generer_corpus(graine=0):
+    """Un cas par combinaison nombre de pages × format d'ID, avec une formulation de date variée"""
+    rnd = random.Random(graine)
+    corpus = []
+    for nb_pages in PAGES:
+        for n, format_id in enumerate(FORMATS_ID):
+            id_commande = format_id.format(n=rnd.randint(1, 99))
+            fournisseur = rnd.choice(FOURNISSEURS)
+            date_livraison = f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/2025"
+            phrase = rnd.choice(PHRASES_DATE).format(date=date_livraison)
+            email = (f"Bonjour,\n\nConcernant votre commande {id_commande}, {phrase[0].lower()}{phrase[1:]}\n"
+                     f"Nous restons à votre disposition.\n\nCordialement,\n{fournisseur}")
+            corpus.append({
+                "nom": f"{nb_pages}p-{format_id.split('{')[0].strip() or 'id'}",
+                "pdf": creer_pdf_bc(id_commande, fournisseur, "23/06/2025", nb_pages, rnd),
+                "email": email,
+                "id_commande": id_commande,
+                "date_livraison": date_livraison,
+            })
+    return corpus
+
+
+def chronometrer(fonction, repetitions):
+    """Médiane des durées (en ms) et dernier résultat"""
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        durees.append((time.perf_counter() - debut) * 1000)
+    return statistics.median(durees), resultat
+
+
+async def appeler_main(cas):
+    req = func.HttpRequest(
+        method="POST",
+        url="/api/analyze_email_and_pdf",
+        headers={"Content-Type": "application/json"},
+        body=json.dumps({"email": cas["email"], "sender_email": "contact@fournisseur.ma",
+                         "pdf_base64": base64.b64encode(cas["pdf"]).decode()}).encode(),
+    )
+    return await function_app.main(req)
+
+
+def installer_stub(latence):
+    """Branche le client OpenAI sur le stub et désactive le cache pour mesurer chaque appel"""
+    function_app.AZURE_OPENAI_ENDPOINT = "https://stub.openai.local"
+    function_app.AZURE_DEPLOYMENT_NAME = "stub"
+    function_app.API_VERSION = "2024-02-01"
+    function_app.RESULT_CACHE = ResultCache(maxsize=0)
+    function_app._openai_client = httpx.AsyncClient(transport=stub_openai.transport(latence))
+    function_app._openai_client_loop = asyncio.get_event_loop()
+
+
+def executer(repetitions=5, latence=0.0, graine=0):
+    """Mesure chaque étape sur chaque cas du corpus ; renvoie {cas: {étape: ms}} et la justesse"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    installer_stub(latence)
+    mesures, justes = {}, {"id_commande": 0, "date_livraison": 0, "main": 0}
+    corpus = generer_corpus(graine)
+    try:
+        for cas in corpus:
+            temps = {}
+            temps["extract_text_from_pdf"], _ = chronometrer(
+                lambda: extract_text_from_pdf(ParsedPdf(cas["pdf"])), repetitions)
+            pdf = ParsedPdf(cas["pdf"])
+            extract_text_from_pdf(pdf)  # texte déjà en cache : on ne mesure que la recherche d'ID
+            temps["extract_order_id_from_pdf"], id_commande = chronometrer(
+                lambda: extract_order_id_from_pdf(pdf), repetitions)
+            temps["extract_delivery_date_intelligent"], date = chronometrer(
+                lambda: extract_delivery_date_intelligent(cas["email"]), repetitions)
+            temps["main"], resp = chronometrer(lambda: loop.run_until_complete(appeler_main(cas)), repetitions)
+            mesures[cas["nom"]] = {etape: round(ms, 3) for etape, ms in temps.items()}
+            justes["id_commande"] += id_commande == cas["id_commande"]
+            justes["date_livraison"] += date == cas["date_livraison"]
+            justes["main"] += resp.status_code == 200 and \
+                json.loads(resp.get_body()).get("ID_commande") == cas["id_commande"]
+    finally:
+        loop.run_until_complete(function_app._openai_client.aclose())
+        loop.close()
+        asyncio.set_event_loop(None)
+    return {
+        "machine": {"python": platform.python_version(), "plateforme": platform.platform()},
+        "repetitions": repetitions,
+        "latence_stub_ms": latence * 1000,
+        "mesures_ms": mesures,
+        "justesse": {cle: f"{valeur}/{len(corpus)}" for cle, valeur in justes.items()},
+    }
+
+
+def comparer(actuel, reference, tolerance):
+    """Liste des (cas, étape, référence, actuel) plus lents que la référence au-delà de la tolérance"""
+    regressions = []
+    for cas, temps in actuel["mesures_ms"].items():
+        for etape, ms in temps.items():
+            avant = reference["mesures_ms"].get(cas, {}).get(etape)
+            # Les durées inférieures à 0,05 ms sont trop bruitées pour être comparées
+            if avant is not None and ms > max(avant, 0.05) * (1 + tolerance):
+                regressions.append((cas, etape, avant, ms))
+    return regressions
+
+
+def ecart(avant, apres):
+    """Écart relatif, ou absolu quand la référence est nulle (étape à 0 ms)"""
+    if not avant:
+        return f"{apres - avant:+.3f} ms"
+    return f"{apres / avant - 1:+.0%}"
+
+
+def afficher(resultat):
+    print(f"{'cas':<14}" + "".join(f"{etape[:26]:>28}" for etape in ETAPES))
+    for cas, temps in resultat["mesures_ms"].items():
+        print(f"{cas:<14}" + "".join(f"{temps[etape]:>25.3f} ms" for etape in ETAPES))
+    print("\nJustesse : " + ", ".join(f"{cle} {valeur}" for cle, valeur in resultat["justesse"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--latence-ms", type=float, default=0.0, help="latence simulée du stub OpenAI")
+    parser.add_argument("--enregistrer", metavar="FICHIER", help="enregistre les mesures comme référence")
+    parser.add_argument("--comparer", metavar="FICHIER", help="compare aux mesures de référence")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="ralentissement toléré (0.25 = +25 %%)")
+    args = parser.parse_args()
+
+    resultat = executer(args.repetitions, args.latence_ms / 1000)
+    afficher(resultat)
+
+    if args.enregistrer:
+        with open(args.enregistrer, "w", encoding="utf-8") as f:
+            json.dump(resultat, f, indent=2, ensure_ascii=False)
+        print(f"\nRéférence enregistrée dans {args.enregistrer}")
+
+    if args.comparer:
+        with open(args.comparer, encoding="utf-8") as f:
+            reference = json.load(f)
+        regressions = comparer(resultat, reference, args.tolerance)
+        if not regressions:
+            print(f"\nAucune régression au-delà de {args.tolerance:.0%} par rapport à {args.comparer}")
+            return 0
+        print(f"\n{len(regressions)} régression(s) au-delà de {args.tolerance:.0%} :")
+        for cas, etape, avant, apres in regressions:
+            print(f"  {cas:<14} {etape:<34} {avant:>9.3f} ms -> {apres:>9.3f} ms ({ecart(avant, apres)})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
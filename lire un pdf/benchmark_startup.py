@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark du démarrage à froid : temps d'import de function_app et latence de la première requête,
+imports différés (STARTUP_MODE=lazy, par défaut) contre imports au démarrage (STARTUP_MODE=eager,
+comportement d'avant). Chaque mesure est faite dans un nouveau processus Python.
+
+Usage : python benchmark_startup.py [--repetitions 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import fitz
+
+DOSSIER = os.path.dirname(os.path.abspath(__file__))
+
+# Exécuté dans un processus neuf : rien n'est importé avant la mesure
+SCRIPT = """
+import time
+debut = time.perf_counter()
+import function_app
+import_ms = (time.perf_counter() - debut) * 1000
+
+import asyncio, base64, json, sys
+import azure.functions as func
+
+function_app.AZURE_OPENAI_ENDPOINT = "https://stub.openai.local"
+function_app.HEADERS = {"Content-Type": "application/json", "api-key": "stub"}
+
+def requete(body):
+    return func.HttpRequest(method="POST", url="/api/analyze_email_and_pdf",
+                            headers={"Content-Type": "application/json"}, body=json.dumps(body).encode())
+
+async def premiere_requete(body):
+    debut = time.perf_counter()
+    # Le stub importe httpx, comme get_openai_client lors d'une vraie première requête
+    import stub_openai
+    function_app._openai_client = function_app.httpx.AsyncClient(transport=stub_openai.transport())
+    function_app._openai_client_loop = asyncio.get_running_loop()
+    resp = await function_app.main(requete(body))
+    assert resp.status_code == 200, resp.get_body()
+    return (time.perf_counter() - debut) * 1000
+
+body = {"email": "Bonjour, votre commande CMD20250042 sera livrée le 12/10/2025."}
+if sys.argv[1] == "pdf":
+    with open(sys.argv[2], "rb") as f:
+        body["pdf_base64"] = base64.b64encode(f.read()).decode()
+print(json.dumps({"import_ms": import_ms, "requete_ms": asyncio.run(premiere_requete(body))}))
+"""
+
+
+def mesurer(mode, requete, chemin_pdf, repetitions):
+    """Médianes (import, première requête) en ms sur `repetitions` processus neufs"""
+    env = dict(os.environ, STARTUP_MODE=mode)
+    mesures = []
+    for _ in range(repetitions):
+        sortie = subprocess.run([sys.executable, "-c", SCRIPT, requete, chemin_pdf], cwd=DOSSIER, env=env,
+                                capture_output=True, text=True, check=True)
+        mesures.append(json.loads(sortie.stdout.strip().splitlines()[-1]))
+    return (statistics.median(m["import_ms"] for m in mesures),
+            statistics.median(m["requete_ms"] for m in mesures))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repetitions", type=int, default=5)
+    args = parser.parse_args()
+
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Bon de commande CMD20250042 - livraison le 12/10/2025")
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(doc.tobytes())
+    doc.close()
+
+    print(f"{'requête':<12} {'mode':<7} {'import (ms)':>12} {'1re requête (ms)':>17} {'total (ms)':>11}")
+    try:
+        for requete in ("email", "pdf"):
+            for mode in ("eager", "lazy"):
+                import_ms, requete_ms = mesurer(mode, requete, f.name, args.repetitions)
+                print(f"{requete:<12} {mode:<7} {import_ms:>12.1f} {requete_ms:>17.1f} {import_ms + requete_ms:>11.1f}")
+    finally:
+        os.remove(f.name)
+
+
+if __name__ == "__main__":
+    main()
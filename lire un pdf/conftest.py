@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixtures partagées des tests : client OpenAI branché sur un stub local
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import function_app
+
+
+@pytest.fixture
+def installer_client(monkeypatch):
+    """
+    Point de terminaison de test et client OpenAI du module branché sur un handler httpx.MockTransport.
+    Renvoie la fonction d'installation, à appeler dans la boucle du test ; tout est restauré après le test.
+    """
+    monkeypatch.setattr(function_app, "AZURE_OPENAI_ENDPOINT", "https://stub.openai.local")
+    monkeypatch.setattr(function_app, "AZURE_DEPLOYMENT_NAME", "stub")
+    monkeypatch.setattr(function_app, "API_VERSION", "2024-02-01")
+    monkeypatch.setattr(function_app, "_openai_client", None)
+    monkeypatch.setattr(function_app, "_openai_client_loop", None)
+
+    def installer(handler):
+        function_app._openai_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        function_app._openai_client_loop = asyncio.get_running_loop()
+    return installer
@@ -1,16 +1,64 @@
 import azure.functions as func
+import asyncio
+import importlib
+import itertools
 import logging
 import os
-import requests
-import fitz  # PyMuPDF
 import json
 import time
 import base64
+import random
+import hashlib
+import sqlite3
+import threading
+import tempfile
+import uuid
+import weakref
+import csv
+import unicodedata
+import email.message
+import email.parser
+import email.utils
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from collections import Counter, OrderedDict, namedtuple
+from functools import lru_cache, partial
+from contextlib import contextmanager
+from contextvars import ContextVar
 import re  # Importation de la bibliothèque regex pour extraire l'ID de commande
-from datetime import datetime
-import dateutil.parser
-from dateutil.relativedelta import relativedelta
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 # tbadel10
+
+# Démarrage à froid : les modules lourds ne sont importés qu'à leur première utilisation,
+# une requête sans PDF ne charge jamais PyMuPDF. STARTUP_MODE=eager les importe au démarrage.
+class _LazyModule:
+    """Module importé au premier accès à l'un de ses attributs"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+httpx = _LazyModule("httpx")
+fitz = _LazyModule("fitz")  # PyMuPDF
+dateutil_parser = _LazyModule("dateutil.parser")
+azure_blob = _LazyModule("azure.storage.blob")
+azure_exceptions = _LazyModule("azure.core.exceptions")
+
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
+if STARTUP_MODE == "eager":
+    for _module in (httpx, fitz, dateutil_parser):
+        _module._load()
+
 # Configuration via variables d'environnement
 AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -21,6 +69,86 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
+# Pool de connexions HTTP partagé pour les appels OpenAI (keep-alive, TLS réutilisé)
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "20"))
+OPENAI_POOL_KEEPALIVE = int(os.getenv("OPENAI_POOL_KEEPALIVE", str(OPENAI_POOL_SIZE)))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "30"))
+
+_openai_client = None
+_openai_client_loop = None
+_closing_clients = set()  # fermetures en cours des clients remplacés (référence forte sur les tâches)
+
+# Quota du déploiement (0 = pas de limite côté client), reprises et disjoncteur
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "0"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "2"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+OPENAI_CIRCUIT_THRESHOLD = int(os.getenv("OPENAI_CIRCUIT_THRESHOLD", "5"))
+OPENAI_CIRCUIT_RESET = float(os.getenv("OPENAI_CIRCUIT_RESET", "30"))
+OPENAI_CIRCUIT_MODE = os.getenv("OPENAI_CIRCUIT_MODE", "fail")  # "fail" : échec immédiat, "queue" : attente
+
+# Plusieurs déploiements (régions, quotas distincts), en JSON : [{"nom": "france", "endpoint": "https://...",
+# "deploiement": "gpt-4o", "cle": "...", "rpm": 300, "tpm": 30000}, ...]. Vide : AZURE_OPENAI_ENDPOINT seul
+OPENAI_BACKENDS = os.getenv("OPENAI_BACKENDS", "")
+OPENAI_LATENCY_ALPHA = float(os.getenv("OPENAI_LATENCY_ALPHA", "0.2"))  # poids de la dernière latence mesurée
+OPENAI_LATENCY_STALE = float(os.getenv("OPENAI_LATENCY_STALE", "60"))  # s sans appel avant de réexplorer
+
+# Cache des résultats d'extraction (mémoire LRU + SQLite optionnel)
+OPENAI_CACHE_SIZE = int(os.getenv("OPENAI_CACHE_SIZE", "256"))
+OPENAI_CACHE_TTL = float(os.getenv("OPENAI_CACHE_TTL", "3600"))
+OPENAI_CACHE_SQLITE = os.getenv("OPENAI_CACHE_SQLITE", "")
+
+# Extraction du texte des gros PDF en parallèle sur un pool de processus (0 = désactivé)
+PDF_POOL_WORKERS = int(os.getenv("PDF_POOL_WORKERS", "0"))
+PDF_POOL_PAGE_THRESHOLD = int(os.getenv("PDF_POOL_PAGE_THRESHOLD", "20"))
+PDF_POOL_TIMEOUT = float(os.getenv("PDF_POOL_TIMEOUT", "60"))
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+# OCR (Tesseract via PyMuPDF) des pages sans couche texte, sur un pool de processus borné
+PDF_OCR = os.getenv("PDF_OCR", "0") == "1"
+PDF_OCR_LANGUAGE = os.getenv("PDF_OCR_LANGUAGE", "fra")
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "300"))
+PDF_OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", "2"))
+PDF_OCR_TIMEOUT = float(os.getenv("PDF_OCR_TIMEOUT", "120"))
+PDF_OCR_TESSDATA = os.getenv("PDF_OCR_TESSDATA") or None  # sinon TESSDATA_PREFIX / installation de Tesseract
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+OCR_STATS = {"pages": 0, "cache": 0, "erreurs": 0}
+
+# Limites d'ingestion des PDF : rejet avant décodage complet, décodage par morceaux
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(20 * 1024 * 1024)))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "500"))
+PDF_SPOOL_THRESHOLD = int(os.getenv("PDF_SPOOL_THRESHOLD", str(2 * 1024 * 1024)))  # au-delà : fichier temporaire
+PDF_DECODE_CHUNK = 256 * 1024  # caractères base64 décodés à la fois (multiple de 4)
+PDF_MAX_FILES = int(os.getenv("PDF_MAX_FILES", "10"))  # pièces jointes d'une requête multipart/form-data
+
+# Ajoute l'en-tête Server-Timing (durée de chaque étape) aux réponses de analyze_email_and_pdf
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "0") == "1"
+
+# Lecture en flux (SSE) de la réponse OpenAI, arrêtée dès que l'objet JSON est complet
+OPENAI_STREAM = os.getenv("OPENAI_STREAM", "0") == "1"
+
+# Paramètres de génération envoyés à OpenAI (font partie de la clé de cache)
+OPENAI_PARAMS = {
+    "temperature": 0.7,
+    "max_tokens": 1000
+}
+
+# Sortie structurée : "texte" (instruction complète, JSON libre) ou "schema" (instruction compacte,
+# response_format json_schema strict, température 0 et max_tokens serré)
+OPENAI_OUTPUT_MODE = os.getenv("OPENAI_OUTPUT_MODE", "texte")
+OPENAI_SCHEMA_MAX_TOKENS = int(os.getenv("OPENAI_SCHEMA_MAX_TOKENS", "150"))
+# Par mode de sortie : réponses reçues, réponses non JSON et tokens consommés (champ usage)
+OUTPUT_STATS = {
+    mode: {"reponses": 0, "echecs_json": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    for mode in ("texte", "schema")
+}
+
 # Instruction donnée à OpenAI pour l'extraction des informations
 LONG_INSTRUCTION = (
     "Tu es un assistant expert en gestion des commandes fournisseurs. "
@@ -68,198 +196,1314 @@ LONG_INSTRUCTION = (
     "Assure-toi que les informations retournées soient **exactes et dans ce format précis**.\n"
 )
 
+# Champs extraits et description donnée à OpenAI lorsqu'une partie seulement est demandée
+EXTRACTION_FIELDS = ("ID_commande", "nom_fournisseur", "date_reception", "date_livraison")
+FIELD_DESCRIPTIONS = {
+    "ID_commande": "**ID de la commande** (exemple : BSK2506CF0383)",
+    "nom_fournisseur": "**Nom du fournisseur** (exemple : 'IMPRIMERIE AJDIR')",
+    "date_reception": "**Date de réception** de la commande (exemple : '23/06/2025')",
+    "date_livraison": "**Date de livraison prévue**, la plus récente ou la plus pertinente, quel que soit le format de la phrase (exemple : '29/07/2025')"
+}
+
+@lru_cache(maxsize=16)
+def build_extraction_instruction(fields: tuple = EXTRACTION_FIELDS) -> str:
+    """Instruction complète si tous les champs sont demandés, sinon une version réduite aux champs manquants"""
+    if set(fields) == set(EXTRACTION_FIELDS):
+        return LONG_INSTRUCTION
+    lines = "\n".join(f"- {FIELD_DESCRIPTIONS[field]}" for field in fields)
+    example = ",\n".join(f'  "{field}": null' for field in fields)
+    return (
+        "Tu es un assistant expert en gestion des commandes fournisseurs. "
+        "À partir du texte d'un email ou d'un bon de commande (BC), y compris les pièces jointes PDF, "
+        "extrais **uniquement** les informations suivantes :\n"
+        f"{lines}\n"
+        "\n"
+        "Si une information est absente, indique la valeur `null`. "
+        "Réponds uniquement avec un JSON valide contenant exactement ces clés, au format :\n"
+        f"{{\n{example}\n}}\n"
+        "Les dates sont au format JJ/MM/AAAA.\n"
+    )
+
+# Version compacte de LONG_INSTRUCTION pour la sortie structurée : le format est imposé par le schéma,
+# l'instruction ne garde que la définition des champs et les règles sur les dates
+COMPACT_FIELD_DESCRIPTIONS = {
+    "ID_commande": "ID de la commande (ex. BSK2506CF0383), dans l'email ou le PDF",
+    "nom_fournisseur": "nom du fournisseur (ex. IMPRIMERIE AJDIR)",
+    "date_reception": "date de réception de la commande",
+    "date_livraison": "date de livraison prévue, la plus récente ou la plus pertinente, y compris formulée "
+                      "indirectement ('pas livrée avant le 12/10/25', 'reportée au 20/10', 'disponible le 15/10')"
+}
+
+@lru_cache(maxsize=None)
+def build_compact_instruction(fields: tuple = EXTRACTION_FIELDS) -> str:
+    lines = "\n".join(f"- {field} : {COMPACT_FIELD_DESCRIPTIONS[field]}" for field in fields)
+    return (
+        "Extrais d'un email fournisseur et de son bon de commande (texte du PDF inclus) :\n"
+        f"{lines}\n"
+        "Dates au format JJ/MM/AAAA. Champ introuvable : null."
+    )
+
+@lru_cache(maxsize=None)
+def _output_schema(fields: tuple) -> str:
+    schema = {
+        "type": "object",
+        "properties": {field: {"type": ["string", "null"]} for field in fields},
+        "required": list(fields),
+        "additionalProperties": False
+    }
+    return json.dumps({"type": "json_schema", "json_schema": {"name": "extraction_commande", "strict": True,
+                                                              "schema": schema}})
+
+def _output_mode() -> str:
+    return "schema" if OPENAI_OUTPUT_MODE == "schema" else "texte"
+
+def _output_stats() -> dict:
+    stats = {}
+    for mode, counters in OUTPUT_STATS.items():
+        responses = counters["reponses"]
+        stats[mode] = dict(counters)
+        stats[mode]["taux_echec_json"] = round(counters["echecs_json"] / responses, 4) if responses else 0.0
+        for name in ("prompt_tokens", "completion_tokens"):
+            stats[mode][f"{name}_moyens"] = round(counters[name] / responses, 1) if responses else 0.0
+    return stats
+
+def openai_request_options(fields: tuple = EXTRACTION_FIELDS):
+    """(instruction, paramètres de génération) selon OPENAI_OUTPUT_MODE"""
+    if OPENAI_OUTPUT_MODE != "schema":
+        return build_extraction_instruction(fields), OPENAI_PARAMS
+    params = {
+        "temperature": 0,
+        "max_tokens": OPENAI_SCHEMA_MAX_TOKENS,
+        "response_format": json.loads(_output_schema(fields))
+    }
+    return build_compact_instruction(fields), params
+
+# Instructions construites une seule fois, au démarrage, pour chaque combinaison de champs à demander
+for _size in range(1, len(EXTRACTION_FIELDS) + 1):
+    for _fields in itertools.combinations(EXTRACTION_FIELDS, _size):
+        build_extraction_instruction(_fields)
+        build_compact_instruction(_fields)
+        _output_schema(_fields)
+
+class AnalysisError(Exception):
+    """Erreur d'analyse accompagnée du code HTTP à renvoyer"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+# Instrumentation par étape : chaque invocation a son chronomètre, porté par une variable de contexte
+# (suivie par asyncio.to_thread et les tâches), les fonctions instrumentées n'ont pas à le recevoir
+class StageTimer:
+    """Durées (ms) des étapes d'une invocation et métriques de taille associées"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.metrics = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def add(self, name: str, value):
+        self.metrics[name] = self.metrics.get(name, 0) + value
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def custom_dimensions(self) -> dict:
+        """Dimensions personnalisées App Insights : durees_<étape>_ms, métriques et durée totale"""
+        dimensions = {f"duree_{name}_ms": round(ms, 2) for name, ms in self.stages.items()}
+        dimensions.update(self.metrics)
+        dimensions["duree_totale_ms"] = round(self.total_ms(), 2)
+        return dimensions
+
+    def server_timing(self) -> str:
+        entries = [f"{name};dur={ms:.1f}" for name, ms in self.stages.items()]
+        entries.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(entries)
+
+_current_timer = ContextVar("current_timer", default=None)
+
+@contextmanager
+def timed_stage(name: str):
+    """Chronomètre une étape de l'invocation en cours (sans effet hors invocation)"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+def record_metric(name: str, value):
+    """Cumule une métrique (octets, pages, tokens...) de l'invocation en cours"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add(name, value)
+
+# Cache des résultats indexé par le contenu (hash de l'entrée + prompt + déploiement + paramètres)
+class ResultCache:
+    """
+    Cache à deux niveaux : un LRU en mémoire avec durée de vie (TTL),
+    et un niveau persistant SQLite optionnel partagé entre redémarrages.
+    Les valeurs doivent être sérialisables en JSON.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600, sqlite_path: str = ""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Calcule une clé stable à partir des éléments qui déterminent le résultat"""
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 or self._db is not None
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    self.persistent_hits += 1
+                    return value
+                if row:
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._db.commit()
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires)
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, value, expires: float):
+        if self.maxsize <= 0:
+            return
+        self._memory[key] = (expires, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "hits_memoire": self.memory_hits,
+            "hits_persistant": self.persistent_hits,
+            "misses": self.misses,
+            "taux_hit": round(self.hits / total, 4) if total else 0.0,
+            "taille_memoire": len(self._memory),
+            "taille_max": self.maxsize,
+            "ttl": self.ttl,
+            "persistant": self._db is not None
+        }
+
+RESULT_CACHE = ResultCache(OPENAI_CACHE_SIZE, OPENAI_CACHE_TTL, OPENAI_CACHE_SQLITE)
+
+# Limiteur de débit partagé (seau à jetons) : requêtes et tokens par minute
+class TokenBucket:
+    """Seau à jetons rempli en continu à `per_minute` jetons par minute, plafonné à `capacity`"""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Réserve `amount` jetons et retourne le temps d'attente nécessaire (le solde peut devenir négatif)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self, amount: float) -> float:
+        """Attente qu'imposerait la réservation de `amount` jetons, sans rien réserver"""
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+class RateLimiter:
+    """
+    Limite les appels de tout le worker au quota RPM/TPM du déploiement.
+    Un 429 avec Retry-After suspend tous les appels, pas seulement celui qui l'a reçu.
+    """
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.paused_until = 0.0
+        self.waited = 0.0
+        self.throttled = 0
+
+    async def acquire(self, tokens: int = 0):
+        wait = max(0.0, self.paused_until - time.monotonic())
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    def expected_wait(self, tokens: int = 0) -> float:
+        """Attente qu'imposerait acquire(tokens) maintenant (pause après un 429 et quota restant)"""
+        wait = max(0.0, self.paused_until - time.monotonic())
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    def pause(self, delay: float):
+        self.throttled += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def stats(self) -> dict:
+        return {
+            "rpm": self.requests.rate * 60 if self.requests else None,
+            "tpm": self.tokens.rate * 60 if self.tokens else None,
+            "reponses_429": self.throttled,
+            "attente_totale_s": round(self.waited, 3)
+        }
+
+class CircuitOpenError(AnalysisError):
+    """Le point de terminaison OpenAI est saturé : le disjoncteur est ouvert"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Service OpenAI saturé, réessayer dans {retry_in:.0f} s", status_code=503)
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """
+    Disjoncteur : après `threshold` échecs consécutifs (429, 5xx, connexion), les appels
+    échouent immédiatement (mode "fail") ou attendent (mode "queue") pendant `reset_timeout`.
+    Ensuite un seul appel d'essai passe ; son succès referme le circuit.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30, mode: str = "fail"):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.mode = mode
+        self.failures = 0
+        self.opened_at = None
+        self.openings = 0
+        self._probe = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "ferme"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "semi-ouvert"
+        return "ouvert"
+
+    @property
+    def available(self) -> bool:
+        """Un appel passerait maintenant, sans échouer ni attendre"""
+        state = self.state
+        return state == "ferme" or (state == "semi-ouvert" and not self._probe)
+
+    async def before_call(self):
+        while True:
+            state = self.state
+            if state == "ferme":
+                return
+            if state == "semi-ouvert" and not self._probe:
+                self._probe = True
+                return
+            retry_in = max(0.1, self.opened_at + self.reset_timeout - time.monotonic())
+            if self.mode != "queue":
+                raise CircuitOpenError(retry_in)
+            await asyncio.sleep(retry_in)
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe = False
+
+    def release_probe(self):
+        """Appel test interrompu sans réponse (annulation) : un autre appel pourra tester le service"""
+        self._probe = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe or self.failures >= self.threshold:
+            if self.opened_at is None or self._probe:
+                self.openings += 1
+                logging.warning(f"Disjoncteur OpenAI ouvert après {self.failures} échecs consécutifs")
+            self.opened_at = time.monotonic()
+            self._probe = False
+
+    def stats(self) -> dict:
+        return {
+            "etat": self.state,
+            "echecs_consecutifs": self.failures,
+            "ouvertures": self.openings
+        }
+
+OPENAI_RATE_LIMITER = RateLimiter(OPENAI_RPM, OPENAI_TPM)
+OPENAI_CIRCUIT = CircuitBreaker(OPENAI_CIRCUIT_THRESHOLD, OPENAI_CIRCUIT_RESET, OPENAI_CIRCUIT_MODE)
+
+# Statuts temporaires pour lesquels on réessaie
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+def retry_delay(response, attempt: int) -> float:
+    """Délai avant la reprise : Retry-After s'il est fourni, sinon backoff exponentiel avec gigue"""
+    if response is not None:
+        retry_after_ms = response.headers.get("retry-after-ms")
+        retry_after = response.headers.get("retry-after")
+        # Plafonné par OPENAI_BACKOFF_MAX : un en-tête aberrant ne bloque pas le worker pendant des heures
+        try:
+            if retry_after_ms:
+                return min(OPENAI_BACKOFF_MAX, float(retry_after_ms) / 1000)
+            if retry_after:
+                return min(OPENAI_BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                return min(OPENAI_BACKOFF_MAX, max(0.0, delay))
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+class OpenAIBackend:
+    """Un déploiement Azure OpenAI, avec son quota, son disjoncteur et sa latence observée"""
+
+    def __init__(self, name: str, endpoint: str, deployment: str, api_key: str = None, api_version: str = None,
+                 limiter: RateLimiter = None, circuit: CircuitBreaker = None):
+        self.name = name
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.api_key = api_key  # None : clé des en-têtes du client (HEADERS)
+        self.api_version = api_version
+        self.limiter = limiter or RateLimiter()
+        self.circuit = circuit or CircuitBreaker(OPENAI_CIRCUIT_THRESHOLD, OPENAI_CIRCUIT_RESET, OPENAI_CIRCUIT_MODE)
+        self.latency = None  # moyenne mobile exponentielle, en secondes
+        self.last_call = 0.0
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+
+    @property
+    def url(self) -> str:
+        return (f"{self.endpoint}/openai/deployments/{self.deployment}/chat/completions"
+                f"?api-version={self.api_version or API_VERSION}")
+
+    @property
+    def headers(self):
+        return {"api-key": self.api_key} if self.api_key else None
+
+    def expected_delay(self, tokens: int = 0) -> float:
+        """
+        Délai attendu d'un appel : latence observée multipliée par les appels en cours, plus l'attente
+        imposée par le quota. Une latence inconnue ou trop ancienne compte pour nulle, pour réexplorer.
+        """
+        latency = self.latency
+        if latency is None or time.monotonic() - self.last_call > OPENAI_LATENCY_STALE:
+            latency = 0.0
+        return latency * (1 + self.in_flight) + self.limiter.expected_wait(tokens)
+
+    def record_latency(self, seconds: float):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += OPENAI_LATENCY_ALPHA * (seconds - self.latency)
+
+    def record_failure(self):
+        self.failures += 1
+        self.circuit.record_failure()
+
+    def stats(self) -> dict:
+        return {
+            "endpoint": self.endpoint,
+            "deploiement": self.deployment,
+            "appels": self.calls,
+            "echecs": self.failures,
+            "en_cours": self.in_flight,
+            "latence_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "disponible": self.circuit.available,
+            "limiteur": self.limiter.stats(),
+            "disjoncteur": self.circuit.stats()
+        }
+
+class OpenAIRouter:
+    """
+    Choisit pour chaque tentative le déploiement au plus faible délai attendu parmi ceux dont le disjoncteur
+    est fermé : un déploiement en échec est écarté le temps de sa réouverture, un 429 bascule sur un autre.
+    """
+
+    def __init__(self, backends: list):
+        self.backends = backends
+
+    def choose(self, tokens: int = 0, exclude=()) -> OpenAIBackend:
+        available = [backend for backend in self.backends if backend.circuit.available]
+        candidates = [backend for backend in available if backend not in exclude] or available
+        if candidates:
+            return min(candidates, key=lambda backend: (backend.expected_delay(tokens), backend.in_flight))
+        # Tous écartés : celui qui sera réessayé le plus tôt (son disjoncteur fait échouer ou attendre l'appel)
+        return min(self.backends, key=lambda backend: backend.circuit.opened_at)
+
+    def has_alternative(self, exclude) -> bool:
+        return any(backend.circuit.available and backend not in exclude for backend in self.backends)
+
+    @property
+    def deployments(self) -> str:
+        """Identité des modèles servis, pour les clés du cache"""
+        return ",".join(sorted({str(backend.deployment) for backend in self.backends}))
+
+    def stats(self) -> dict:
+        return {backend.name: backend.stats() for backend in self.backends}
+
+def parse_openai_backends(config: str) -> list:
+    """Déploiements décrits par OPENAI_BACKENDS ; "cle_env" désigne une variable contenant la clé"""
+    try:
+        backends = []
+        for index, entry in enumerate(json.loads(config)):
+            api_key = entry.get("cle") or (os.getenv(entry["cle_env"]) if entry.get("cle_env") else None)
+            backends.append(OpenAIBackend(
+                entry.get("nom") or f"deploiement-{index + 1}",
+                entry["endpoint"].rstrip("/"),
+                entry["deploiement"],
+                api_key=api_key or AZURE_OPENAI_KEY,
+                api_version=entry.get("api_version"),
+                limiter=RateLimiter(float(entry.get("rpm", 0)), float(entry.get("tpm", 0)))
+            ))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"OPENAI_BACKENDS invalide : {str(e)}") from e
+    if not backends:
+        raise ValueError("OPENAI_BACKENDS ne contient aucun déploiement")
+    return backends
+
+OPENAI_ROUTER = OpenAIRouter(parse_openai_backends(OPENAI_BACKENDS)) if OPENAI_BACKENDS else None
+_default_backend = OpenAIBackend("defaut", None, None)
+_default_router = OpenAIRouter([_default_backend])
+
+def get_openai_router() -> OpenAIRouter:
+    """Routeur des déploiements de OPENAI_BACKENDS, sinon du seul AZURE_OPENAI_ENDPOINT"""
+    if OPENAI_ROUTER is not None:
+        return OPENAI_ROUTER
+    # Relu à chaque appel : la configuration d'un seul déploiement reste modifiable à chaud (tests, benchmarks)
+    _default_backend.endpoint = AZURE_OPENAI_ENDPOINT
+    _default_backend.deployment = AZURE_DEPLOYMENT_NAME
+    _default_backend.limiter = OPENAI_RATE_LIMITER
+    _default_backend.circuit = OPENAI_CIRCUIT
+    return _default_router
+
+# Lecture de la réponse chat/completions, complète ou en flux (SSE)
+class JsonObjectScanner:
+    """
+    Suit le texte reçu morceau par morceau et repère la fin du premier objet JSON
+    (accolades équilibrées hors chaînes), sans attendre le reste de la réponse.
+    """
+
+    def __init__(self):
+        self.received = []
+        self.start = None
+        self.end = None
+        self._offset = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, chunk: str) -> bool:
+        """Ajoute un morceau ; retourne True dès que l'objet est complet"""
+        self.received.append(chunk)
+        for position, char in enumerate(chunk, self._offset):
+            if self.complete:
+                break
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self.start is not None:
+                self._in_string = True
+            elif char == "{":
+                if self.start is None:
+                    self.start = position
+                self._depth += 1
+            elif char == "}" and self.start is not None:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = position + 1
+        self._offset += len(chunk)
+        return self.complete
+
+    @property
+    def text(self) -> str:
+        """L'objet JSON s'il est complet, sinon tout le texte reçu"""
+        received = "".join(self.received)
+        return received[self.start:self.end] if self.complete else received
+
+async def _read_completion_stream(response) -> dict:
+    """Lit les événements SSE et s'arrête dès que l'objet JSON de la réponse est complet"""
+    scanner = JsonObjectScanner()
+    finish_reason = None
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        event = json.loads(data)
+        for choice in event.get("choices") or []:
+            finish_reason = choice.get("finish_reason") or finish_reason
+            if scanner.feed((choice.get("delta") or {}).get("content") or ""):
+                break
+        if scanner.complete:
+            record_metric("openai_flux_arret_anticipe", 1)
+            finish_reason = finish_reason or "stop"
+            break
+    # Même forme qu'une réponse non diffusée : le reste du code ne fait pas la différence
+    return {"choices": [{"index": 0, "finish_reason": finish_reason,
+                         "message": {"role": "assistant", "content": scanner.text}}]}
+
+async def _post_completion(client, url: str, body: dict, headers: dict = None) -> dict:
+    """Envoie la requête chat/completions ; en mode flux, ferme la connexion une fois l'objet reçu"""
+    if not body.get("stream"):
+        response = await client.post(url, json=body, headers=headers)
+        response.raise_for_status()
+        return response.json()
+    async with client.stream("POST", url, json=body, headers=headers) as response:
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+        return await _read_completion_stream(response)
+
+# Client HTTP asynchrone partagé par toutes les invocations du worker
+def get_openai_client() -> "httpx.AsyncClient":
+    """
+    Retourne le client asynchrone du module, créé au premier appel.
+    Le client est recréé si la boucle d'événements a changé (tests, redémarrage du worker).
+    """
+    global _openai_client, _openai_client_loop
+    loop = asyncio.get_running_loop()
+    if _openai_client is None or _openai_client.is_closed or _openai_client_loop is not loop:
+        if _openai_client is not None and not _openai_client.is_closed:
+            _close_stale_client(_openai_client, _openai_client_loop, loop)
+        _openai_client = httpx.AsyncClient(
+            headers=HEADERS,
+            limits=httpx.Limits(
+                max_connections=OPENAI_POOL_SIZE,
+                max_keepalive_connections=OPENAI_POOL_KEEPALIVE
+            ),
+            timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+        )
+        _openai_client_loop = loop
+    return _openai_client
+
+def _close_stale_client(client, client_loop, loop):
+    """Ferme le client d'une autre boucle : sur celle-ci si elle tourne encore, sinon sur la boucle courante"""
+    if client_loop is not None and client_loop.is_running() and not client_loop.is_closed():
+        asyncio.run_coroutine_threadsafe(client.aclose(), client_loop)
+        return
+    task = loop.create_task(_aclose_quietly(client))
+    _closing_clients.add(task)
+    task.add_done_callback(_closing_clients.discard)
+
+async def _aclose_quietly(client):
+    # Le client est marqué fermé avant la fermeture des connexions, qui échoue si leur boucle est fermée
+    try:
+        await client.aclose()
+    except (RuntimeError, OSError) as e:
+        logging.debug(f"Connexions de l'ancien client OpenAI abandonnées : {e}")
+
 # Fonction pour envoyer la requête à OpenAI
-def query_azure_openai(user_content: str):
-    url = f"{AZURE_OPENAI_ENDPOINT}/openai/deployments/{AZURE_DEPLOYMENT_NAME}/chat/completions?api-version={API_VERSION}"
+async def query_azure_openai(user_content: str, instruction: str = LONG_INSTRUCTION, params: dict = None):
+    router = get_openai_router()
     body = {
         "messages": [
-            {"role": "system", "content": LONG_INSTRUCTION},
+            {"role": "system", "content": instruction},
             {"role": "user", "content": user_content}
         ],
-        "temperature": 0.7,
-        "max_tokens": 1000
+        **(params or OPENAI_PARAMS)
     }
-    retry_delay = 5
-    max_retries = 3
-    for attempt in range(max_retries):
+    if OPENAI_STREAM:
+        body["stream"] = True
+    # Une même entrée (renvoi Power Automate) ne repasse pas par OpenAI
+    cache_key = ResultCache.make_key("openai", router.deployments, body)
+    cached = RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        logging.info("Réponse OpenAI servie depuis le cache")
+        record_metric("cache_openai", 1)
+        return cached
+    client = get_openai_client()
+    estimated_tokens = estimate_tokens(instruction) + estimate_tokens(user_content) + body["max_tokens"]
+    failed = set()  # déploiements en échec pendant cette requête : la reprise part ailleurs si possible
+    for attempt in range(OPENAI_MAX_RETRIES):
+        last_attempt = attempt == OPENAI_MAX_RETRIES - 1
+        backend = router.choose(estimated_tokens, failed)
+        await backend.circuit.before_call()
         try:
-            response = requests.post(url, headers=HEADERS, json=body, timeout=30)
-            response.raise_for_status()
-            return response.json()  # Retourner le JSON de la réponse
-        except requests.exceptions.HTTPError as e:
-            if response.status_code == 429:
-                time.sleep(retry_delay * (attempt + 1))
-                continue
-            logging.error(f"Erreur OpenAI: {str(e)}")
+            await backend.limiter.acquire(estimated_tokens)
+        except BaseException:
+            backend.circuit.release_probe()  # annulé en attente du quota : l'appel test n'a pas eu lieu
             raise
-        except Exception as e:
-            logging.error(f"Erreur de connexion: {str(e)}")
-            if attempt == max_retries - 1:
+        record_metric("openai_tentatives", 1)
+        backend.calls += 1
+        backend.in_flight += 1
+        backend.last_call = started = time.monotonic()
+        try:
+            result = await _post_completion(client, backend.url, body, backend.headers)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in RETRYABLE_STATUS:
+                backend.circuit.record_success()  # le service répond : erreur propre à la requête
+                logging.error(f"Erreur OpenAI: {str(e)}")
                 raise
-            time.sleep(retry_delay * (attempt + 1))
+            backend.record_failure()
+            failed.add(backend)
+            delay = retry_delay(e.response, attempt)
+            if e.response.status_code == 429:
+                backend.limiter.pause(delay)
+            logging.warning(f"OpenAI {e.response.status_code} ({backend.name}), tentative {attempt + 1}/{OPENAI_MAX_RETRIES}, reprise dans {delay:.1f} s")
+            if last_attempt:
+                raise
+            # Pour un 429, la pause du limiteur s'applique déjà ; un autre déploiement disponible répond sans attendre
+            if e.response.status_code != 429 and not router.has_alternative(failed):
+                await asyncio.sleep(delay)
+            continue
+        except httpx.TransportError as e:
+            backend.record_failure()
+            failed.add(backend)
+            logging.error(f"Erreur de connexion ({backend.name}): {str(e)}")
+            if last_attempt:
+                raise
+            if not router.has_alternative(failed):
+                await asyncio.sleep(retry_delay(None, attempt))
+            continue
+        except Exception:
+            # Réponse illisible (page HTML d'un proxy, flux SSE invalide...) : échec du déploiement, sans reprise
+            backend.record_failure()
+            raise
+        except BaseException:
+            # Annulation ou délai de l'hôte : l'appel test éventuel du disjoncteur est libéré
+            backend.circuit.release_probe()
+            raise
+        finally:
+            backend.in_flight -= 1
+        backend.circuit.record_success()
+        backend.record_latency(time.monotonic() - started)
+        for name, value in (result.get("usage") or {}).items():
+            if isinstance(value, int):
+                record_metric(name, value)  # prompt_tokens, completion_tokens, total_tokens
+        RESULT_CACHE.set(cache_key, result)
+        return result  # Retourner le JSON de la réponse
+
+# Document PDF analysé une seule fois par requête et partagé par tous les extracteurs
+class ParsedPdf:
+    """
+    Ouvre le PDF une seule fois avec PyMuPDF et garde en cache le texte de chaque page.
+    Le texte d'une page n'est extrait qu'à la première demande.
+    """
+
+    def __init__(self, pdf_bytes: bytes = None, path: str = None, owned: bool = False):
+        if path is not None:
+            # Fichier sur disque : PyMuPDF lit les pages à la demande, sans tout charger en mémoire
+            self.doc = fitz.open(path, filetype="pdf")
+            self.source = path
+            self.size = os.path.getsize(path)
+        else:
+            self.doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            self.source = pdf_bytes
+            self.size = len(pdf_bytes)
+        # Fichier temporaire créé par l'ingestion : supprimé à la fermeture ou à la destruction
+        self._cleanup = weakref.finalize(self, _remove_file, path) if owned else None
+        self._page_texts = {}
+
+    @property
+    def page_count(self) -> int:
+        return self.doc.page_count
+
+    def page_text(self, index: int) -> str:
+        if index not in self._page_texts:
+            self._page_texts[index] = self.doc[index].get_text("text").strip()  # Extraction du texte brut
+        return self._page_texts[index]
+
+    def iter_page_texts(self):
+        """Parcourt les pages dans l'ordre en ignorant les pages sans texte"""
+        for index in range(self.page_count):
+            text = self.page_text(index)
+            if text:
+                yield index, text
+
+    @property
+    def full_text(self) -> str:
+        return "\n".join(text for _, text in self.iter_page_texts())
+
+    def close(self):
+        self.doc.close()
+        if self._cleanup is not None:
+            self._cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _as_parsed_pdf(pdf) -> ParsedPdf:
+    """Accepte indifféremment des octets ou un ParsedPdf déjà construit"""
+    return pdf if isinstance(pdf, ParsedPdf) else ParsedPdf(pdf)
+
+# Pool de processus partagé, démarré à la première utilisation puis gardé chaud
+def _extract_pages_worker(source, start: int, stop: int) -> list:
+    """Exécuté dans un processus du pool : texte des pages [start, stop) d'un PDF (octets ou chemin)"""
+    if isinstance(source, str):
+        doc = fitz.open(source, filetype="pdf")
+    else:
+        doc = fitz.open(stream=source, filetype="pdf")
+    with doc:
+        return [doc[index].get_text("text").strip() for index in range(start, stop)]
+
+def _warm_pdf_worker() -> int:
+    fitz._load()  # PyMuPDF chargé avant la première page à extraire
+    return os.getpid()
+
+def get_pdf_pool():
+    """Retourne le pool de processus, ou None si le mode parallèle est désactivé"""
+    global _pdf_pool
+    if PDF_POOL_WORKERS <= 0:
+        return None
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            # Démarrer tous les processus maintenant plutôt qu'au premier gros PDF
+            for future in [_pdf_pool.submit(_warm_pdf_worker) for _ in range(PDF_POOL_WORKERS)]:
+                future.result()
+        return _pdf_pool
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(cancel_futures=True)
+            _pdf_pool = None
+
+def load_pdf_texts_parallel(pdfs: list, timeout: float = None):
+    """
+    Répartit les pages de un ou plusieurs documents sur le pool de processus,
+    puis range le texte de chaque page dans le cache de son ParsedPdf.
+    Chaque document a son propre délai : un document trop lent est abandonné sans
+    interrompre les autres, puis TimeoutError est levée une fois tous les documents traités.
+    """
+    pool = get_pdf_pool()
+    timeout = PDF_POOL_TIMEOUT if timeout is None else timeout
+    submitted = []
+    for pdf in pdfs:
+        chunk = -(-pdf.page_count // PDF_POOL_WORKERS)
+        futures = [
+            (start, pool.submit(_extract_pages_worker, pdf.source, start, min(start + chunk, pdf.page_count)))
+            for start in range(0, pdf.page_count, chunk)
+        ]
+        submitted.append((pdf, futures))
+
+    timed_out = 0
+    for pdf, futures in submitted:
+        deadline = time.monotonic() + timeout
+        try:
+            for start, future in futures:
+                texts = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                for offset, text in enumerate(texts):
+                    pdf._page_texts[start + offset] = text
+        # Avant Python 3.11, concurrent.futures.TimeoutError n'est pas le TimeoutError natif
+        except FutureTimeoutError:
+            for _, future in futures:
+                future.cancel()
+            timed_out += 1
+            logging.error(f"Extraction parallèle d'un PDF de {pdf.page_count} pages interrompue après {timeout} s")
+    if timed_out:
+        raise FutureTimeoutError(f"{timed_out} PDF non extrait(s) en {timeout} s")
 
 # Fonction pour extraire le texte d'un PDF
-def extract_text_from_pdf(pdf_bytes: bytes):
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    all_text = []
-    for page in doc:
-        text = page.get_text("text").strip()  # Extraction du texte brut
-        if text:
-            all_text.append(text)
-    return "\n".join(all_text)
+def extract_text_from_pdf(pdf):
+    pdf = _as_parsed_pdf(pdf)
+    # Gros document : pages réparties sur le pool de processus, texte rassemblé dans l'ordre
+    if get_pdf_pool() is not None and pdf.page_count >= PDF_POOL_PAGE_THRESHOLD and len(pdf._page_texts) < pdf.page_count:
+        load_pdf_texts_parallel([pdf])
+    if PDF_OCR:
+        ocr_missing_pages(pdf)
+    return pdf.full_text
+
+def ocr_page_image(png: bytes, language: str, tessdata: str = None) -> str:
+    """Exécuté dans un processus du pool OCR : texte reconnu sur l'image d'une page"""
+    pix = fitz.Pixmap(png)
+    ocr_pdf = pix.pdfocr_tobytes(language=language, tessdata=tessdata)
+    with fitz.open(stream=ocr_pdf, filetype="pdf") as doc:
+        return doc[0].get_text("text").strip()
+
+def get_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(
+                max_workers=max(1, PDF_OCR_WORKERS),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _ocr_pool
+
+def shutdown_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is not None:
+            _ocr_pool.shutdown(cancel_futures=True)
+            _ocr_pool = None
+
+def ocr_missing_pages(pdf: ParsedPdf) -> int:
+    """
+    Reconnaît le texte des pages scannées (sans texte mais avec des images) et le range dans le ParsedPdf.
+    Les résultats sont mis en cache par empreinte de l'image : un document renvoyé n'est pas réanalysé.
+    Retourne le nombre de pages complétées.
+    """
+    pending = {}
+    for index in range(pdf.page_count):
+        page = pdf.doc[index]
+        if pdf.page_text(index) or not page.get_images():
+            continue  # page avec texte, ou page blanche
+        pix = page.get_pixmap(dpi=PDF_OCR_DPI, colorspace=fitz.csGRAY)
+        digest = hashlib.sha256(pix.samples_mv).hexdigest()
+        key = ResultCache.make_key("ocr", PDF_OCR_LANGUAGE, PDF_OCR_DPI, digest)
+        cached = RESULT_CACHE.get(key)
+        if cached is not None:
+            OCR_STATS["cache"] += 1
+            pdf._page_texts[index] = cached
+        else:
+            pending[index] = (key, pix.tobytes("png"))
+    if not pending:
+        return 0
+
+    pool = get_ocr_pool()
+    futures = {
+        index: pool.submit(ocr_page_image, png, PDF_OCR_LANGUAGE, PDF_OCR_TESSDATA)
+        for index, (_, png) in pending.items()
+    }
+    deadline = time.monotonic() + PDF_OCR_TIMEOUT
+    completed = 0
+    for index, future in futures.items():
+        try:
+            text = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as e:  # Tesseract absent, délai dépassé... : la page reste sans texte
+            future.cancel()
+            OCR_STATS["erreurs"] += 1
+            logging.error(f"OCR de la page {index + 1} impossible : {type(e).__name__} {e}")
+            if isinstance(e, BrokenProcessPool):
+                shutdown_ocr_pool()  # recréé à la prochaine page scannée
+                break
+            continue
+        OCR_STATS["pages"] += 1
+        RESULT_CACHE.set(pending[index][0], text)
+        pdf._page_texts[index] = text
+        completed += 1
+    record_metric("pdf_pages_ocr", completed)
+    return completed
+
+# Expression régulière pour extraire différents formats d'ID de commande
+# Formats supportés : BSK, TAC, CMD, PO, BC, ORDER, REF, et formats numériques
+ORDER_ID_PATTERNS = [
+    r"\bBSK[A-Z0-9]{10}\b",  # Format BSK standard
+    r"\bTAC\s+[A-Z0-9]+\b",  # Format TAC (ex: TAC ETAC60JDF)
+    r"\b[A-Z]{2,4}[0-9]{6,12}\b",  # Format générique : 2-4 lettres + 6-12 chiffres
+    r"\b[A-Z]{2,4}[0-9]{3,4}[-]?[0-9]{3}\b",  # Format avec tiret (ex: BC2025-001)
+    r"\b[A-Z0-9]{8,15}\b",  # Format générique : 8-15 caractères alphanumériques
+    r"\b[0-9]{9,12}\b",  # Format numérique pur (ex: 212011016)
+    r"\b[A-Z0-9]{6,20}\b",  # Format très générique : 6-20 caractères alphanumériques
+    r"\b[A-Z]{2,6}[0-9]{4,10}\b",  # Format : 2-6 lettres + 4-10 chiffres
+    r"\b[A-Z0-9]{4,25}\b",  # Format ultra-générique : 4-25 caractères alphanumériques
+    r"\b[A-Z]{1,8}[0-9]{1,15}\b",  # Format : 1-8 lettres + 1-15 chiffres
+    r"\b[0-9]{4,20}\b"  # Format numérique étendu : 4-20 chiffres
+]
+
+# Formats spécifiques (BSK, TAC) : une correspondance suffit à arrêter la lecture des pages
+ORDER_ID_HIGH_PRIORITY = 2
+
+# Moteur de recherche d'ID compilé une seule fois : chaque famille de ORDER_ID_PATTERNS
+# est testée sur les mots en majuscules/chiffres repérés en un seul passage sur le texte.
+# Les familles 1 (TAC + identifiant) et 3 (tiret optionnel) portent sur deux mots consécutifs.
+_ORDER_ID_FAMILIES = [
+    re.compile(r"BSK[A-Z0-9]{10}"),
+    None,  # TAC : traité à part
+    re.compile(r"[A-Z]{2,4}[0-9]{6,12}"),
+    re.compile(r"[A-Z]{2,4}[0-9]{3,4}[0-9]{3}"),  # variante sans tiret ; avec tiret : traitée à part
+    re.compile(r"[A-Z0-9]{8,15}"),
+    re.compile(r"[0-9]{9,12}"),
+    re.compile(r"[A-Z0-9]{6,20}"),
+    re.compile(r"[A-Z]{2,6}[0-9]{4,10}"),
+    re.compile(r"[A-Z0-9]{4,25}"),
+    re.compile(r"[A-Z]{1,8}[0-9]{1,15}"),
+    re.compile(r"[0-9]{4,20}")
+]
+_ORDER_ID_DASH_PREFIX = re.compile(r"[A-Z]{2,4}[0-9]{3,4}")
+_ORDER_ID_DASH_SUFFIX = re.compile(r"[0-9]{3}")
+_ORDER_ID_SPACES = re.compile(r"\s+")
+
+# Un seul passage sur le texte : mots composés uniquement de majuscules et de chiffres
+_ORDER_ID_TOKENS = re.compile(r"\b[A-Z0-9]+\b")
+
+# Mots d'ancrage ("Commande", "BC", "N°"...), cherchés seulement juste avant un candidat
+_ORDER_ID_ANCHORS = re.compile(
+    r"(?i)(?:\bbon\s+de\s+commande|\bcommande|\bcmd|\bbc|\bnum(?:éro|ero)?|\bréf(?:érence)?|\bref(?:erence)?"
+    r"|\border|\bpo)\b|\bn°"
+)
+
+# Distance maximale (en caractères) entre un mot d'ancrage et l'ID qui le suit
+ORDER_ID_ANCHOR_WINDOW = 80
+
+OrderIdMatch = namedtuple("OrderIdMatch", "value priority start anchor_distance")
+
+def _anchor_distance(text: str, start: int):
+    """Distance entre le candidat et le dernier mot d'ancrage qui le précède dans la fenêtre"""
+    window_start = max(0, start - ORDER_ID_ANCHOR_WINDOW)
+    anchor_end = None
+    for anchor in _ORDER_ID_ANCHORS.finditer(text, window_start, start):
+        anchor_end = anchor.end()
+    return None if anchor_end is None else start - anchor_end
+
+def match_order_id(text: str):
+    """
+    Cherche l'ID de commande en un seul passage sur le texte.
+    La famille de format la plus prioritaire l'emporte ; à priorité égale,
+    on préfère l'ID le plus proche d'un mot d'ancrage, puis le premier du texte.
+    """
+    if not text:
+        return None
+    scan = _ORDER_ID_TOKENS.finditer(text)
+    following = next(scan, None)
+    best = None
+    while following is not None:
+        current = following
+        token, start, end = current.group(), current.start(), current.end()
+        # Le mot suivant n'est lu que pour les formats sur deux mots (TAC, tiret)
+        pair = token == "TAC" or _ORDER_ID_DASH_PREFIX.fullmatch(token) is not None
+        following = next(scan, None) if pair else None
+        gap = text[end:following.start()] if following else ""
+        priority = None
+        value = token
+        for index, family in enumerate(_ORDER_ID_FAMILIES):
+            if best is not None and index > best.priority:
+                break
+            if index == 1:
+                if token == "TAC" and following and _ORDER_ID_SPACES.fullmatch(gap):
+                    priority, value = index, text[start:following.end()]
+                    break
+            elif index == 3:
+                if family.fullmatch(token):
+                    priority = index
+                    break
+                if following and gap == "-" and _ORDER_ID_DASH_PREFIX.fullmatch(token) and _ORDER_ID_DASH_SUFFIX.fullmatch(following.group()):
+                    priority, value = index, text[start:following.end()]
+                    break
+            elif family.fullmatch(token):
+                priority = index
+                break
+        if priority is not None:
+            candidate = OrderIdMatch(value, priority, start, _anchor_distance(text, start))
+            if best is None or _order_id_rank(candidate) < _order_id_rank(best):
+                best = candidate
+            if best.priority == 0 and best.anchor_distance is not None:
+                break  # BSK annoncé par un mot d'ancrage : inutile de chercher plus loin
+        if not pair:
+            following = next(scan, None)
+    return best
+
+def _order_id_rank(match: OrderIdMatch):
+    return (
+        match.priority,
+        match.anchor_distance if match.anchor_distance is not None else float("inf"),
+        match.start
+    )
 
 # Fonction pour extraire l'ID de commande
-def extract_order_id_from_pdf(pdf_bytes: bytes):
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    all_text = []
-    for page in doc:
-        text = page.get_text("text").strip()  # Extraction du texte brut
-        if text:
-            all_text.append(text)
-    
-    # Combiner tout le texte extrait pour chercher l'ID de commande
-    full_text = "\n".join(all_text)
-    
-    # Expression régulière pour extraire différents formats d'ID de commande
-    # Formats supportés : BSK, TAC, CMD, PO, BC, ORDER, REF, et formats numériques
-    patterns = [
-        r"\bBSK[A-Z0-9]{10}\b",  # Format BSK standard
-        r"\bTAC\s+[A-Z0-9]+\b",  # Format TAC (ex: TAC ETAC60JDF)
-        r"\b[A-Z]{2,4}[0-9]{6,12}\b",  # Format générique : 2-4 lettres + 6-12 chiffres
-        r"\b[A-Z]{2,4}[0-9]{3,4}[-]?[0-9]{3}\b",  # Format avec tiret (ex: BC2025-001)
-        r"\b[A-Z0-9]{8,15}\b",  # Format générique : 8-15 caractères alphanumériques
-        r"\b[0-9]{9,12}\b",  # Format numérique pur (ex: 212011016)
-        r"\b[A-Z0-9]{6,20}\b",  # Format très générique : 6-20 caractères alphanumériques
-        r"\b[A-Z]{2,6}[0-9]{4,10}\b",  # Format : 2-6 lettres + 4-10 chiffres
-        r"\b[A-Z0-9]{4,25}\b",  # Format ultra-générique : 4-25 caractères alphanumériques
-        r"\b[A-Z]{1,8}[0-9]{1,15}\b",  # Format : 1-8 lettres + 1-15 chiffres
-        r"\b[0-9]{4,20}\b"  # Format numérique étendu : 4-20 chiffres
-    ]
-    
-    # Log pour debug
-    logging.info(f"Texte complet extrait du PDF: {full_text[:500]}...")
-    
-    for pattern in patterns:
-        match = re.search(pattern, full_text)
-        if match:
-            found_id = match.group(0)
-            logging.info(f"ID trouvé avec pattern {pattern}: {found_id}")
-            return found_id  # Retourne le premier ID trouvé
-    
+def extract_order_id_from_pdf(pdf):
+    pdf = _as_parsed_pdf(pdf)
+    best = None
+    best_page = None
+
+    # Lecture page par page : on s'arrête à la première page contenant un format prioritaire
+    for index, text in pdf.iter_page_texts():
+        match = match_order_id(text)
+        if match is None:
+            continue
+        if match.priority < ORDER_ID_HIGH_PRIORITY:
+            logging.info(f"ID trouvé (famille {match.priority}, page {index + 1}/{pdf.page_count}): {match.value}")
+            return match.value
+        if best is None or _order_id_rank(match)[:2] < _order_id_rank(best)[:2]:
+            best, best_page = match, index
+
+    if best is not None:
+        logging.info(f"ID trouvé (famille {best.priority}, page {best_page + 1}/{pdf.page_count}): {best.value}")
+        return best.value  # Retourne le meilleur ID trouvé
+
     logging.warning("Aucun ID de commande trouvé dans le PDF")
     return None  # Aucun ID trouvé
 
-# Fonction intelligente pour extraire les dates de livraison dans tous les formats
-def extract_delivery_date_intelligent(text):
+# Extraction des dates de livraison : toutes les expressions sont compilées une fois à l'import.
+# Chaque date candidate est repérée en un seul passage, puis le contexte (mots-clés de livraison)
+# est vérifié seulement dans une fenêtre bornée avant la date : le temps reste linéaire
+# même sur de longs PDF, sans les retours arrière des anciens motifs ".*?".
+DATE_CANDIDATE_RE = re.compile(r"\d{1,2}[/-]\d{1,2}[/-]\d{2,4}")  # Format DD/MM/YYYY ou DD/MM/YY
+
+# Mois français, noms complets et abréviations usuelles, avec ou sans accents
+FRENCH_MONTHS = {
+    "janvier": 1, "janv": 1, "jan": 1,
+    "février": 2, "fevrier": 2, "févr": 2, "fevr": 2, "fév": 2, "fev": 2,
+    "mars": 3, "mar": 3,
+    "avril": 4, "avr": 4,
+    "mai": 5,
+    "juin": 6, "jun": 6,
+    "juillet": 7, "juil": 7, "jul": 7,
+    "août": 8, "aout": 8, "aoû": 8,
+    "septembre": 9, "sept": 9, "sep": 9,
+    "octobre": 10, "oct": 10,
+    "novembre": 11, "nov": 11,
+    "décembre": 12, "decembre": 12, "déc": 12, "dec": 12,
+}
+_MONTH_ALTERNATION = "|".join(sorted(FRENCH_MONTHS, key=len, reverse=True))
+DATE_MONTH_NAME_RE = re.compile(
+    rf"\d{{1,2}}(?:er)?\s+(?:{_MONTH_ALTERNATION})\.?\s+\d{{4}}",  # « 12 octobre 2025 », « 1er oct. 2025 »
+    re.IGNORECASE
+)
+_NUMERIC_DATE_RE = re.compile(r"(\d{1,2})([/-])(\d{1,2})([/-])(\d{2,4})")
+_ISO_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+_MONTH_NAME_DATE_RE = re.compile(rf"(\d{{1,2}})(?:er)?\s+({_MONTH_ALTERNATION})\.?\s+(\d{{4}})", re.IGNORECASE)
+DATE_CACHE_SIZE = int(os.getenv("DATE_CACHE_SIZE", "4096"))
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(date_str: str, mixed_separators: bool = True):
     """
-    Fonction intelligente qui analyse le texte pour extraire les dates de livraison
-    dans tous les formats possibles, y compris les phrases contextuelles complexes.
+    Date française en datetime, None si elle est invalide (31/02, mois 13...) : DD/MM/YY(YY), DD-MM-YY(YY)
+    (séparateurs mélangés seulement si `mixed_separators`), YYYY-MM-DD, « 12 octobre 2025 », « 1er oct. 2025 ».
+    Les années sur deux chiffres sont du XXIe siècle. dateutil ne sert qu'aux formes non reconnues.
     """
-    if not text:
+    date_str = date_str.strip()
+    match = _NUMERIC_DATE_RE.fullmatch(date_str)
+    if match:
+        day, first, month, second, year = match.groups()
+        if first != second and not mixed_separators:
+            return None
+        year_value = int(year) + 2000 if len(year) == 2 else int(year)
+        return _build_date(year_value, int(month), int(day))
+    match = _ISO_DATE_RE.fullmatch(date_str)
+    if match:
+        year, month, day = match.groups()
+        return _build_date(int(year), int(month), int(day))
+    match = _MONTH_NAME_DATE_RE.fullmatch(date_str)
+    if match:
+        day, month, year = match.groups()
+        return _build_date(int(year), FRENCH_MONTHS[month.lower()], int(day))
+    try:
+        return dateutil_parser.parse(date_str, dayfirst=True)
+    except (ValueError, OverflowError):
         return None
-    
+
+def _build_date(year: int, month: int, day: int):
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def normalize_date(date_str: str, mixed_separators: bool = True):
+    """Date au format DD/MM/YYYY renvoyé par l'API, None si elle est invalide"""
+    parsed = parse_date(date_str, mixed_separators)
+    return parsed.strftime('%d/%m/%Y') if parsed else None
+
+# Taille maximale (en caractères) du contexte examiné avant une date candidate
+DELIVERY_CONTEXT_WINDOW = 200
+
+# Liaison entre deux éléments d'une phrase : même ligne (".*?"), espaces ("\s*") ou au moins un espace ("\s+")
+_SAME_LINE, _SPACES, _SPACES_REQUIRED = "ligne", "espaces", "espaces+"
+
+class _Keyword:
+    """Mot-clé à plusieurs variantes, cherché librement ou juste avant une position donnée"""
+
+    def __init__(self, *variants):
+        self.any = re.compile("|".join(variants))
+        self.ending = [re.compile(f"(?:{variant})$") for variant in variants]
+
+    def starts_ending_at(self, text, lo, end):
+        """Débuts possibles d'une occurrence finissant exactement en `end`"""
+        starts = set()
+        for variant in self.ending:
+            match = variant.search(text, max(lo, end - 32), end)
+            if match:
+                starts.add(match.start())
+        return sorted(starts, reverse=True)
+
+    def starts_before(self, text, lo, end):
+        """Débuts des occurrences comprises dans text[lo:end], de la plus proche à la plus lointaine"""
+        return [m.start() for m in self.any.finditer(text, lo, end)][::-1]
+
+_KW_NEGATIVE = _Keyword("ne sera pas", "pas de", "impossible de", "ne pourra pas")
+_KW_LIVR = _Keyword("livr[ée]*")
+_KW_DELIVERY = _Keyword("livraison", "livr[ée]*")
+_KW_BEFORE = _Keyword("avant le", "avant", "le")
+_KW_POSTPONED = _Keyword("reportée", "repoussée", "décalée")
+_KW_AT = _Keyword("au", "le", "pour le")
+_KW_DELAY = _Keyword("délai", "retard")
+_KW_PLANNED = _Keyword("prévue", "estimée", "planifiée")
+_KW_AVAILABLE = _Keyword("disponible", "prêt")
+_KW_ORDER = _Keyword("commande", "colis")
+_KW_SHIPPED = _Keyword("livr[ée]*", "expédi[ée]*")
+_KW_FORECAST = _Keyword("prévu", "estimé", "planifié")
+_KW_AROUND = _Keyword("dans", "en", "vers", "autour de")
+_KW_PERIOD = _Keyword("fin", "début", "mi")
+_KW_WEEK = _Keyword("semaine", "mois")
+_KW_NEXT = _Keyword("prochaine", "suivante")
+
+# Phrases de livraison, par ordre de priorité : suite de (mot-clé, liaison avec l'élément suivant)
+DELIVERY_PHRASES = [
+    # Phrases négatives avec dates
+    [(_KW_NEGATIVE, _SAME_LINE), (_KW_LIVR, _SAME_LINE), (_KW_BEFORE, _SPACES)],
+    [(_KW_DELIVERY, _SAME_LINE), (_KW_POSTPONED, _SAME_LINE), (_KW_AT, _SPACES)],
+    [(_KW_DELAY, _SAME_LINE), (_KW_DELIVERY, _SAME_LINE)],
+
+    # Phrases positives avec dates
+    [(_KW_DELIVERY, _SAME_LINE), (_KW_PLANNED, _SAME_LINE), (_KW_AT, _SPACES)],
+    [(_KW_AVAILABLE, _SAME_LINE), (_KW_AT, _SPACES)],
+    [(_KW_ORDER, _SAME_LINE), (_KW_SHIPPED, _SAME_LINE), (_KW_AT, _SPACES)],
+
+    # Formats abrégés
+    [(_KW_DELIVERY, _SPACES_REQUIRED), (_KW_AT, _SPACES)],
+    [(_KW_FORECAST, _SAME_LINE), (_KW_AT, _SPACES)],
+
+    # Phrases avec contexte temporel
+    [(_KW_AROUND, _SPACES)],
+    [(_KW_PERIOD, _SAME_LINE), (_KW_WEEK, _SAME_LINE)],
+
+    # Formats avec mots-clés temporels
+    [(_KW_WEEK, _SAME_LINE)],
+    [(_KW_NEXT, _SAME_LINE)]
+]
+# Les premières phrases nomment la livraison ; les suivantes (contexte temporel) sont des indices faibles
+DELIVERY_EXPLICIT_PHRASES = 8
+
+def _phrase_precedes(text, phrase, step, end, lo):
+    """
+    Vérifie que les éléments phrase[:step + 1] apparaissent avant la position `end`,
+    le dernier étant relié à `end` par sa liaison. Recherche de droite à gauche, bornée par `lo`.
+    """
+    keyword, link = phrase[step]
+    if link == _SAME_LINE:
+        line_start = text.rfind("\n", lo, end) + 1
+        starts = keyword.starts_before(text, max(lo, line_start), end)
+    else:
+        keyword_end = end
+        while keyword_end > lo and text[keyword_end - 1].isspace():
+            keyword_end -= 1
+        if link == _SPACES_REQUIRED and keyword_end == end:
+            return None
+        starts = keyword.starts_ending_at(text, lo, keyword_end)
+    for start in starts:
+        if step == 0 or _phrase_precedes(text, phrase, step - 1, start, lo) is not None:
+            return start
+    return None
+
+def _find_delivery_date(text):
+    """
+    Retourne (date, origine, phrase) : origine vaut "contexte" si la date suit une phrase de livraison,
+    dont phrase est l'indice dans DELIVERY_PHRASES, "repli" si c'est seulement la date la plus récente du texte.
+    """
+    if not text:
+        return None, None, None
+
     text_lower = text.lower()
-    
-    # Patterns pour détecter les phrases de livraison
-    delivery_patterns = [
-        # Phrases négatives avec dates
-        r"(?:ne sera pas|pas de|impossible de|ne pourra pas).*?livr[ée]*.*?(?:avant le|avant|le)\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        r"(?:livraison|livr[ée]*).*?(?:reportée|repoussée|décalée).*?(?:au|le|pour le)\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        r"(?:délai|retard).*?(?:livraison|livr[ée]*).*?(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        
-        # Phrases positives avec dates
-        r"(?:livraison|livr[ée]*).*?(?:prévue|estimée|planifiée).*?(?:le|pour le|au)\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        r"(?:disponible|prêt).*?(?:le|pour le|au)\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        r"(?:commande|colis).*?(?:livr[ée]*|expédi[ée]*).*?(?:le|pour le|au)\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        
-        # Formats abrégés
-        r"(?:livraison|livr[ée]*)\s+(?:le|pour le|au)\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        r"(?:prévu|estimé|planifié).*?(?:pour le|le|au)\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        
-        # Phrases avec contexte temporel
-        r"(?:dans|en|vers|autour de)\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        r"(?:fin|début|mi).*?(?:semaine|mois).*?(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        
-        # Formats avec mots-clés temporels
-        r"(?:semaine|mois).*?(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        r"(?:prochaine|suivante).*?(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})"
-    ]
-    
-    # Chercher d'abord les patterns de livraison
-    for pattern in delivery_patterns:
-        matches = re.findall(pattern, text_lower, re.IGNORECASE)
-        if matches:
-            for match in matches:
-                try:
-                    # Nettoyer et parser la date
-                    date_str = match.strip()
-                    if '/' in date_str:
-                        # Format français DD/MM/YYYY ou DD/MM/YY
-                        parts = date_str.split('/')
-                        if len(parts) == 3:
-                            day, month, year = parts
-                            if len(year) == 2:
-                                year = '20' + year
-                            parsed_date = datetime(int(year), int(month), int(day))
-                            return parsed_date.strftime('%d/%m/%Y')
-                    elif '-' in date_str:
-                        # Format avec tirets
-                        parts = date_str.split('-')
-                        if len(parts) == 3:
-                            day, month, year = parts
-                            if len(year) == 2:
-                                year = '20' + year
-                            parsed_date = datetime(int(year), int(month), int(day))
-                            return parsed_date.strftime('%d/%m/%Y')
-                except:
-                    continue
-    
-    # Si aucun pattern de livraison trouvé, chercher toutes les dates dans le texte
-    date_patterns = [
-        r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',  # Format DD/MM/YYYY ou DD/MM/YY
-        r'(\d{1,2}\s+(?:janvier|février|mars|avril|mai|juin|juillet|août|septembre|octobre|novembre|décembre)\s+\d{4})',  # Format français
-        r'(\d{1,2}\s+(?:jan|fév|mar|avr|mai|jun|jul|aoû|sep|oct|nov|déc)\s+\d{4})',  # Format français abrégé
-    ]
-    
-    all_dates = []
-    for pattern in date_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
-            try:
-                if '/' in match or '-' in match:
-                    # Format numérique
-                    date_str = match.replace('-', '/')
-                    parts = date_str.split('/')
-                    if len(parts) == 3:
-                        day, month, year = parts
-                        if len(year) == 2:
-                            year = '20' + year
-                        parsed_date = datetime(int(year), int(month), int(day))
-                        all_dates.append((parsed_date, match))
-                else:
-                    # Format français
-                    try:
-                        parsed_date = dateutil.parser.parse(match, dayfirst=True, fuzzy=True)
-                        all_dates.append((parsed_date, match))
-                    except:
-                        continue
-            except:
+    candidates = list(DATE_CANDIDATE_RE.finditer(text_lower))
+
+    # Chercher d'abord les phrases de livraison
+    for index, phrase in enumerate(DELIVERY_PHRASES):
+        consumed = 0  # comme re.findall : les correspondances ne se chevauchent pas
+        for candidate in candidates:
+            lo = max(consumed, candidate.start() - DELIVERY_CONTEXT_WINDOW)
+            last = len(phrase) - 1
+            if _phrase_precedes(text_lower, phrase, last, candidate.start(), lo) is None:
                 continue
-    
+            consumed = candidate.end()
+            delivery_date = normalize_date(candidate.group(), mixed_separators=False)
+            if delivery_date:
+                return delivery_date, "contexte", index
+
+    # Si aucune phrase de livraison trouvée, chercher toutes les dates dans le texte
+    all_dates = []
+    for match in itertools.chain(candidates, DATE_MONTH_NAME_RE.finditer(text)):
+        parsed_date = parse_date(match.group())
+        if parsed_date:
+            all_dates.append(parsed_date)
+
     # Si on a trouvé des dates, retourner la plus récente (probablement la date de livraison)
     if all_dates:
-        # Trier par date et prendre la plus récente
-        all_dates.sort(key=lambda x: x[0])
-        most_recent = all_dates[-1]
-        
-        # Vérifier si c'est une date future (probablement une date de livraison)
-        if most_recent[0] > datetime.now():
-            return most_recent[0].strftime('%d/%m/%Y')
-        else:
-            # Si pas de date future, retourner la plus récente trouvée
-            return most_recent[0].strftime('%d/%m/%Y')
-    
-    return None
+        return max(all_dates).strftime('%d/%m/%Y'), "repli", None
+
+    return None, None, None
+
+# Fonction intelligente pour extraire les dates de livraison dans tous les formats
+def extract_delivery_date_intelligent(text):
+    """
+    Fonction intelligente qui analyse le texte pour extraire les dates de livraison
+    dans tous les formats possibles, y compris les phrases contextuelles complexes.
+    """
+    return _find_delivery_date(text)[0]
 
 # Fonction pour améliorer l'extraction des informations avec post-traitement
 def enhance_extraction_with_intelligence(openai_result, original_text):
@@ -272,6 +1516,7 @@ def enhance_extraction_with_intelligence(openai_result, original_text):
             try:
                 parsed_result = json.loads(openai_result)
             except:
+                OUTPUT_STATS[_output_mode()]["echecs_json"] += 1
                 # Si ce n'est pas du JSON valide, essayer de l'extraire
                 parsed_result = extract_info_from_text(openai_result)
         else:
@@ -308,81 +1553,1046 @@ def extract_info_from_text(text):
     
     return result
 
+# Annuaire des fournisseurs : adresse d'expéditeur, domaine ou alias -> nom canonique, sans OpenAI
+SUPPLIER_DIRECTORY = os.getenv("SUPPLIER_DIRECTORY", "")  # fichier .csv ou .json
+SUPPLIER_REFRESH_INTERVAL = float(os.getenv("SUPPLIER_REFRESH_INTERVAL", "30"))  # secondes entre deux contrôles
+SUPPLIER_FUZZY_THRESHOLD = float(os.getenv("SUPPLIER_FUZZY_THRESHOLD", "0.75"))
+# Domaines de messagerie grand public : ils n'identifient pas un fournisseur
+PUBLIC_EMAIL_DOMAINS = frozenset(
+    os.getenv("PUBLIC_EMAIL_DOMAINS", "gmail.com,outlook.com,hotmail.com,hotmail.fr,yahoo.com,yahoo.fr,live.fr").split(",")
+)
+LEGAL_FORMS = frozenset({"sarl", "sa", "sas", "sasu", "eurl", "ste", "societe", "ets", "etablissements", "cie"})
+SupplierMatch = namedtuple("SupplierMatch", "name confidence source")
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+def normalize_supplier_name(name: str) -> str:
+    """Minuscules sans accents ni ponctuation, formes juridiques retirées"""
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(word for word in _NON_ALNUM_RE.sub(" ", text).split() if word not in LEGAL_FORMS)
+
+def _trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SupplierDirectory:
+    """
+    Index construit une fois au chargement : dictionnaires pour les adresses, domaines et alias exacts,
+    index de trigrammes pour la correspondance approchée des noms.
+    Fichier CSV (colonnes nom, emails, domaines, alias ; listes séparées par « | »)
+    ou JSON (liste d'objets avec les mêmes clés, listes en tableaux).
+    """
+
+    def __init__(self, entries: list):
+        self.by_email = {}
+        self.by_domain = {}
+        self.by_alias = {}
+        self._alias_trigrams = {}
+        self._index = {}
+        self.suppliers = 0
+        for entry in entries:
+            name = (entry.get("nom") or "").strip()
+            if not name:
+                continue
+            self.suppliers += 1
+            for address in entry.get("emails") or []:
+                self.by_email[address.strip().lower()] = name
+            for domain in entry.get("domaines") or []:
+                self.by_domain[domain.strip().lower().lstrip("@")] = name
+            for alias in [name, *(entry.get("alias") or [])]:
+                key = normalize_supplier_name(alias)
+                if key and key not in self.by_alias:
+                    self.by_alias[key] = name
+                    grams = _trigrams(key)
+                    self._alias_trigrams[key] = len(grams)
+                    for gram in grams:
+                        self._index.setdefault(gram, []).append(key)
+
+    @classmethod
+    def from_file(cls, path: str) -> "SupplierDirectory":
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            if path.lower().endswith(".json"):
+                return cls(json.load(f))
+            entries = []
+            for row in csv.DictReader(f):
+                entry = {"nom": row.get("nom")}
+                for column in ("emails", "domaines", "alias"):
+                    entry[column] = [value for value in (row.get(column) or "").split("|") if value.strip()]
+                entries.append(entry)
+            return cls(entries)
+
+    def resolve_address(self, address: str):
+        address = address.strip().lower()
+        if address in self.by_email:
+            return SupplierMatch(self.by_email[address], 0.99, "email")
+        domain = address.rpartition("@")[2]
+        while domain and domain not in PUBLIC_EMAIL_DOMAINS:
+            if domain in self.by_domain:
+                return SupplierMatch(self.by_domain[domain], 0.95, "domaine")
+            domain = domain.partition(".")[2]  # sous-domaine : mail.ajdir.ma -> ajdir.ma
+        return None
+
+    def resolve_name(self, name: str):
+        key = normalize_supplier_name(name)
+        if not key:
+            return None
+        if key in self.by_alias:
+            return SupplierMatch(self.by_alias[key], 0.95, "alias")
+        # Coefficient de Dice sur les trigrammes, candidats limités aux alias partageant un trigramme
+        grams = _trigrams(key)
+        shared = Counter(candidate for gram in grams for candidate in self._index.get(gram, ()))
+        best_key, best_score = None, 0.0
+        for candidate, common in shared.items():
+            score = 2 * common / (len(grams) + self._alias_trigrams[candidate])
+            if score > best_score:
+                best_key, best_score = candidate, score
+        if best_key is not None and best_score >= SUPPLIER_FUZZY_THRESHOLD:
+            return SupplierMatch(self.by_alias[best_key], round(0.95 * best_score, 3), "approche")
+        return None
+
+    def resolve(self, value: str):
+        """Adresse email (exacte puis domaine) ou nom (alias exact puis approché)"""
+        if not value:
+            return None
+        return self.resolve_address(value) if "@" in value else self.resolve_name(value)
+
+    def stats(self) -> dict:
+        return {"fournisseurs": self.suppliers, "emails": len(self.by_email),
+                "domaines": len(self.by_domain), "alias": len(self.by_alias)}
+
+_supplier_directory = None
+_supplier_directory_mtime = None
+_supplier_directory_checked = 0.0
+_supplier_directory_lock = threading.Lock()
+
+def get_supplier_directory():
+    """Annuaire courant, rechargé si le fichier a changé (contrôle au plus tous les SUPPLIER_REFRESH_INTERVAL s)"""
+    global _supplier_directory, _supplier_directory_mtime, _supplier_directory_checked
+    if not SUPPLIER_DIRECTORY:
+        return None
+    now = time.monotonic()
+    if _supplier_directory is not None and now - _supplier_directory_checked < SUPPLIER_REFRESH_INTERVAL:
+        return _supplier_directory
+    with _supplier_directory_lock:
+        _supplier_directory_checked = now
+        try:
+            mtime = os.stat(SUPPLIER_DIRECTORY).st_mtime_ns
+            if mtime != _supplier_directory_mtime:
+                _supplier_directory = SupplierDirectory.from_file(SUPPLIER_DIRECTORY)
+                _supplier_directory_mtime = mtime
+                logging.info(f"Annuaire fournisseurs chargé : {_supplier_directory.stats()}")
+        except (OSError, ValueError, csv.Error) as e:
+            # Fichier absent ou invalide : on garde la dernière version chargée
+            logging.error(f"Annuaire fournisseurs illisible ({SUPPLIER_DIRECTORY}) : {str(e)}")
+        return _supplier_directory
+
+def resolve_supplier(value: str):
+    directory = get_supplier_directory()
+    return directory.resolve(value) if directory is not None else None
+
+# Chargé au démarrage plutôt qu'à la première requête
+get_supplier_directory()
+
+# Extraction déterministe (regex) avec un score de confiance par champ.
+# OpenAI n'est interrogé que pour les champs absents ou trop incertains.
+DETERMINISTIC_TIER = os.getenv("DETERMINISTIC_TIER", "1") == "1"
+DETERMINISTIC_CONFIDENCE = float(os.getenv("DETERMINISTIC_CONFIDENCE", "0.8"))
+
+SUPPLIER_LINE_RE = re.compile(r"Fournisseur\s*:[ \t]*(\S[^\n]*)")
+RECEPTION_DATE_RE = re.compile(
+    r"date\s+(?:de\s+)?(?:réception|reception|commande)\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
+    re.IGNORECASE
+)
+
+DETERMINISTIC_STATS = {
+    "analyses": 0,
+    "sans_llm": 0,
+    "champs_demandes_llm": 0
+}
+
+def _order_id_confidence(match: OrderIdMatch) -> float:
+    if match.priority < ORDER_ID_HIGH_PRIORITY:
+        return 0.95  # BSK, TAC : formats propres à nos fournisseurs
+    if match.anchor_distance is not None:
+        return 0.9 if match.priority <= 3 else 0.6
+    return 0.5 if match.priority <= 3 else 0.2
+
+def deterministic_extraction(text: str) -> dict:
+    """
+    Extrait les quatre champs sans OpenAI.
+    Retourne {champ: (valeur, confiance)} avec une confiance entre 0 et 1.
+    """
+    fields = {field: (None, 0.0) for field in EXTRACTION_FIELDS}
+    if not text:
+        return fields
+
+    match = match_order_id(text)
+    if match:
+        fields["ID_commande"] = (match.value, _order_id_confidence(match))
+
+    supplier = SUPPLIER_LINE_RE.search(text)
+    if supplier:
+        name = supplier.group(1).strip()
+        resolved = resolve_supplier(name)
+        if resolved:
+            fields["nom_fournisseur"] = (resolved.name, resolved.confidence)
+        else:
+            # L'adresse de l'expéditeur (ajoutée faute de mieux) ne donne pas le nom du fournisseur
+            fields["nom_fournisseur"] = (name, 0.3 if "@" in name else 0.9)
+
+    reception = RECEPTION_DATE_RE.search(text)
+    if reception:
+        reception_date = normalize_date(reception.group(1), mixed_separators=False)
+        if reception_date:
+            fields["date_reception"] = (reception_date, 0.85)
+
+    delivery_date, origin, phrase = _find_delivery_date(text)
+    if delivery_date:
+        if origin == "repli":
+            confidence = 0.4
+        elif phrase < DELIVERY_EXPLICIT_PHRASES:
+            confidence = 0.9
+        else:
+            confidence = 0.6  # « en », « semaine », « prochaine »... : la date est confirmée par OpenAI
+        fields["date_livraison"] = (delivery_date, confidence)
+
+    return fields
+
+def _deterministic_stats() -> dict:
+    analyses = DETERMINISTIC_STATS["analyses"]
+    return {
+        **DETERMINISTIC_STATS,
+        "part_sans_llm": round(DETERMINISTIC_STATS["sans_llm"] / analyses, 4) if analyses else 0.0
+    }
+
+# Assemblage du prompt avec un budget de tokens : pour les gros PDF (catalogues, annexes CGV),
+# on garde les pages les plus utiles à l'extraction et on écarte les pages de conditions générales.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+CHARS_PER_TOKEN = 4  # estimation moyenne pour du texte français
+PROMPT_EMAIL_SHARE = 0.5  # part maximale du budget laissée à l'email quand un PDF l'accompagne
+PDF_PAGE_MIN_TOKENS = 100  # la meilleure page est toujours gardée, tronquée au besoin à ce minimum
+
+PAGE_KEYWORDS_RE = re.compile(
+    r"commande|livraison|livr[ée]|fournisseur|réception|date|délai|référence|\bbc\b|n°",
+    re.IGNORECASE
+)
+PAGE_BOILERPLATE_RE = re.compile(
+    r"conditions\s+générales|\bcgv\b|mentions\s+légales|clause|tribunal|pénalités|propriété\s+intellectuelle"
+    r"|\barticle\s+\d+",
+    re.IGNORECASE
+)
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def score_pdf_page(index: int, text: str) -> float:
+    """Pertinence d'une page pour l'extraction : mots-clés, dates et ID de commande, moins le texte juridique"""
+    score = 3 * len(PAGE_KEYWORDS_RE.findall(text)) + 4 * len(DATE_CANDIDATE_RE.findall(text))
+    match = match_order_id(text)
+    if match and match.priority <= 3:
+        score += 20 if match.priority < ORDER_ID_HIGH_PRIORITY else 10
+    score -= 3 * len(PAGE_BOILERPLATE_RE.findall(text))
+    if index == 0:
+        score += 5  # l'en-tête du BC est presque toujours en première page
+    return score
+
+def select_pdf_pages(pdf: ParsedPdf, budget: int):
+    """
+    Retourne (texte, pages gardées, pages écartées) en respectant le budget de tokens.
+    Les pages gardées restent dans l'ordre du document.
+    """
+    pages = list(pdf.iter_page_texts())
+    if sum(estimate_tokens(text) for _, text in pages) + len(pages) <= budget:
+        return "\n".join(text for _, text in pages), [index for index, _ in pages], []
+
+    scores = {index: score_pdf_page(index, text) for index, text in pages}  # un seul calcul par page
+    ranked = sorted(pages, key=lambda page: scores[page[0]], reverse=True)
+    kept = {}
+    remaining = budget
+    for index, text in ranked:
+        tokens = estimate_tokens(text) + 1
+        if tokens <= remaining and (scores[index] > 0 or not kept):
+            kept[index] = text
+            remaining -= tokens
+    if not kept and ranked:
+        index, text = ranked[0]
+        kept[index] = text[:max(budget, PDF_PAGE_MIN_TOKENS) * CHARS_PER_TOKEN]  # page la plus pertinente, tronquée
+    dropped = [index for index, _ in pages if index not in kept]
+    return "\n".join(kept[index] for index in sorted(kept)), sorted(kept), dropped
+
+def build_prompt_content(email_text: str, pdf=None, budget: int = None):
+    """
+    Assemble l'email et le texte du PDF (ou d'une liste de PDF) dans la limite du budget de tokens.
+    Retourne (contenu, statistiques) ; les tokens envoyés et écartés sont journalisés.
+    """
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    email_text = email_text or ""
+    pdfs = [pdf] if isinstance(pdf, ParsedPdf) else list(pdf or ())
+    # Un long fil de discussion ne doit pas évincer les pages du PDF (ID de commande, dates)
+    email_budget = budget
+    if any(next(document.iter_page_texts(), None) for document in pdfs):
+        email_budget = int(budget * PROMPT_EMAIL_SHARE)
+    email_tokens = estimate_tokens(email_text)
+    if email_tokens > email_budget:
+        email_text = email_text[:email_budget * CHARS_PER_TOKEN]  # le message le plus récent est en tête
+
+    pdf_texts, kept, dropped = [], [], []
+    dropped_tokens = max(0, email_tokens - email_budget)
+    remaining = max(0, budget - estimate_tokens(email_text) - 10)
+    for position, document in enumerate(pdfs):
+        # Budget restant partagé entre les PDF qui suivent ; la part inutilisée passe aux suivants
+        if position:
+            remaining = max(0, remaining - 10)  # en-tête de la pièce jointe
+        text, document_kept, document_dropped = select_pdf_pages(document, remaining // (len(pdfs) - position))
+        remaining -= estimate_tokens(text)
+        dropped_tokens += max(0, estimate_tokens(document.full_text) - estimate_tokens(text))
+        kept += document_kept
+        dropped += document_dropped
+        if text:
+            pdf_texts.append(text)
+    pdf_text = "\n\nPIECE_JOINTE_PDF:\n".join(pdf_texts)
+
+    # Si un email et un PDF sont fournis, combinez-les
+    if email_text and pdf_text:
+        user_content = f"EMAIL:\n{email_text}\n\nPIECE_JOINTE_PDF:\n{pdf_text}"
+    else:
+        user_content = email_text or pdf_text
+
+    stats = {
+        "tokens_envoyes": estimate_tokens(user_content),
+        "tokens_ecartes": dropped_tokens,
+        "pages_gardees": len(kept),
+        "pages_ecartees": len(dropped)
+    }
+    logging.info(
+        f"Prompt : {stats['tokens_envoyes']} tokens envoyés, {stats['tokens_ecartes']} tokens écartés "
+        f"(pages PDF gardées : {stats['pages_gardees']}, écartées : {stats['pages_ecartees']})"
+    )
+    return user_content, stats
+
+# Fils de discussion : seuls le dernier message et les messages cités encore jamais analysés
+# pour cette conversation sont envoyés à OpenAI (et parcourus par les regex)
+THREAD_DEDUP = os.getenv("THREAD_DEDUP", "0") == "1"
+THREAD_MAX_SEGMENTS = 500  # empreintes gardées par conversation
+THREAD_MEMORY_SIZE = int(os.getenv("THREAD_MEMORY_SIZE", "2048"))  # conversations gardées par worker
+THREAD_MEMORY_TTL = float(os.getenv("THREAD_MEMORY_TTL", str(7 * 24 * 3600)))
+
+# Début d'un message cité : « Le ... a écrit : », « On ... wrote: », séparateurs Outlook, en-têtes De/Envoyé
+THREAD_HEADER_RE = re.compile(
+    r"^[ \t>]*(?:"
+    r"Le [^\n]{1,200}?(?:\n[^\n]{0,200}?)?a\s+écrit\s*:"
+    r"|On [^\n]{1,200}?(?:\n[^\n]{0,200}?)?wrote\s*:"
+    r"|-{2,}\s*(?:Message d'origine|Original Message|Message transféré|Forwarded message)\s*-{2,}"
+    r"|(?:De|From)\s?:[^\n]*\n(?:[ \t>]*[^\n]*\n){0,3}?[ \t>]*(?:Envoyé|Sent|Date)\s?:"
+    r")",
+    re.MULTILINE | re.IGNORECASE
+)
+_QUOTE_PREFIX_RE = re.compile(r"^[ \t]*>+[ \t]?", re.MULTILINE)
+_SUBJECT_PREFIX_RE = re.compile(r"^\s*(?:(?:re|tr|fw|fwd|réf)\s*:\s*)+", re.IGNORECASE)
+
+# Mémoire des conversations, à part du cache des résultats : les réponses OpenAI et l'OCR ne l'évincent pas
+THREAD_MEMORY = ResultCache(THREAD_MEMORY_SIZE, THREAD_MEMORY_TTL)
+THREAD_STATS = {"emails": 0, "segments": 0, "segments_ecartes": 0, "caracteres_ecartes": 0}
+
+def split_email_thread(text: str) -> list:
+    """Découpe un email en messages, du plus récent (la réponse) au plus ancien (les citations)"""
+    starts, previous_end = [], 0
+    for match in THREAD_HEADER_RE.finditer(text):
+        # Un en-tête qui suit directement le précédent (séparateur Outlook puis De/Envoyé) ouvre le même message
+        if text[previous_end:match.start()].strip() or not starts:
+            starts.append(match.start())
+        previous_end = match.end()
+    bounds = [0, *[start for start in starts if start > 0], len(text)]
+    segments = (text[begin:end].strip() for begin, end in zip(bounds, bounds[1:]))
+    return [segment for segment in segments if segment]
+
+def _segment_hash(segment: str) -> str:
+    """
+    Empreinte du corps du message, sans ses en-têtes de citation (qui changent selon le client de messagerie
+    qui cite) et indépendante des chevrons, des retours à la ligne et de la casse
+    """
+    while (header := THREAD_HEADER_RE.match(segment)):
+        segment = segment[header.end():]
+    normalized = " ".join(_QUOTE_PREFIX_RE.sub("", segment).split()).lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:24]
+
+def conversation_key(req_body: dict, sender_email: str):
+    """Identifiant de conversation fourni par Power Automate, sinon le sujet sans RE:/TR:"""
+    conversation = req_body.get("conversation_id") or _SUBJECT_PREFIX_RE.sub("", req_body.get("subject") or "").strip()
+    if not conversation:
+        return None
+    return ResultCache.make_key("fil", sender_email.lower(), conversation)
+
+def strip_email_thread(text: str, conversation: str = None) -> str:
+    """
+    Garde le message le plus récent et les messages cités jamais vus : ni dans ce même email
+    (historique recopié plusieurs fois), ni dans les emails déjà analysés de la conversation.
+    """
+    segments = split_email_thread(text)
+    if len(segments) <= 1 and not conversation:
+        return text
+    # Empreintes des segments par email de la conversation : un renvoi identique (reprise Power Automate)
+    # ne voit pas ses propres citations comme déjà analysées, et donne le même prompt
+    email_key = ResultCache.make_key("email", text)
+    history = (THREAD_MEMORY.get(conversation) or {}) if conversation else {}
+    seen = {digest for key, digests in history.items() if key != email_key for digest in digests}
+    kept, hashes = [], []
+    for position, segment in enumerate(segments):
+        digest = _segment_hash(segment)
+        if position == 0 or digest not in seen:
+            kept.append(segment)
+        seen.add(digest)
+        hashes.append(digest)
+    if conversation:
+        history = {key: digests for key, digests in history.items() if key != email_key}
+        history[email_key] = hashes
+        # Au-delà de THREAD_MAX_SEGMENTS empreintes, les emails les plus anciens sont oubliés
+        while len(history) > 1 and sum(map(len, history.values())) > THREAD_MAX_SEGMENTS:
+            del history[next(iter(history))]
+        THREAD_MEMORY.set(conversation, history)
+
+    # Rien d'écarté : le texte est rendu tel quel
+    result = text if len(kept) == len(segments) else "\n\n".join(kept)
+    THREAD_STATS["emails"] += 1
+    THREAD_STATS["segments"] += len(segments)
+    THREAD_STATS["segments_ecartes"] += len(segments) - len(kept)
+    THREAD_STATS["caracteres_ecartes"] += max(0, len(text) - len(result))
+    record_metric("fil_segments_ecartes", len(segments) - len(kept))
+    return result
+
+# Nombre maximal d'appels OpenAI simultanés pour une requête batch
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "5"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+# Ingestion des PDF à mémoire bornée
+_BASE64_WHITESPACE = str.maketrans("", "", " \t\r\n")
+
+def _reject_oversized(size: int):
+    if size > PDF_MAX_BYTES:
+        raise AnalysisError(
+            f"PDF trop volumineux ({size} octets, maximum {PDF_MAX_BYTES})", status_code=413
+        )
+
+def check_pdf_limits(pdf: ParsedPdf) -> ParsedPdf:
+    """Refuse les documents au-delà de PDF_MAX_PAGES pages"""
+    if pdf.page_count > PDF_MAX_PAGES:
+        page_count = pdf.page_count
+        pdf.close()
+        raise AnalysisError(f"PDF trop long ({page_count} pages, maximum {PDF_MAX_PAGES})", status_code=413)
+    return pdf
+
+def decode_base64_pdf(pdf_base64: str) -> ParsedPdf:
+    """
+    Décode le base64 par morceaux : en mémoire pour les petits PDF, dans un fichier temporaire
+    au-delà de PDF_SPOOL_THRESHOLD, ouvert ensuite directement par PyMuPDF.
+    La taille est vérifiée avant de décoder quoi que ce soit.
+    """
+    # Taille décodée, sans compter les retours à la ligne du base64 MIME (76 caractères par ligne)
+    encoded = len(pdf_base64) - sum(map(pdf_base64.count, " \t\r\n"))
+    _reject_oversized(encoded * 3 // 4 - pdf_base64[-8:].rstrip()[-2:].count("="))
+    return _spool_pdf(_decode_base64_chunks(pdf_base64))
+
+def _decode_base64_chunks(pdf_base64: str):
+    carry = ""
+    for offset in range(0, len(pdf_base64), PDF_DECODE_CHUNK):
+        chunk = carry + pdf_base64[offset:offset + PDF_DECODE_CHUNK].translate(_BASE64_WHITESPACE)
+        usable = len(chunk) - len(chunk) % 4
+        carry = chunk[usable:]
+        yield base64.b64decode(chunk[:usable])
+    if carry:
+        yield base64.b64decode(carry)  # lève une erreur si le remplissage est invalide
+
+def read_pdf_part(content: memoryview) -> ParsedPdf:
+    """PDF reçu en binaire (partie multipart/form-data) : recopié par morceaux, sans décodage"""
+    return _spool_pdf(content[offset:offset + PDF_DECODE_CHUNK] for offset in range(0, len(content), PDF_DECODE_CHUNK))
+
+def _spool_pdf(chunks) -> ParsedPdf:
+    """
+    Garde les morceaux du PDF en mémoire, assemblés en une seule copie à la fin ; au-delà de
+    PDF_SPOOL_THRESHOLD, ils sont écrits directement dans un fichier temporaire.
+    """
+    parts = []
+    output = None
+    path = None
+    written = 0
+    try:
+        for data in chunks:
+            written += len(data)
+            _reject_oversized(written)
+            if path is None and written > PDF_SPOOL_THRESHOLD:
+                fd, path = tempfile.mkstemp(suffix=".pdf")
+                output = os.fdopen(fd, "wb")
+                output.writelines(parts)
+                parts = None
+            if path is None:
+                parts.append(data)
+            else:
+                output.write(data)
+        if path is None:
+            return check_pdf_limits(ParsedPdf(b"".join(parts)))
+        output.close()
+        return check_pdf_limits(ParsedPdf(path=path, owned=True))
+    except BaseException:
+        if path is not None:
+            output.close()
+            _remove_file(path)
+        raise
+
+# Préparation du contenu envoyé à OpenAI pour un email (et son éventuel PDF en base64 ou ses pièces jointes)
+async def prepare_email_content(req_body: dict, sender_email: str, attachments=()) -> str:
+    email_text = req_body.get("email") or ""
+    if THREAD_DEDUP:
+        email_text = strip_email_thread(email_text, conversation_key(req_body, sender_email))
+
+    # Vérifier si le fournisseur est présent dans l'email
+    if "Fournisseur : " not in email_text or not email_text.split("Fournisseur : ")[1].strip():
+        # Si le fournisseur est absent : nom trouvé dans l'annuaire, sinon l'email de l'expéditeur
+        resolved = resolve_supplier(sender_email)
+        supplier = resolved.name if resolved else sender_email
+        if "Fournisseur : " in email_text:
+            email_text = email_text.replace("Fournisseur : ", f"Fournisseur : {supplier}")
+        elif resolved:
+            email_text = f"{email_text}\nFournisseur : {supplier}"
+
+    pdfs = []
+    if "pdf_base64" in req_body:
+        # Retiré du corps pour que la chaîne base64 soit libérée dès la fin du décodage
+        pdfs.append(await _load_pdf(decode_base64_pdf, req_body.pop("pdf_base64") or ""))
+    for attachment in attachments:
+        pdfs.append(await _load_pdf(read_pdf_part, attachment))
+
+    with timed_stage("prompt"):
+        user_content, _ = await asyncio.to_thread(build_prompt_content, email_text, [pdf for pdf in pdfs if pdf])
+    record_metric("prompt_caracteres", len(user_content))
+    if not user_content:
+        raise AnalysisError("Aucun contenu à analyser (ni email ni PDF)", status_code=400)
+    return user_content
+
+async def _load_pdf(reader, source):
+    """Lecture et analyse unique d'un PDF, hors de la boucle d'événements (PyMuPDF est bloquant) ; None si illisible"""
+    try:
+        with timed_stage("decodage"):
+            pdf = await asyncio.to_thread(reader, source)
+        del source
+        record_metric("pdf_octets", pdf.size)
+        record_metric("pdf_pages", pdf.page_count)
+        with timed_stage("pdf"):
+            pdf_text = await asyncio.to_thread(extract_text_from_pdf, pdf)
+        # Log pour debug
+        logging.info(f"Texte extrait du PDF: {pdf_text[:200]}...")
+        return pdf
+    except AnalysisError:
+        raise
+    except Exception as e:
+        logging.error(f"Erreur lors du décodage ou de l'extraction du PDF: {str(e)}")
+        return None
+
+# Analyses identiques simultanées (renvoi de Power Automate après un délai dépassé) : une seule passe
+# par OpenAI, les autres attendent son résultat. Avec ANALYSIS_COALESCE_DIR, un fichier de verrou par
+# analyse étend la coalescence aux autres workers de la machine, qui lisent le résultat dans ce dossier.
+ANALYSIS_COALESCE = os.getenv("ANALYSIS_COALESCE", "1") == "1"
+ANALYSIS_COALESCE_DIR = os.getenv("ANALYSIS_COALESCE_DIR", "")
+ANALYSIS_COALESCE_TIMEOUT = float(os.getenv("ANALYSIS_COALESCE_TIMEOUT", "120"))  # s ; aussi durée de vie d'un résultat
+ANALYSIS_COALESCE_POLL = 0.05
+
+COALESCE_STATS = {"calculs": 0, "attentes": 0, "attentes_inter_workers": 0, "verrous_expires": 0}
+
+class SingleFlight:
+    """
+    Une seule exécution à la fois par clé : les appels concurrents attendent le résultat de la première.
+    Le calcul tourne dans sa propre tâche, qu'une requête abandonnée n'annule pas pour les autres.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # l'erreur est remontée aux appelants, pas au journal de la boucle
+
+    async def run(self, key: str, factory):
+        task = self._tasks.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            COALESCE_STATS["attentes"] += 1
+            record_metric("analyse_coalescee", 1)
+            result = await asyncio.shield(task)
+            return dict(result) if isinstance(result, dict) else result
+        COALESCE_STATS["calculs"] += 1
+        task = asyncio.ensure_future(factory())
+        self._tasks[key] = task
+        task.add_done_callback(partial(self._forget, key))
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._tasks)
+
+ANALYSIS_SINGLE_FLIGHT = SingleFlight()
+
+def _read_shared_result(path: str):
+    """Résultat déposé par un autre worker, s'il est encore frais"""
+    try:
+        if time.time() - os.path.getmtime(path) > ANALYSIS_COALESCE_TIMEOUT:
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_shared_result(path: str, result):
+    """Écriture atomique, puis suppression des résultats expirés du dossier"""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(temporary, path)
+        limit = time.time() - ANALYSIS_COALESCE_TIMEOUT
+        for entry in os.scandir(ANALYSIS_COALESCE_DIR):
+            if entry.name.endswith(".json") and entry.stat().st_mtime < limit:
+                _remove_file(entry.path)
+    except OSError as e:
+        logging.warning(f"Résultat partagé non écrit ({path}) : {str(e)}")
+        _remove_file(temporary)
+
+async def coalesce_across_workers(key: str, factory):
+    """
+    Le premier worker qui crée le fichier de verrou calcule et dépose le résultat ; les autres attendent
+    ce résultat. Verrou abandonné (worker arrêté) ou attente trop longue : le worker calcule lui-même.
+    """
+    lock_path = os.path.join(ANALYSIS_COALESCE_DIR, f"{key}.lock")
+    result_path = os.path.join(ANALYSIS_COALESCE_DIR, f"{key}.json")
+    deadline = time.monotonic() + ANALYSIS_COALESCE_TIMEOUT
+    waited = False
+    while time.monotonic() < deadline:
+        shared = _read_shared_result(result_path)
+        if shared is not None:
+            if waited:
+                COALESCE_STATS["attentes_inter_workers"] += 1
+                record_metric("analyse_coalescee", 1)
+            return shared
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > ANALYSIS_COALESCE_TIMEOUT:
+                    COALESCE_STATS["verrous_expires"] += 1
+                    _remove_file(lock_path)
+            except OSError:
+                pass  # verrou libéré entre-temps
+            waited = True
+            await asyncio.sleep(ANALYSIS_COALESCE_POLL)
+            continue
+        try:
+            result = await factory()
+            _write_shared_result(result_path, result)
+            return result
+        finally:
+            _remove_file(lock_path)
+    logging.warning("Attente d'une analyse identique d'un autre worker trop longue, analyse lancée")
+    return await factory()
+
+# Analyse du contenu : cache, extraction déterministe, OpenAI puis post-traitement intelligent
+def analysis_key(user_content: str) -> str:
+    """Empreinte de l'entrée normalisée et de tous les réglages qui déterminent le résultat"""
+    return ResultCache.make_key("analyse", get_openai_router().deployments, LONG_INSTRUCTION, OPENAI_PARAMS,
+                                OPENAI_OUTPUT_MODE, OPENAI_SCHEMA_MAX_TOKENS,
+                                DETERMINISTIC_TIER, DETERMINISTIC_CONFIDENCE, user_content)
+
+async def analyze_user_content(user_content: str):
+    """Retourne le résultat amélioré (dict) ou, à défaut, le texte brut renvoyé par OpenAI"""
+    # Résultat final déjà calculé pour cette entrée : ni OpenAI ni post-traitement
+    key = analysis_key(user_content)
+    cached_result = RESULT_CACHE.get(key)
+    if cached_result is not None:
+        logging.info("Résultat d'analyse servi depuis le cache")
+        record_metric("cache_analyse", 1)
+        return cached_result
+    if not ANALYSIS_COALESCE:
+        return await _run_analysis(user_content, key)
+
+    async def compute():
+        if ANALYSIS_COALESCE_DIR:
+            return await coalesce_across_workers(key, lambda: _run_analysis(user_content, key))
+        return await _run_analysis(user_content, key)
+
+    return await ANALYSIS_SINGLE_FLIGHT.run(key, compute)
+
+async def _run_analysis(user_content: str, key: str):
+    # Premier niveau : regex ; seuls les champs incertains sont demandés à OpenAI
+    DETERMINISTIC_STATS["analyses"] += 1
+    known = {}
+    missing = EXTRACTION_FIELDS
+    if DETERMINISTIC_TIER:
+        with timed_stage("deterministe"):
+            known = deterministic_extraction(user_content)
+        missing = tuple(field for field in EXTRACTION_FIELDS if known[field][1] < DETERMINISTIC_CONFIDENCE)
+        if not missing:
+            DETERMINISTIC_STATS["sans_llm"] += 1
+            result = {field: value for field, (value, _) in known.items()}
+            logging.info(f"Extraction déterministe suffisante, OpenAI non appelé : {result}")
+            RESULT_CACHE.set(key, result)
+            return result
+    DETERMINISTIC_STATS["champs_demandes_llm"] += len(missing)
+
+    # Envoi de la requête à OpenAI
+    instruction, params = openai_request_options(missing)
+    with timed_stage("openai"):  # aller-retour complet, tentatives et attentes comprises
+        result = await query_azure_openai(user_content, instruction, params)
+    stats = OUTPUT_STATS[_output_mode()]
+    stats["reponses"] += 1
+    for name in ("prompt_tokens", "completion_tokens"):
+        stats[name] += (result.get("usage") or {}).get(name) or 0
+
+    # Vérification si la réponse est valide et structurer correctement
+    if 'choices' in result and 'content' in result['choices'][0]['message']:
+        result_json = result['choices'][0]['message']['content']
+        logging.info(f"Réponse OpenAI ({', '.join(missing)}) : {result_json}")
+
+        # Post-traitement intelligent pour améliorer l'extraction
+        with timed_stage("post_traitement"):
+            enhanced_result = enhance_extraction_with_intelligence(result_json, user_content)
+
+        # Retourner le résultat amélioré
+        if isinstance(enhanced_result, dict):
+            for field, (value, confidence) in known.items():
+                # Champ sûr : valeur déterministe ; champ incertain : OpenAI, sinon la valeur déterministe
+                if field not in missing or (value and not enhanced_result.get(field)):
+                    enhanced_result[field] = value
+            RESULT_CACHE.set(key, enhanced_result)
+            return enhanced_result
+        return result_json
+
+    logging.error("Réponse non valide ou mal structurée.")
+    raise AnalysisError("Erreur lors de l'analyse des données.", status_code=500)
+
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
 @app.function_name(name="analyze_email_and_pdf")
 @app.route(route="analyze_email_and_pdf", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    timer = StageTimer()
+    token = _current_timer.set(timer)
     try:
-        content_type = req.headers.get("Content-Type", "")
-        user_content = ""
+        response = await _analyze_request(req)
+    finally:
+        _current_timer.reset(token)
+    dimensions = timer.custom_dimensions()
+    dimensions["status_code"] = response.status_code
+    logging.info(f"Durées par étape : {json.dumps(dimensions)}", extra={"custom_dimensions": dimensions})
+    if SERVER_TIMING_HEADER:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return response
 
-        # Récupération de l'email de l'expéditeur
-        sender_email = req.get_json().get("sender_email", "")
+def read_multipart_request(req: func.HttpRequest):
+    """
+    Champs texte (email, sender_email, subject, conversation_id) et pièces jointes d'une requête
+    multipart/form-data. Le corps est déjà en mémoire : il est découpé sur place et chaque pièce jointe
+    est une vue (memoryview) sur le corps, sans copie. Les parties fichier vides sont ignorées.
+    """
+    boundary = _multipart_boundary(req.headers.get("Content-Type", ""))
+    if not boundary:
+        raise AnalysisError("Corps multipart/form-data sans boundary", status_code=400)
+    delimiter = b"\r\n--" + boundary.encode("latin-1")
+    body = req.get_body()
+    view = memoryview(body)
+    fields, attachments = {}, []
+    # Le premier délimiteur, en tête du corps, n'est pas précédé d'un CRLF
+    if body.startswith(delimiter[2:]):
+        position, length = 0, len(delimiter) - 2
+    else:
+        position, length = body.find(delimiter), len(delimiter)
+    while position >= 0 and not body.startswith(b"--", position + length):
+        headers_start = body.find(b"\r\n", position + length) + 2
+        headers_end = body.find(b"\r\n\r\n", headers_start)
+        end = body.find(delimiter, headers_end)
+        if headers_start < 2 or headers_end < 0 or end < 0:
+            raise AnalysisError("Corps multipart/form-data tronqué", status_code=400)
+        name, filename = _part_disposition(body[headers_start:headers_end])
+        content = view[headers_end + 4:end]
+        if filename is None:
+            fields[name] = str(content, "utf-8", "replace")
+        elif len(content):
+            attachments.append(content)
+        position, length = end, len(delimiter)
+    if position < 0:
+        raise AnalysisError("Corps multipart/form-data tronqué", status_code=400)
+    if len(attachments) > PDF_MAX_FILES:
+        raise AnalysisError(f"Trop de pièces jointes ({len(attachments)}, maximum {PDF_MAX_FILES})", status_code=413)
+    return fields, attachments
+
+_SIMPLE_BOUNDARY_RE = re.compile(r'(?i);\s*boundary=(?:"([^"\\]+)"|([^\s;"*]+))\s*(?:;|$)')
+
+def _multipart_boundary(content_type):
+    match = _SIMPLE_BOUNDARY_RE.search(content_type)
+    if match and "*=" not in content_type:
+        return match.group(1) or match.group(2)
+    message = email.message.Message()
+    message["Content-Type"] = content_type
+    boundary = message.get_param("boundary")
+    return email.utils.collapse_rfc2231_value(boundary) if boundary else None
+
+_MULTIPART_HEADER_PARSER = email.parser.BytesHeaderParser()
+# Cas courant (navigateurs, httpx, Power Automate) : name et filename entre guillemets, sans encodage RFC 2231
+_SIMPLE_DISPOSITION_RE = re.compile(
+    rb'(?im)^content-disposition:[ \t]*form-data[ \t]*;[ \t]*name="([^"\\]*)"(?:[ \t]*;[ \t]*filename="([^"\\]*)")?[ \t]*\r?$')
+
+def _part_disposition(raw_headers):
+    """(name, filename) d'une partie ; filename vaut None pour un champ texte"""
+    match = _SIMPLE_DISPOSITION_RE.search(raw_headers)
+    if match and b"*=" not in raw_headers:
+        name, filename = match.groups()
+        return name.decode("utf-8", "replace"), None if filename is None else filename.decode("utf-8", "replace")
+    headers = _MULTIPART_HEADER_PARSER.parsebytes(raw_headers)
+    name = email.utils.collapse_rfc2231_value(headers.get_param("name", "", header="content-disposition"))
+    return name, headers.get_filename()
+
+async def _analyze_request(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        content_type = req.headers.get("Content-Type", "")
 
         # Si le contenu est un PDF
         if "application/pdf" in content_type:
-            pdf_bytes = req.get_body()
+            with timed_stage("lecture"):
+                pdf_bytes = req.get_body()
             if not pdf_bytes or len(pdf_bytes) < 1000:
                 return func.HttpResponse("Le fichier PDF est vide ou incomplet", status_code=400)
+            _reject_oversized(len(pdf_bytes))
+            record_metric("pdf_octets", len(pdf_bytes))
             # Extraire l'ID de commande du PDF
-            order_id = extract_order_id_from_pdf(pdf_bytes)
+            with timed_stage("pdf"):
+                pdf = await asyncio.to_thread(lambda: check_pdf_limits(ParsedPdf(pdf_bytes)))
+            record_metric("pdf_pages", pdf.page_count)
+            if PDF_OCR:
+                with timed_stage("ocr"):
+                    await asyncio.to_thread(ocr_missing_pages, pdf)
+            with timed_stage("id_commande"):
+                order_id = await asyncio.to_thread(extract_order_id_from_pdf, pdf)
 
             if order_id:
                 return func.HttpResponse(json.dumps({"ID_commande": order_id}), status_code=200, mimetype="application/json")
             else:
                 return func.HttpResponse("Aucun ID de commande trouvé dans le PDF.", status_code=404)
 
-        # Si le contenu est un email (ce cas est déclenché par Power Automate)
+        # Email et pièces jointes en binaire : pas de base64 à décoder
+        attachments = []
+        if "multipart/form-data" in content_type:
+            with timed_stage("lecture"):
+                req_body, attachments = await asyncio.to_thread(read_multipart_request, req)
         else:
-            req_body = req.get_json()
-            email_text = req_body.get("email")
-
-            # Vérifier si le fournisseur est présent dans l'email
-            if "Fournisseur : " not in email_text or not email_text.split("Fournisseur : ")[1].strip():
-                # Si le fournisseur est absent, utiliser l'email de l'expéditeur comme fournisseur
-                email_text = email_text.replace("Fournisseur : ", f"Fournisseur : {sender_email}")
-
-            pdf_text = None
-            if "pdf_base64" in req_body:
-                try:
-                    pdf_bytes = base64.b64decode(req_body["pdf_base64"])
-                    pdf_text = extract_text_from_pdf(pdf_bytes)
-                    # Log pour debug
-                    logging.info(f"Texte extrait du PDF: {pdf_text[:200]}...")
-                except Exception as e:
-                    logging.error(f"Erreur lors du décodage ou de l'extraction du PDF: {str(e)}")
-
-            # Si un email et un PDF sont fournis, combinez-les
-            if email_text and pdf_text:
-                user_content = f"EMAIL:\n{email_text}\n\nPIECE_JOINTE_PDF:\n{pdf_text}"
-            elif email_text:
-                user_content = email_text
-            elif pdf_text:
-                user_content = pdf_text
-            else:
-                return func.HttpResponse("Aucun contenu à analyser (ni email ni PDF)", status_code=400)
+            # Si le contenu est un email (ce cas est déclenché par Power Automate)
+            try:
+                with timed_stage("lecture"):
+                    req_body = req.get_json()  # corps analysé une seule fois
+            except ValueError:
+                return func.HttpResponse("Le corps de la requête doit être un JSON valide", status_code=400)
 
-        # Envoi de la requête à OpenAI
-        result = query_azure_openai(user_content)
+        # Récupération de l'email de l'expéditeur
+        sender_email = req_body.get("sender_email", "")
+        user_content = await prepare_email_content(req_body, sender_email, attachments)
+        result = await analyze_user_content(user_content)
 
-        # Vérification si la réponse est valide et structurer correctement
-        if 'choices' in result and 'content' in result['choices'][0]['message']:
-            result_json = result['choices'][0]['message']['content']
-            logging.info(f"Réponse OpenAI : {result_json}")
-            
-            # Post-traitement intelligent pour améliorer l'extraction
-            enhanced_result = enhance_extraction_with_intelligence(result_json, user_content)
-            
-            # Retourner le résultat amélioré
-            if isinstance(enhanced_result, dict):
-                return func.HttpResponse(json.dumps(enhanced_result, ensure_ascii=False), status_code=200, mimetype="application/json")
-            else:
-                return func.HttpResponse(result_json, status_code=200, mimetype="application/json")
-        else:
-            logging.error("Réponse non valide ou mal structurée.")
-            return func.HttpResponse("Erreur lors de l'analyse des données.", status_code=500)
+        if isinstance(result, dict):
+            return func.HttpResponse(json.dumps(result, ensure_ascii=False), status_code=200, mimetype="application/json")
+        return func.HttpResponse(result, status_code=200, mimetype="application/json")
 
+    except AnalysisError as e:
+        return func.HttpResponse(str(e), status_code=e.status_code)
     except Exception as e:
         logging.error(f"Erreur interne : {str(e)}")
         return func.HttpResponse(f"Erreur interne : {str(e)}", status_code=500)
+
+# Analyse d'un lot d'emails : un élément en erreur n'interrompt pas le lot
+async def analyze_batch(items: list, max_concurrency: int = None) -> list:
+    """
+    Les PDF sont analysés en parallèle, les appels OpenAI limités par un sémaphore.
+    Les résultats sont renvoyés dans l'ordre des éléments reçus.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or BATCH_MAX_CONCURRENCY)
+
+    async def process(index: int, item):
+        try:
+            if not isinstance(item, dict):
+                raise AnalysisError("Élément invalide : un objet JSON est attendu", status_code=400)
+            user_content = await prepare_email_content(item, item.get("sender_email", ""))
+            async with semaphore:
+                result = await analyze_user_content(user_content)
+            return {"index": index, "status_code": 200, "resultat": result}
+        except AnalysisError as e:
+            return {"index": index, "status_code": e.status_code, "erreur": str(e)}
+        except Exception as e:
+            logging.error(f"Erreur sur l'élément {index} du lot : {str(e)}")
+            return {"index": index, "status_code": 500, "erreur": f"Erreur interne : {str(e)}"}
+
+    return list(await asyncio.gather(*(process(i, item) for i, item in enumerate(items))))
+
+@app.function_name(name="analyze_email_and_pdf_batch")
+@app.route(route="analyze_email_and_pdf_batch", methods=["POST"])
+async def batch(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        items = req.get_json()
+    except ValueError:
+        return func.HttpResponse("Le corps doit être un tableau JSON", status_code=400)
+    if isinstance(items, dict):
+        items = items.get("items")
+    if not isinstance(items, list) or not items:
+        return func.HttpResponse("Le corps doit être un tableau JSON non vide", status_code=400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return func.HttpResponse(f"Lot trop volumineux (maximum {BATCH_MAX_ITEMS} éléments)", status_code=413)
+
+    results = await analyze_batch(items)
+    return func.HttpResponse(json.dumps({"resultats": results}, ensure_ascii=False), status_code=200, mimetype="application/json")
+
+
+# Mode asynchrone : l'analyse est confiée à une file, le client suit l'avancement par le statut.
+# Évite les délais d'attente HTTP de Power Automate sur les gros PDF ou les reprises OpenAI.
+JOBS_CONNECTION = "AzureWebJobsStorage"  # nom du paramètre d'application (Azurite en local)
+JOBS_CONTAINER = os.getenv("JOBS_CONTAINER", "analyses")
+JOBS_QUEUE = os.getenv("JOBS_QUEUE", "analyses-a-traiter")
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))  # aligné sur queues.maxDequeueCount (host.json)
+JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+class JobStore:
+    """
+    Entrées, statuts et résultats des analyses asynchrones dans un conteneur blob :
+    {id}/entree.json (supprimé après traitement) et {id}/statut.json.
+    """
+
+    def __init__(self, connection_string: str, container: str = JOBS_CONTAINER):
+        service = azure_blob.BlobServiceClient.from_connection_string(connection_string)
+        self._container = service.get_container_client(container)
+        try:
+            self._container.create_container()
+        except azure_exceptions.ResourceExistsError:
+            pass
+
+    def _write(self, name: str, data: bytes):
+        self._container.upload_blob(name, data, overwrite=True)
+
+    def _read(self, name: str):
+        try:
+            return self._container.download_blob(name).readall()
+        except azure_exceptions.ResourceNotFoundError:
+            return None
+
+    def create(self, payload: bytes) -> str:
+        job_id = uuid.uuid4().hex
+        self._write(f"{job_id}/entree.json", payload)
+        self.set_status(job_id, "en_attente")
+        return job_id
+
+    def load_payload(self, job_id: str):
+        return self._read(f"{job_id}/entree.json")
+
+    def set_status(self, job_id: str, status: str, **details):
+        document = {"job_id": job_id, "statut": status, "mis_a_jour": datetime.now(timezone.utc).isoformat()}
+        document.update(details)
+        self._write(f"{job_id}/statut.json", json.dumps(document, ensure_ascii=False).encode("utf-8"))
+
+    def get_status(self, job_id: str):
+        data = self._read(f"{job_id}/statut.json")
+        return json.loads(data) if data is not None else None
+
+    def delete_payload(self, job_id: str):
+        try:
+            self._container.delete_blob(f"{job_id}/entree.json")
+        except azure_exceptions.ResourceNotFoundError:
+            pass
+
+_job_store = None
+
+def get_job_store() -> JobStore:
+    global _job_store
+    if _job_store is None:
+        _job_store = JobStore(os.getenv(JOBS_CONNECTION))
+    return _job_store
+
+@app.function_name(name="analyze_email_and_pdf_async")
+@app.route(route="analyze_email_and_pdf_async", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
+@app.queue_output(arg_name="queue", queue_name=JOBS_QUEUE, connection=JOBS_CONNECTION)
+async def submit_job(req: func.HttpRequest, queue: func.Out[str]) -> func.HttpResponse:
+    """Même corps que analyze_email_and_pdf ; répond 202 avec l'identifiant de l'analyse"""
+    payload = req.get_body()
+    # Base64 : 4 caractères pour 3 octets, plus une marge pour l'email et le JSON
+    if len(payload) > PDF_MAX_BYTES * 4 // 3 + 1024 * 1024:
+        return func.HttpResponse(f"Requête trop volumineuse (PDF de {PDF_MAX_BYTES} octets au maximum)", status_code=413)
+    # Contrôle de forme seulement : le JSON complet (jusqu'à ~27 Mo) n'est analysé que par le worker
+    if payload[:64].lstrip()[:1] != b"{" or payload[-64:].rstrip()[-1:] != b"}":
+        return func.HttpResponse("Le corps de la requête doit être un objet JSON", status_code=400)
+
+    job_id = await asyncio.to_thread(get_job_store().create, payload)
+    queue.set(job_id)
+    status_url = f"/api/analyze_jobs/{job_id}"
+    return func.HttpResponse(
+        json.dumps({"job_id": job_id, "statut": "en_attente", "statut_url": status_url}),
+        status_code=202,
+        mimetype="application/json",
+        headers={"Location": status_url, "Retry-After": "2"}
+    )
+
+@app.function_name(name="analyze_job_worker")
+@app.queue_trigger(arg_name="msg", queue_name=JOBS_QUEUE, connection=JOBS_CONNECTION)
+async def process_job(msg: func.QueueMessage) -> None:
+    """Exécute l'analyse comme le handler synchrone ; les erreurs 5xx sont réessayées par la file"""
+    job_id = msg.get_body().decode("utf-8").strip()
+    store = get_job_store()
+    payload = await asyncio.to_thread(store.load_payload, job_id)
+    if payload is None:
+        logging.warning(f"Analyse {job_id} : entrée introuvable (déjà traitée ?)")
+        return
+    attempt = msg.dequeue_count or 1
+    await asyncio.to_thread(store.set_status, job_id, "en_cours", tentative=attempt)
+
+    req = func.HttpRequest(
+        method="POST",
+        url="/api/analyze_email_and_pdf",
+        headers={"Content-Type": "application/json"},
+        body=payload
+    )
+    response = await main(req)
+    body = response.get_body().decode("utf-8")
+    if response.status_code >= 500 and attempt < JOBS_MAX_ATTEMPTS:
+        await asyncio.to_thread(store.set_status, job_id, "en_attente", tentative=attempt, erreur=body)
+        raise RuntimeError(f"Analyse {job_id} en échec ({response.status_code}), nouvelle tentative")
+
+    try:
+        result = json.loads(body)
+    except ValueError:
+        result = body
+    if response.status_code == 200:
+        await asyncio.to_thread(store.set_status, job_id, "termine", status_code=200, resultat=result)
+    else:
+        await asyncio.to_thread(store.set_status, job_id, "echec", status_code=response.status_code, erreur=result)
+    await asyncio.to_thread(store.delete_payload, job_id)
+
+@app.function_name(name="analyze_job_status")
+@app.route(route="analyze_jobs/{job_id}", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def job_status(req: func.HttpRequest) -> func.HttpResponse:
+    job_id = req.route_params.get("job_id", "")
+    status = None
+    if JOB_ID_RE.fullmatch(job_id):
+        status = await asyncio.to_thread(get_job_store().get_status, job_id)
+    if status is None:
+        return func.HttpResponse("Analyse inconnue", status_code=404)
+    return func.HttpResponse(json.dumps(status, ensure_ascii=False), status_code=200, mimetype="application/json")
+
+# Compteurs exposés pour dimensionner les caches et suivre le service
+def collect_metrics() -> dict:
+    directory = get_supplier_directory()
+    return {
+        "cache": RESULT_CACHE.stats(),
+        "extraction_deterministe": _deterministic_stats(),
+        "sortie_openai": _output_stats(),
+        "ocr": dict(OCR_STATS),
+        "fils_de_discussion": dict(THREAD_STATS),
+        "coalescence": {**COALESCE_STATS, "en_cours": len(ANALYSIS_SINGLE_FLIGHT)},
+        "annuaire_fournisseurs": directory.stats() if directory is not None else None,
+        "openai": {
+            "limiteur": OPENAI_RATE_LIMITER.stats(),
+            "disjoncteur": OPENAI_CIRCUIT.stats()
+        } if OPENAI_ROUTER is None else {"deploiements": OPENAI_ROUTER.stats()}
+    }
+
+@app.function_name(name="metrics")
+@app.route(route="metrics", methods=["GET"])
+def metrics(req: func.HttpRequest) -> func.HttpResponse:
+    return func.HttpResponse(json.dumps(collect_metrics(), ensure_ascii=False), status_code=200, mimetype="application/json")
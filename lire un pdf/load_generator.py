@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Générateur de charge pour analyze_email_and_pdf : envoie à débit cible (RPS) des emails fournisseurs
+avec leur BC en base64, tirés du corpus synthétique de benchmark_pipeline, et rapporte les latences
+p50/p95/p99 et les taux d'erreur.
+
+Les arrivées suivent un processus de Poisson (charge ouverte) : un serveur lent n'abaisse pas le débit envoyé.
+
+Usage (fonction démarrée avec `func start`, OpenAI remplacé par stub_openai.py) :
+    python load_generator.py --rps 20 --duree 60 [--url http://localhost:7071/api/analyze_email_and_pdf]
+
+Mode asynchrone (Azurite démarré) : chaque requête est soumise puis suivie jusqu'à son résultat,
+la latence mesurée va de la soumission au statut final.
+    python load_generator.py --rps 20 --duree 60 --url http://localhost:7071/api/analyze_email_and_pdf_async
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+from collections import Counter
+
+import httpx
+
+from benchmark_pipeline import generer_corpus
+
+URL_PAR_DEFAUT = "http://localhost:7071/api/analyze_email_and_pdf"
+
+
+def construire_charges(part_pdf=0.7, graine=0):
+    """Corps JSON prêts à l'envoi : email seul ou email + PDF en base64"""
+    rnd = random.Random(graine)
+    charges = []
+    for cas in generer_corpus(graine):
+        body = {"email": cas["email"], "sender_email": "contact@fournisseur.ma"}
+        if rnd.random() < part_pdf:
+            body["pdf_base64"] = base64.b64encode(cas["pdf"]).decode()
+        charges.append(json.dumps(body).encode())
+    return charges
+
+
+def percentile(valeurs, p):
+    """Percentile par rang le plus proche (valeurs triées)"""
+    if not valeurs:
+        return None
+    rang = max(0, min(len(valeurs) - 1, round(p / 100 * len(valeurs) + 0.5) - 1))
+    return valeurs[rang]
+
+
+async def suivre(client, url, resp, intervalle=0.5, delai_max=600.0):
+    """Interroge l'URL de statut d'une analyse asynchrone jusqu'à son issue ; renvoie son code HTTP"""
+    statut_url = str(httpx.URL(url).join(resp.json()["statut_url"]))
+    limite = time.perf_counter() + delai_max
+    while time.perf_counter() < limite:
+        await asyncio.sleep(intervalle)
+        document = (await client.get(statut_url)).json()
+        if document["statut"] in ("termine", "echec"):
+            return document["status_code"]
+    return "timeout"
+
+
+async def envoyer(client, url, body, resultats):
+    debut = time.perf_counter()
+    try:
+        resp = await client.post(url, content=body, headers={"Content-Type": "application/json"})
+        statut = str(await suivre(client, url, resp) if resp.status_code == 202 else resp.status_code)
+    except httpx.TimeoutException:
+        statut = "timeout"
+    except httpx.HTTPError as e:
+        statut = type(e).__name__
+    resultats.append((statut, time.perf_counter() - debut))
+
+
+async def generer_charge(url, rps, duree, charges, timeout=60.0, graine=0, transport=None):
+    """Envoie des requêtes pendant `duree` secondes ; renvoie [(statut, latence en s)]"""
+    rnd = random.Random(graine)
+    resultats, taches = [], []
+    limites = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(timeout=timeout, limits=limites, transport=transport) as client:
+        debut = time.perf_counter()
+        prochain = debut
+        while prochain - debut < duree:
+            attente = prochain - time.perf_counter()
+            if attente > 0:
+                await asyncio.sleep(attente)
+            taches.append(asyncio.create_task(envoyer(client, url, rnd.choice(charges), resultats)))
+            prochain += rnd.expovariate(rps)
+        await asyncio.gather(*taches)
+    return resultats
+
+
+def rapport(resultats, duree):
+    """Synthèse : débit obtenu, latences des réponses 200 et répartition des statuts"""
+    statuts = Counter(statut for statut, _ in resultats)
+    latences = sorted(latence * 1000 for statut, latence in resultats if statut == "200")
+    total = len(resultats)
+    erreurs = total - statuts.get("200", 0)
+    return {
+        "requetes": total,
+        "debit_rps": round(total / duree, 2) if duree else None,
+        "p50_ms": percentile(latences, 50),
+        "p95_ms": percentile(latences, 95),
+        "p99_ms": percentile(latences, 99),
+        "taux_erreur": round(erreurs / total, 4) if total else 0.0,
+        "statuts": dict(statuts),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=URL_PAR_DEFAUT)
+    parser.add_argument("--rps", type=float, default=10.0, help="débit cible en requêtes par seconde")
+    parser.add_argument("--duree", type=float, default=30.0, help="durée d'envoi en secondes")
+    parser.add_argument("--part-pdf", type=float, default=0.7, help="part des requêtes avec un PDF joint")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", action="store_true", help="affiche le rapport en JSON")
+    args = parser.parse_args()
+
+    charges = construire_charges(args.part_pdf)
+    resultats = asyncio.run(generer_charge(args.url, args.rps, args.duree, charges, args.timeout))
+    synthese = rapport(resultats, args.duree)
+    if args.json:
+        print(json.dumps(synthese, indent=2))
+        return
+    print(f"{synthese['requetes']} requêtes en {args.duree:.0f} s ({synthese['debit_rps']} req/s, cible {args.rps})")
+    if synthese["p50_ms"] is not None:
+        print(f"Latence des succès : p50 {synthese['p50_ms']:.0f} ms, p95 {synthese['p95_ms']:.0f} ms, "
+              f"p99 {synthese['p99_ms']:.0f} ms")
+    print(f"Taux d'erreur : {synthese['taux_erreur']:.2%}  statuts : {synthese['statuts']}")
+
+
+if __name__ == "__main__":
+    main()
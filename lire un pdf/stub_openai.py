@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stub local du point d'accès Azure OpenAI chat/completions, pour les benchmarks et les tests de charge.
+Les réponses sont construites par règles à partir du message utilisateur (ou lues dans un fichier) :
+aucun quota n'est consommé.
+
+En serveur HTTP, il répond sur /openai/deployments/{nom}/chat/completions avec une latence tirée
+d'une distribution et des erreurs 429/5xx injectées à la demande :
+
+    python stub_openai.py --port 8090 --latence lognormale:400:0.5 --taux-429 0.05 --taux-5xx 0.01
+    AZURE_OPENAI_ENDPOINT=http://localhost:8090 func start
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+ID_RE = re.compile(r"\b(?:BSK\d{4}[A-Z]{2}\d{4}|TAC [A-Z0-9]{6,}|CMD\d{6,}|BC\d{4}-\d{3}|PO \d{6,})\b")
+DATE_RE = re.compile(r"\b\d{1,2}/\d{1,2}/\d{2,4}\b")
+FOURNISSEUR_RE = re.compile(r"Fournisseur\s*:\s*([^\n]+)")
+CHEMIN_RE = re.compile(r"^/openai/deployments/[^/]+/chat/completions(?:\?.*)?$")
+
+
+def repondre(body: dict) -> dict:
+    """Réponse chat/completions : JSON des champs trouvés par règles simples dans le message utilisateur"""
+    message = body["messages"][-1]["content"]
+    dates = DATE_RE.findall(message)
+    id_commande = ID_RE.search(message)
+    fournisseur = FOURNISSEUR_RE.search(message)
+    contenu = {
+        "ID_commande": id_commande.group(0) if id_commande else None,
+        "nom_fournisseur": fournisseur.group(1).strip() if fournisseur else None,
+        "date_reception": dates[0] if len(dates) > 1 else None,
+        "date_livraison": dates[-1] if dates else None,
+    }
+    texte = json.dumps(contenu, ensure_ascii=False)
+    prompt = sum(len(m["content"]) for m in body["messages"]) // 4
+    return {
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": texte}}],
+        "usage": {"prompt_tokens": prompt, "completion_tokens": len(texte) // 4,
+                  "total_tokens": prompt + len(texte) // 4},
+    }
+
+
+BAVARDAGE = ("\n\nJ'espère que cette extraction vous aidera. N'hésitez pas à me solliciter "
+             "si vous avez besoin d'autres informations sur cette commande.")
+
+
+def evenements_sse(reponse: dict, bavardage: str = BAVARDAGE, taille: int = 8):
+    """Réponse découpée en événements SSE (stream=true), suivie d'un bavardage comme en produit le modèle"""
+    texte = reponse["choices"][0]["message"]["content"] + bavardage
+    for debut in range(0, len(texte), taille):
+        delta = {"choices": [{"index": 0, "delta": {"content": texte[debut:debut + taille]}, "finish_reason": None}]}
+        yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n".encode("utf-8")
+    fin = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    yield f"data: {json.dumps(fin)}\n\n".encode("utf-8")
+    yield b"data: [DONE]\n\n"
+
+
+async def flux_async(evenements):
+    """Corps de réponse diffusé, tel que l'attend httpx.AsyncClient"""
+    for evenement in evenements:
+        yield evenement
+
+
+def transport(latence: float = 0.0) -> httpx.MockTransport:
+    """Transport httpx qui répond comme le stub après `latence` secondes, sans réseau"""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if latence:
+            await asyncio.sleep(latence)
+        body = json.loads(request.content)
+        if body.get("stream"):
+            return httpx.Response(200, headers={"Content-Type": "text/event-stream"},
+                                  content=flux_async(evenements_sse(repondre(body))))
+        return httpx.Response(200, json=repondre(body))
+
+    return httpx.MockTransport(handler)
+
+
+def tirer_latence(spec: str, rnd: random.Random) -> float:
+    """
+    Latence en secondes selon une spécification (valeurs en ms) :
+    "fixe:300", "uniforme:100:800", "lognormale:400:0.5" (médiane, sigma), "exponentielle:300" (moyenne).
+    """
+    nom, *valeurs = spec.split(":")
+    valeurs = [float(v) for v in valeurs]
+    if nom == "fixe":
+        ms = valeurs[0]
+    elif nom == "uniforme":
+        ms = rnd.uniform(valeurs[0], valeurs[1])
+    elif nom == "lognormale":
+        ms = valeurs[0] * rnd.lognormvariate(0, valeurs[1])
+    elif nom == "exponentielle":
+        ms = rnd.expovariate(1 / valeurs[0])
+    else:
+        raise ValueError(f"Distribution de latence inconnue : {spec}")
+    return ms / 1000
+
+
+class StubConfig:
+    """Comportement du serveur : latence, taux d'erreurs injectées et réponse figée éventuelle"""
+
+    def __init__(self, latence="fixe:0", taux_429=0.0, taux_5xx=0.0, retry_after=1, reponse=None, graine=None,
+                 delai_jeton=0.0):
+        tirer_latence(latence, random.Random())  # valide la spécification au démarrage
+        self.latence = latence
+        self.taux_429 = taux_429
+        self.taux_5xx = taux_5xx
+        self.retry_after = retry_after
+        self.reponse = reponse
+        self.delai_jeton = delai_jeton  # secondes entre deux événements SSE
+        self.rnd = random.Random(graine)
+        self.lock = threading.Lock()
+        self.compteurs = {"requetes": 0, "429": 0, "5xx": 0, "flux_interrompus": 0}
+
+    def tirer(self):
+        """(latence, statut) de la prochaine requête"""
+        with self.lock:
+            self.compteurs["requetes"] += 1
+            latence = tirer_latence(self.latence, self.rnd)
+            tirage = self.rnd.random()
+            if tirage < self.taux_429:
+                self.compteurs["429"] += 1
+                return latence, 429
+            if tirage < self.taux_429 + self.taux_5xx:
+                self.compteurs["5xx"] += 1
+                return latence, self.rnd.choice((500, 502, 503))
+            return latence, 200
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "StubAzureOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass  # un journal par requête fausserait les mesures de charge
+
+    def _envoyer(self, statut, contenu, entetes=None):
+        data = json.dumps(contenu, ensure_ascii=False).encode("utf-8")
+        self.send_response(statut)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for nom, valeur in (entetes or {}).items():
+            self.send_header(nom, valeur)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        config = self.server.config
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not CHEMIN_RE.match(self.path):
+            return self._envoyer(404, {"error": {"code": "404", "message": "Resource not found"}})
+        latence, statut = config.tirer()
+        time.sleep(latence)
+        if statut == 429:
+            return self._envoyer(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                                 {"retry-after": str(config.retry_after)})
+        if statut != 200:
+            return self._envoyer(statut, {"error": {"code": str(statut), "message": "Injected failure"}})
+        try:
+            requete = json.loads(body)
+        except ValueError:
+            return self._envoyer(400, {"error": {"code": "400", "message": "Invalid JSON body"}})
+        reponse = repondre(requete)
+        if config.reponse is not None:
+            reponse["choices"][0]["message"]["content"] = json.dumps(config.reponse, ensure_ascii=False)
+        if not requete.get("stream"):
+            return self._envoyer(200, reponse)
+        # Flux SSE : fin de réponse signalée par la fermeture de la connexion (HTTP/1.0)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for evenement in evenements_sse(reponse):
+                self.wfile.write(evenement)
+                self.wfile.flush()
+                time.sleep(config.delai_jeton)
+        except (BrokenPipeError, ConnectionResetError):
+            with config.lock:
+                config.compteurs["flux_interrompus"] += 1  # le client a fermé le flux après l'objet JSON
+
+
+def creer_serveur(config: StubConfig, hote="127.0.0.1", port=0) -> ThreadingHTTPServer:
+    serveur = ThreadingHTTPServer((hote, port), StubHandler)
+    serveur.daemon_threads = True
+    serveur.config = config
+    return serveur
+
+
+def demarrer_serveur(config: StubConfig, hote="127.0.0.1", port=0):
+    """Démarre le serveur dans un thread ; renvoie (serveur, url de base). Port 0 : port libre"""
+    serveur = creer_serveur(config, hote, port)
+    threading.Thread(target=serveur.serve_forever, daemon=True).start()
+    return serveur, f"http://{hote}:{serveur.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hote", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latence", default="lognormale:400:0.5",
+                        help="fixe:MS, uniforme:MIN:MAX, lognormale:MEDIANE:SIGMA ou exponentielle:MOYENNE")
+    parser.add_argument("--taux-429", type=float, default=0.0)
+    parser.add_argument("--taux-5xx", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1, help="secondes annoncées avec les 429")
+    parser.add_argument("--reponse", metavar="FICHIER", help="JSON renvoyé tel quel au lieu des règles")
+    parser.add_argument("--graine", type=int)
+    parser.add_argument("--delai-jeton-ms", type=float, default=20.0, help="délai entre événements SSE (stream)")
+    args = parser.parse_args()
+
+    reponse = None
+    if args.reponse:
+        with open(args.reponse, encoding="utf-8") as f:
+            reponse = json.load(f)
+    config = StubConfig(args.latence, args.taux_429, args.taux_5xx, args.retry_after, reponse, args.graine,
+                        args.delai_jeton_ms / 1000)
+    serveur = creer_serveur(config, args.hote, args.port)
+    print(f"Stub Azure OpenAI sur http://{args.hote}:{args.port} (latence {args.latence}, "
+          f"429 {args.taux_429:.0%}, 5xx {args.taux_5xx:.0%})")
+    try:
+        serveur.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        serveur.server_close()
+        print(f"Requêtes servies : {config.compteurs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la route batch : ordre des résultats, erreurs par élément et concurrence bornée
+"""
+
+import asyncio
+import json
+
+import azure.functions as func
+import httpx
+
+import function_app
+
+
+def test_lot_avec_erreurs_et_concurrence_bornee(installer_client, monkeypatch):
+    """Chaque élément a son résultat, les erreurs ne font pas échouer le lot"""
+    en_cours = 0
+    maximum = 0
+
+    async def handler(request):
+        nonlocal en_cours, maximum
+        contenu = json.loads(request.content)["messages"][1]["content"]
+        if "ERREUR" in contenu:
+            return httpx.Response(400, json={"error": "bad request"})
+        en_cours += 1
+        maximum = max(maximum, en_cours)
+        await asyncio.sleep(0.02)
+        en_cours -= 1
+        numero = contenu.split("#")[1]
+        return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps({"ID_commande": f"CMD{numero}"})}}]})
+
+    items = [{"email": f"Fournisseur : AJDIR\nlot #{i:06d}", "sender_email": "a@b.ma"} for i in range(12)]
+    items[3] = "pas un objet"
+    items[7] = {"email": "ERREUR de lot"}
+    items[9] = {"sender_email": "vide@b.ma"}
+
+    monkeypatch.setattr(function_app, "BATCH_MAX_CONCURRENCY", 3)
+
+    async def envoyer():
+        installer_client(handler)
+        req = func.HttpRequest(
+            method="POST",
+            url="/api/analyze_email_and_pdf_batch",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps(items).encode()
+        )
+        return await function_app.batch(req)
+
+    resp = asyncio.run(envoyer())
+    assert resp.status_code == 200
+    resultats = json.loads(resp.get_body())["resultats"]
+    assert [r["index"] for r in resultats] == list(range(12))
+    assert resultats[0]["resultat"]["ID_commande"] == "CMD000000"
+    assert resultats[11]["resultat"]["ID_commande"] == "CMD000011"
+    assert resultats[3]["status_code"] == 400
+    assert resultats[7]["status_code"] == 500
+    assert resultats[9]["status_code"] == 400
+    assert 1 < maximum <= 3
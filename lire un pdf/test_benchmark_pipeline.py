@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du benchmark de bout en bout (corpus synthétique, stub OpenAI, comparaison aux références)
+"""
+
+import stub_openai
+from benchmark_pipeline import comparer, ecart, generer_corpus
+from function_app import ParsedPdf, extract_order_id_from_pdf
+
+
+def test_corpus_et_stub():
+    """Les PDF générés contiennent l'ID attendu et le stub répond au format chat/completions"""
+    corpus = generer_corpus()
+    assert len(corpus) == 15
+    cas = corpus[0]
+    with ParsedPdf(cas["pdf"]) as pdf:
+        assert extract_order_id_from_pdf(pdf) == cas["id_commande"]
+    reponse = stub_openai.repondre({"messages": [{"role": "user", "content": cas["email"]}]})
+    assert cas["date_livraison"] in reponse["choices"][0]["message"]["content"]
+
+
+def test_comparaison_aux_references():
+    """Seuls les ralentissements au-delà de la tolérance sont signalés"""
+    reference = {"mesures_ms": {"1p": {"main": 10.0, "extract_order_id_from_pdf": 0.01}}}
+    actuel = {"mesures_ms": {"1p": {"main": 14.0, "extract_order_id_from_pdf": 0.04}}}
+    assert comparer(actuel, reference, 0.25) == [("1p", "main", 10.0, 14.0)]
+    assert comparer(actuel, reference, 0.5) == []
+
+
+def test_reference_nulle():
+    """Une étape mesurée à 0 ms dans la référence est signalée avec un écart absolu"""
+    reference = {"mesures_ms": {"1p": {"main": 0.0}}}
+    actuel = {"mesures_ms": {"1p": {"main": 2.5}}}
+    assert comparer(actuel, reference, 0.25) == [("1p", "main", 0.0, 2.5)]
+    assert ecart(0.0, 2.5) == "+2.500 ms" and ecart(10.0, 14.0) == "+40%"
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la coalescence des analyses identiques simultanées (même worker et workers de la même machine)
+"""
+
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import pytest
+
+import function_app
+import stub_openai
+from function_app import ResultCache
+
+EMAIL = "Bonjour, la commande CMD20250042 sera livrée le 12/10/2025.\nFournisseur : IMPRIMERIE AJDIR"
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Stub OpenAI lent qui compte ses appels ; cache désactivé pour ne mesurer que la coalescence"""
+    appels = []
+
+    async def handler(request):
+        appels.append(request)
+        await asyncio.sleep(0.1)
+        return httpx.Response(200, json=stub_openai.repondre(json.loads(request.content)))
+
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    monkeypatch.setattr(function_app, "DETERMINISTIC_TIER", False)
+    monkeypatch.setattr(function_app, "OPENAI_ROUTER", None)
+    monkeypatch.setattr(function_app, "AZURE_OPENAI_ENDPOINT", "https://stub.openai.local")
+    monkeypatch.setattr(function_app, "_openai_client", None)
+    monkeypatch.setattr(function_app, "ANALYSIS_SINGLE_FLIGHT", function_app.SingleFlight())
+    for nom in function_app.COALESCE_STATS:
+        monkeypatch.setitem(function_app.COALESCE_STATS, nom, 0)
+    return handler, appels
+
+
+def executer(handler, coroutine_factory):
+    async def scenario():
+        function_app._openai_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        function_app._openai_client_loop = asyncio.get_running_loop()
+        try:
+            return await coroutine_factory()
+        finally:
+            await function_app._openai_client.aclose()
+    return asyncio.run(scenario())
+
+
+def test_doublons_simultanes_un_seul_appel(stub):
+    """Trois analyses identiques simultanées : un appel OpenAI, trois résultats égaux mais distincts"""
+    handler, appels = stub
+    resultats = executer(handler, lambda: asyncio.gather(*[function_app.analyze_user_content(EMAIL) for _ in range(3)]))
+    assert len(appels) == 1
+    assert resultats[0]["ID_commande"] == "CMD20250042"
+    assert resultats[0] == resultats[1] == resultats[2]
+    assert resultats[1] is not resultats[0]
+    assert function_app.collect_metrics()["coalescence"] == {
+        "calculs": 1, "attentes": 2, "attentes_inter_workers": 0, "verrous_expires": 0, "en_cours": 0}
+
+
+def test_erreur_partagee_puis_nouveau_calcul(stub, monkeypatch):
+    """L'échec du calcul est remonté à tous les appelants ; l'appel suivant recalcule"""
+    handler, appels = stub
+    monkeypatch.setattr(function_app, "OPENAI_MAX_RETRIES", 1)
+    monkeypatch.setattr(function_app, "OPENAI_CIRCUIT", function_app.CircuitBreaker(threshold=10))
+
+    async def panne(request):
+        appels.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(400, json={"error": {"code": "400"}})
+
+    async def scenario():
+        erreurs = await asyncio.gather(*[function_app.analyze_user_content(EMAIL) for _ in range(2)],
+                                       return_exceptions=True)
+        function_app._openai_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return erreurs, await function_app.analyze_user_content(EMAIL)
+
+    erreurs, resultat = executer(panne, scenario)
+    assert all(isinstance(erreur, httpx.HTTPStatusError) for erreur in erreurs)
+    assert resultat["ID_commande"] == "CMD20250042"
+    assert len(appels) == 2 and len(function_app.ANALYSIS_SINGLE_FLIGHT) == 0
+
+
+def test_resultat_d_un_autre_worker(stub, monkeypatch, tmp_path):
+    """Un verrou tenu par un autre worker : on attend le résultat qu'il dépose au lieu d'appeler OpenAI"""
+    handler, appels = stub
+    monkeypatch.setattr(function_app, "ANALYSIS_COALESCE_DIR", str(tmp_path))
+    cle = function_app.analysis_key(EMAIL)
+    verrou = tmp_path / f"{cle}.lock"
+    verrou.touch()
+
+    async def autre_worker():
+        await asyncio.sleep(0.15)
+        (tmp_path / f"{cle}.json").write_text(json.dumps({"ID_commande": "CMD20250042", "source": "autre worker"}))
+        verrou.unlink()
+
+    async def scenario():
+        resultat, _ = await asyncio.gather(function_app.analyze_user_content(EMAIL), autre_worker())
+        return resultat
+
+    assert executer(handler, scenario)["source"] == "autre worker"
+    assert not appels and function_app.COALESCE_STATS["attentes_inter_workers"] == 1
+
+
+def test_verrou_abandonne(stub, monkeypatch, tmp_path):
+    """Un verrou plus ancien que le délai (worker arrêté) est ignoré ; le résultat est déposé pour les autres"""
+    handler, appels = stub
+    monkeypatch.setattr(function_app, "ANALYSIS_COALESCE_DIR", str(tmp_path))
+    monkeypatch.setattr(function_app, "ANALYSIS_COALESCE_TIMEOUT", 5)
+    ancien = time.time() - 60
+    for nom in ("abandonne.lock", "expire.json"):
+        (tmp_path / nom).touch()
+        os.utime(tmp_path / nom, (ancien, ancien))
+    # Le verrou abandonné est placé sur la clé même de l'analyse
+    original = function_app.coalesce_across_workers
+
+    async def avec_verrou_abandonne(key, factory):
+        (tmp_path / "abandonne.lock").rename(tmp_path / f"{key}.lock")
+        return await original(key, factory)
+
+    monkeypatch.setattr(function_app, "coalesce_across_workers", avec_verrou_abandonne)
+    resultat = executer(handler, lambda: function_app.analyze_user_content(EMAIL))
+    assert resultat["ID_commande"] == "CMD20250042" and len(appels) == 1
+    assert function_app.COALESCE_STATS["verrous_expires"] == 1
+    fichiers = sorted(p.suffix for p in tmp_path.iterdir())
+    assert fichiers == [".json"]  # verrou libéré, résultat expiré supprimé
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la normalisation des dates françaises (formats numériques, mois en toutes lettres, repli dateutil)
+"""
+
+from datetime import datetime
+
+import function_app
+from function_app import normalize_date, parse_date
+
+
+def test_formats_numeriques():
+    """Barres ou tirets, années sur deux ou quatre chiffres, dates impossibles refusées"""
+    assert normalize_date("12/10/2025") == "12/10/2025"
+    assert normalize_date("5-6-25") == "05/06/2025"
+    assert normalize_date(" 7/8/2025 ") == "07/08/2025"
+    assert normalize_date("31/02/2025") is None
+    assert normalize_date("12/13/2025") is None
+    assert normalize_date("29/02/24") == "29/02/2024"
+    assert normalize_date("2025-10-12") == "12/10/2025"
+
+
+def test_separateurs_melanges():
+    """« 7/8-2025 » n'est accepté que si on l'autorise (repli sur toutes les dates du texte)"""
+    assert normalize_date("7/8-2025") == "07/08/2025"
+    assert normalize_date("7/8-2025", mixed_separators=False) is None
+
+
+def test_mois_en_toutes_lettres():
+    """Noms complets, abréviations avec ou sans point, sans accents, « 1er »"""
+    assert normalize_date("22 octobre 2025") == "22/10/2025"
+    assert normalize_date("3 Mai 2025") == "03/05/2025"
+    assert normalize_date("12 oct. 2025") == "12/10/2025"
+    assert normalize_date("1er février 2026") == "01/02/2026"
+    assert normalize_date("15 aout 2025") == "15/08/2025"
+    assert normalize_date("4 sept 2025") == "04/09/2025"
+    assert normalize_date("31 avril 2025") is None
+
+
+def test_repli_dateutil_pour_les_formes_inconnues():
+    """Les formes non reconnues passent par dateutil, sans lecture floue"""
+    assert parse_date("12.10.2025") == datetime(2025, 10, 12)
+    assert parse_date("12 Oct 2025 14:30") == datetime(2025, 10, 12, 14, 30)
+    assert parse_date("bientôt") is None
+
+
+def test_memoisation():
+    """Une même chaîne n'est analysée qu'une fois"""
+    parse_date.cache_clear()
+    for _ in range(100):
+        parse_date("18/11/2025")
+    informations = parse_date.cache_info()
+    assert informations.misses == 1 and informations.hits == 99
+    assert informations.maxsize == function_app.DATE_CACHE_SIZE
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Corpus de non-régression : la nouvelle extraction des dates de livraison (motifs précompilés,
+contexte borné) doit donner les mêmes résultats que l'ancienne implémentation à base de re.findall.
+Seules les dates à mois en toutes lettres diffèrent : l'ancienne version les confiait à dateutil,
+qui ne connaît pas les mois français (« 5 mai 2025 » devenait le 5 du mois courant, ou une erreur).
+"""
+
+import random
+import time
+
+from function_app import DATE_MONTH_NAME_RE, extract_delivery_date_intelligent
+# Copie de l'ancienne implémentation, conservée dans le script de démonstration
+from test_intelligence import extract_delivery_date_intelligent as extract_delivery_date_legacy
+
+CORPUS = [
+    "la commande ne sera pas livrée avant le 12/10/25",
+    "la nouvelle date de livraison est le 12/10/2025",
+    "Suite à un problème, la livraison de votre commande est reportée au 20/10/2025",
+    "on ne pourra pas livrer avant le 25/10",
+    "Livraison le 30/10/2025",
+    "Votre commande TAC ETAC60JDF est en production.\nLivraison prévue pour le 15/10/2025.",
+    "Il ne sera pas possible de livrer avant le 18/10/25. Nous faisons de notre mieux.",
+    "La commande sera disponible le 22 octobre 2025.",
+    "Impossible de livrer avant le 28/10. Désolé pour le contretemps.",
+    """
+    Bonjour,
+
+    Suite à votre commande BSK2506CF0383, nous avons rencontré des difficultés.
+
+    Initialement prévue pour le 10/10/2025, la livraison ne pourra pas être effectuée
+    avant le 12/10/25 en raison d'un problème de stock.
+
+    Nous nous excusons pour ce contretemps et faisons tout notre possible pour
+    respecter cette nouvelle échéance du 12/10/2025.
+
+    Cordialement,
+    IMPRIMERIE AJDIR
+    """,
+    "Délai de livraison : 30/10/2025",
+    "Retard de livraison, nouvelle date 05-11-2025",
+    "Le colis sera expédié le 03/11/2025",
+    "Prévu pour le 07/11/25",
+    "Livraison vers 14/11/2025",
+    "Fin de semaine prochaine, soit le 21/11/2025",
+    "Commande du 23/06/2025, livraison estimée au 29/07/2025",
+    "Date de commande : 01/02/2025\nDate : 31/02/2025\nTotal 15/03/2025",
+    "Livraison prévue le\n12/12/2025",
+    "livraison\n\nle 03/03/2026",
+    "prêt au 5-6-2025 ou 7/8-2025",
+    "Bon de commande 12 mai 2025, réception 3 juin 2025",
+    "aucune date dans ce message",
+    "",
+]
+
+FRAGMENTS = [
+    "la commande", "ne sera pas", "livrée", "avant le", "le", "livraison", "prévue", "pour le", "au",
+    "reportée", "délai", "retard", "disponible", "prêt", "colis", "expédié", "prévu", "dans", "en", "vers",
+    "autour de", "fin", "début", "mi", "semaine", "mois", "prochaine", "suivante", "bonjour", "cordialement",
+    "pas de", "impossible de", "ne pourra pas", "\n", "\n\n", ",", ".", "12/10/25", "15/10/2025",
+    "32/10/2025", "1-2-2025", "3/4-2025", "20/10/2025", "10/10/2025", "5 mai 2025", "12 oct 2025",
+]
+
+
+def corpus_synthetique(taille=2000, graine=0):
+    """Phrases aléatoires mêlant mots-clés de livraison et dates valides ou invalides"""
+    rnd = random.Random(graine)
+    return [" ".join(rnd.choice(FRAGMENTS) for _ in range(rnd.randint(1, 25))) for _ in range(taille)]
+
+
+def test_memes_resultats_que_l_ancienne_version():
+    """Résultats identiques sur le corpus réel et le corpus synthétique, hors dates à mois en toutes lettres"""
+    for texte in CORPUS + corpus_synthetique():
+        if DATE_MONTH_NAME_RE.search(texte):
+            continue
+        assert extract_delivery_date_intelligent(texte) == extract_delivery_date_legacy(texte), repr(texte)
+
+
+def test_mois_en_toutes_lettres():
+    """Les mois français, complets ou abrégés, sont lus correctement en l'absence de phrase de livraison"""
+    assert extract_delivery_date_intelligent("La commande sera disponible le 22 octobre 2025.") == "22/10/2025"
+    assert extract_delivery_date_intelligent("Bon de commande 12 mai 2025, réception 3 juin 2025") == "03/06/2025"
+    assert extract_delivery_date_intelligent("Commande du 1-2-2025, prête le 12 oct. 2025") == "12/10/2025"
+    assert extract_delivery_date_intelligent("Livraison le 30/10/2025 (commande du 5 mai 2025)") == "30/10/2025"
+
+
+def test_temps_lineaire_sur_long_pdf():
+    """Une longue ligne pleine de mots-clés sans date ne provoque plus de retours arrière"""
+    texte = "la livraison de la commande prévue " * 10000
+    debut = time.perf_counter()
+    assert extract_delivery_date_intelligent(texte) is None
+    assert time.perf_counter() - debut < 1.0
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du niveau d'extraction déterministe placé avant OpenAI
+"""
+
+import asyncio
+import json
+
+import httpx
+
+import function_app
+
+BC_COMPLET = """Fournisseur : IMPRIMERIE AJDIR
+Bon de commande N° BSK2506CF0383
+Date de commande : 23/06/2025
+Livraison prévue pour le 29/07/2025"""
+
+
+def analyser(installer_client, texte, handler):
+    async def scenario():
+        installer_client(handler)
+        return await function_app.analyze_user_content(texte)
+    return asyncio.run(scenario())
+
+
+def test_bc_bien_forme_sans_openai(installer_client):
+    """Tous les champs sont trouvés par les regex : OpenAI n'est pas appelé"""
+    def handler(request):
+        raise AssertionError("OpenAI ne doit pas être appelé")
+
+    avant = function_app.collect_metrics()["extraction_deterministe"]["sans_llm"]
+    resultat = analyser(installer_client, BC_COMPLET, handler)
+    assert resultat == {
+        "ID_commande": "BSK2506CF0383",
+        "nom_fournisseur": "IMPRIMERIE AJDIR",
+        "date_reception": "23/06/2025",
+        "date_livraison": "29/07/2025"
+    }
+    metriques = function_app.collect_metrics()["extraction_deterministe"]
+    assert metriques["sans_llm"] == avant + 1
+    assert metriques["part_sans_llm"] > 0
+
+
+def test_seuls_les_champs_manquants_sont_demandes(installer_client):
+    """Le prompt envoyé ne porte que sur les champs incertains"""
+    prompts = []
+
+    def handler(request):
+        prompts.append(json.loads(request.content)["messages"][0]["content"])
+        contenu = json.dumps({"nom_fournisseur": "IMPRIMERIE AJDIR", "date_reception": None})
+        return httpx.Response(200, json={"choices": [{"message": {"content": contenu}}]})
+
+    texte = "Fournisseur : contact@ajdir.ma\nCommande TAC ETAC60JDF\nLivraison le 30/10/2025"
+    resultat = analyser(installer_client, texte, handler)
+    assert len(prompts) == 1
+    assert "Nom du fournisseur" in prompts[0] and "Date de réception" in prompts[0]
+    assert "ID de la commande" not in prompts[0]
+    assert resultat["ID_commande"] == "TAC ETAC60JDF"
+    assert resultat["nom_fournisseur"] == "IMPRIMERIE AJDIR"
+    assert resultat["date_livraison"] == "30/10/2025"
+
+
+def test_indice_temporel_confirme_par_openai(installer_client):
+    """Une date trouvée après « mois », « en »... n'évite pas OpenAI : la date de livraison lui est demandée"""
+    prompts = []
+
+    def handler(request):
+        prompts.append(json.loads(request.content)["messages"][0]["content"])
+        contenu = json.dumps({"date_livraison": None, "nom_fournisseur": None, "date_reception": "03/06/2025"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": contenu}}]})
+
+    texte = "Fournisseur : IMPRIMERIE AJDIR\nCommande BSK2506CF0384 du mois de juin, passée le 03/06/2025. Livraison à confirmer."
+    champs = function_app.deterministic_extraction(texte)
+    assert champs["date_livraison"][1] < function_app.DETERMINISTIC_CONFIDENCE
+    analyser(installer_client, texte, handler)
+    assert len(prompts) == 1 and "Date de livraison" in prompts[0]
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du découpage des fils de discussion et de l'écartement des messages cités déjà analysés
+"""
+
+from function_app import ResultCache, conversation_key, split_email_thread, strip_email_thread
+import function_app
+
+PREMIER = """Bonjour,
+
+Votre commande BSK2506CF0383 sera livrée le 12/07/2025.
+
+Cordialement,
+IMPRIMERIE AJDIR"""
+
+SECOND = f"""Bonjour,
+
+Suite à un retard, la livraison est reportée au 20/07/2025.
+
+Cordialement,
+IMPRIMERIE AJDIR
+
+Le lun. 30 juin 2025 à 10:12, IMPRIMERIE AJDIR <contact@ajdir.ma> a
+écrit :
+> {PREMIER.replace(chr(10), chr(10) + "> ")}"""
+
+OUTLOOK = f"""Nouvelle date : 25/07/2025.
+
+-----Message d'origine-----
+De : Achats <achats@client.ma>
+Envoyé : mardi 1 juillet 2025 09:00
+À : IMPRIMERIE AJDIR
+Objet : RE: Commande BSK2506CF0383
+
+Merci de confirmer la date.
+
+{SECOND}"""
+
+
+def test_decoupage_des_entetes_de_citation():
+    """Les en-têtes « a écrit » (même coupés), Outlook et De/Envoyé séparent les messages"""
+    assert split_email_thread(PREMIER) == [PREMIER]
+    segments = split_email_thread(SECOND)
+    assert len(segments) == 2 and "20/07/2025" in segments[0] and "12/07/2025" in segments[1]
+    segments = split_email_thread(OUTLOOK)
+    assert len(segments) == 3 and segments[0] == "Nouvelle date : 25/07/2025."
+
+
+def test_messages_deja_vus_ecartes(monkeypatch):
+    """Le message cité déjà analysé dans la conversation n'est plus renvoyé"""
+    monkeypatch.setattr(function_app, "THREAD_MEMORY", ResultCache())
+    cle = conversation_key({"subject": "RE: TR: Commande BSK2506CF0383"}, "Contact@Ajdir.ma")
+    assert cle == conversation_key({"subject": "Commande BSK2506CF0383"}, "contact@ajdir.ma")
+
+    assert strip_email_thread(PREMIER, cle) == PREMIER
+    reponse = strip_email_thread(SECOND, cle)
+    assert "20/07/2025" in reponse and "12/07/2025" not in reponse
+    # Sans conversation connue, la citation est gardée
+    assert "12/07/2025" in strip_email_thread(SECOND, None)
+
+
+def test_historique_recopie_dans_le_meme_email(monkeypatch):
+    """Une citation présente deux fois dans l'email n'est gardée qu'une fois"""
+    monkeypatch.setattr(function_app, "THREAD_MEMORY", ResultCache())
+    texte = OUTLOOK + "\n\nOn Mon, Jun 30, 2025 at 10:12 AM Ajdir wrote:\n" + PREMIER
+    resultat = strip_email_thread(texte)
+    assert resultat.count("12/07/2025") == 1
+    assert resultat.startswith("Nouvelle date : 25/07/2025.")
+
+
+def test_renvoi_identique_inchange(monkeypatch):
+    """Un email renvoyé à l'identique (reprise Power Automate) garde ses citations et donne le même prompt"""
+    monkeypatch.setattr(function_app, "THREAD_MEMORY", ResultCache())
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=1))
+    cle = conversation_key({"conversation_id": "AAQk-42"}, "contact@ajdir.ma")
+    premier_envoi = strip_email_thread(SECOND, cle)
+    assert "BSK2506CF0383" in premier_envoi and "IMPRIMERIE AJDIR" in premier_envoi
+    function_app.RESULT_CACHE.set("autre", {"choices": []})  # le cache des résultats n'évince pas la mémoire
+    assert strip_email_thread(SECOND, cle) == premier_envoi
+    # Un email suivant de la conversation écarte bien la citation déjà vue
+    suivant = strip_email_thread(OUTLOOK, cle)
+    assert "Nouvelle date" in suivant and "12/07/2025" not in suivant
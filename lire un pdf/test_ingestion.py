@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'ingestion des PDF à mémoire bornée (limites de taille et de pages, décodage par morceaux)
+"""
+
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+
+import azure.functions as func
+import fitz
+import pytest
+
+import function_app
+from function_app import AnalysisError, decode_base64_pdf
+
+
+def pdf_de_test(nb_pages=2, piece_jointe=0):
+    """PDF texte, éventuellement alourdi par une pièce jointe incompressible"""
+    doc = fitz.open()
+    for numero in range(nb_pages):
+        doc.new_page().insert_text((72, 72), f"Bon de commande BSK2506CF0383 page {numero + 1}")
+    if piece_jointe:
+        doc.embfile_add("annexe.bin", os.urandom(piece_jointe))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_petit_pdf_decode_en_memoire():
+    """Un petit PDF reste en mémoire, le base64 avec retours à la ligne est accepté"""
+    encode = base64.encodebytes(pdf_de_test()).decode()
+    with decode_base64_pdf(encode) as pdf:
+        assert isinstance(pdf.source, bytes)
+        assert "BSK2506CF0383" in pdf.full_text
+
+
+def test_gros_pdf_passe_par_un_fichier_temporaire(monkeypatch):
+    """Au-delà du seuil, le PDF est écrit sur disque puis supprimé à la fermeture"""
+    monkeypatch.setattr(function_app, "PDF_SPOOL_THRESHOLD", 10_000)
+    monkeypatch.setattr(function_app, "PDF_DECODE_CHUNK", 4096)
+    data = pdf_de_test(piece_jointe=100_000)
+    pdf = decode_base64_pdf(base64.b64encode(data).decode())
+    chemin = pdf.source
+    assert isinstance(chemin, str) and os.path.getsize(chemin) == len(data)
+    assert pdf.page_count == 2 and "page 2" in pdf.page_text(1)
+    pdf.close()
+    assert not os.path.exists(chemin)
+
+
+def test_limites_de_taille_et_de_pages(monkeypatch):
+    """Les PDF trop gros ou trop longs sont refusés avec un 413"""
+    monkeypatch.setattr(function_app, "PDF_MAX_BYTES", 1000)
+    with pytest.raises(AnalysisError) as erreur:
+        decode_base64_pdf("A" * 4000)
+    assert erreur.value.status_code == 413
+
+    monkeypatch.setattr(function_app, "PDF_MAX_BYTES", 10_000_000)
+    monkeypatch.setattr(function_app, "PDF_MAX_PAGES", 3)
+    with pytest.raises(AnalysisError) as erreur:
+        decode_base64_pdf(base64.b64encode(pdf_de_test(nb_pages=5)).decode())
+    assert erreur.value.status_code == 413
+
+    req = func.HttpRequest(
+        method="POST",
+        url="/api/analyze_email_and_pdf",
+        headers={"Content-Type": "application/json"},
+        body=json.dumps({"email": "Commande", "pdf_base64": base64.b64encode(pdf_de_test(nb_pages=5)).decode()}).encode()
+    )
+    assert asyncio.run(function_app.main(req)).status_code == 413
+
+
+def test_base64_mime_a_la_limite(monkeypatch):
+    """Les retours à la ligne du base64 MIME ne comptent pas : un PDF de PDF_MAX_BYTES octets passe"""
+    data = pdf_de_test(piece_jointe=50_000)
+    monkeypatch.setattr(function_app, "PDF_MAX_BYTES", len(data))
+    with decode_base64_pdf(base64.encodebytes(data).decode()) as pdf:
+        assert pdf.size == len(data)
+    monkeypatch.setattr(function_app, "PDF_MAX_BYTES", len(data) - 1)
+    with pytest.raises(AnalysisError):
+        decode_base64_pdf(base64.encodebytes(data).decode())
+
+
+def test_route_pdf_sans_json():
+    """Le corps application/pdf n'est plus lu comme du JSON"""
+    req = func.HttpRequest(
+        method="POST",
+        url="/api/analyze_email_and_pdf",
+        headers={"Content-Type": "application/pdf"},
+        body=pdf_de_test(piece_jointe=2000)
+    )
+    resp = asyncio.run(function_app.main(req))
+    assert resp.status_code == 200
+    assert json.loads(resp.get_body())["ID_commande"] == "BSK2506CF0383"
+
+
+DOSSIER = os.path.dirname(os.path.abspath(__file__))
+
+# Exécuté dans un processus neuf : hausse du pic de RSS (VmHWM, en Ko) pendant l'ingestion, tampons C de
+# PyMuPDF compris. Le pic est remis à zéro juste avant (clear_refs) : ru_maxrss garderait celui de la
+# lecture du fichier, et celui du processus parent quand subprocess passe par vfork.
+SCRIPT_RSS = """
+import base64, re, sys
+import function_app
+
+def pic():
+    with open("/proc/self/status") as status:
+        return int(re.search(r"VmHWM:\\s+(\\d+)", status.read()).group(1))
+
+encode = open(sys.argv[2]).read()
+function_app.fitz.open().close()  # PyMuPDF chargé avant la mesure
+with open("/proc/self/clear_refs", "w") as clear_refs:
+    clear_refs.write("5")
+avant = pic()
+if sys.argv[1] == "complet":
+    pdf = function_app.ParsedPdf(base64.b64decode(encode))
+else:
+    pdf = function_app.decode_base64_pdf(encode)
+pdf.full_text
+print(pic() - avant)
+pdf.close()
+"""
+
+
+def pic_rss(mode, chemin):
+    """Hausse du pic de RSS (Ko) d'un processus neuf qui ingère le base64 du fichier `chemin`"""
+    sortie = subprocess.run([sys.executable, "-c", SCRIPT_RSS, mode, chemin], cwd=DOSSIER,
+                            capture_output=True, text=True, check=True)
+    return int(sortie.stdout.split()[-1])
+
+
+@pytest.mark.skipif(not os.access("/proc/self/clear_refs", os.W_OK), reason="pic de RSS mesuré via /proc (Linux)")
+def test_pic_memoire_inferieur_au_decodage_complet(tmp_path):
+    """Le décodage par morceaux fait nettement moins monter le pic de RSS qu'un b64decode complet"""
+    chemin = tmp_path / "pdf.b64"
+    chemin.write_text(base64.b64encode(pdf_de_test(piece_jointe=8 * 1024 * 1024)).decode())
+    complet = pic_rss("complet", str(chemin))
+    morceaux = pic_rss("morceaux", str(chemin))
+    assert morceaux < complet / 2, (complet, morceaux)
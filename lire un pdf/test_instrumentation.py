@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'instrumentation par étape (dimensions personnalisées et en-tête Server-Timing)
+"""
+
+import asyncio
+import base64
+import json
+import logging
+
+import azure.functions as func
+import fitz
+import httpx
+
+import function_app
+import stub_openai
+from function_app import ResultCache, StageTimer
+
+
+def test_chronometre():
+    """Les durées d'une même étape se cumulent et les métriques s'additionnent"""
+    timer = StageTimer()
+    with timer.stage("pdf"):
+        pass
+    with timer.stage("pdf"):
+        pass
+    timer.add("total_tokens", 10)
+    timer.add("total_tokens", 5)
+    dimensions = timer.custom_dimensions()
+    assert set(dimensions) == {"duree_pdf_ms", "total_tokens", "duree_totale_ms"}
+    assert dimensions["total_tokens"] == 15
+    assert timer.server_timing().startswith("pdf;dur=")
+    # Hors invocation, l'instrumentation n'a aucun effet
+    with function_app.timed_stage("pdf"):
+        function_app.record_metric("pdf_pages", 1)
+
+
+def test_dimensions_et_server_timing(monkeypatch, caplog):
+    """Une analyse email + PDF journalise chaque étape, les tailles et les tokens OpenAI"""
+    monkeypatch.setattr(function_app, "SERVER_TIMING_HEADER", True)
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    doc = fitz.open()
+    for _ in range(3):
+        doc.new_page().insert_text((72, 72), "Bon de commande CMD20250042")
+    pdf_bytes = doc.tobytes()
+    doc.close()
+
+    async def scenario():
+        monkeypatch.setattr(function_app, "AZURE_OPENAI_ENDPOINT", "https://stub.openai.local")
+        monkeypatch.setattr(function_app, "_openai_client", httpx.AsyncClient(transport=stub_openai.transport()))
+        monkeypatch.setattr(function_app, "_openai_client_loop", asyncio.get_running_loop())
+        req = func.HttpRequest(
+            method="POST",
+            url="/api/analyze_email_and_pdf",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps({"email": "Bonjour, la commande partira bientôt.",
+                             "pdf_base64": base64.b64encode(pdf_bytes).decode()}).encode()
+        )
+        return await function_app.main(req)
+
+    with caplog.at_level(logging.INFO):
+        resp = asyncio.run(scenario())
+    assert resp.status_code == 200
+    etapes = [entree.split(";")[0] for entree in resp.headers["Server-Timing"].split(", ")]
+    assert etapes == ["lecture", "decodage", "pdf", "prompt", "deterministe", "openai", "post_traitement", "total"]
+
+    dimensions = next(r.custom_dimensions for r in caplog.records if hasattr(r, "custom_dimensions"))
+    assert dimensions["pdf_octets"] == len(pdf_bytes) and dimensions["pdf_pages"] == 3
+    assert dimensions["openai_tentatives"] == 1 and dimensions["total_tokens"] > 0
+    assert dimensions["prompt_caracteres"] > 0 and dimensions["status_code"] == 200
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du mode asynchrone (202 + file + statut). Le parcours complet nécessite Azurite :
+    azurite --silent --location /tmp/azurite
+"""
+
+import asyncio
+import json
+import socket
+
+import azure.functions as func
+import httpx
+import pytest
+
+import function_app
+import stub_openai
+from function_app import ResultCache
+
+
+def azurite_disponible():
+    try:
+        socket.create_connection(("127.0.0.1", 10000), timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+
+class Sortie(func.Out):
+    """Liaison de sortie de file : garde le message posé par la fonction"""
+
+    def __init__(self):
+        self.valeur = None
+
+    def set(self, val):
+        self.valeur = val
+
+    def get(self):
+        return self.valeur
+
+
+def soumettre(body: bytes):
+    queue = Sortie()
+    req = func.HttpRequest(method="POST", url="/api/analyze_email_and_pdf_async",
+                           headers={"Content-Type": "application/json"}, body=body)
+    return asyncio.run(function_app.submit_job(req, queue)), queue
+
+
+def statut(job_id):
+    req = func.HttpRequest(method="GET", url=f"/api/analyze_jobs/{job_id}", body=b"",
+                           route_params={"job_id": job_id})
+    return asyncio.run(function_app.job_status(req))
+
+
+def test_validation_avant_stockage(monkeypatch):
+    """Corps invalide ou trop gros, identifiant malformé : aucune écriture dans le stockage"""
+    monkeypatch.setattr(function_app, "_job_store", object())  # tout accès au stockage échouerait
+    resp, queue = soumettre(b"pas du json")
+    assert resp.status_code == 400 and queue.get() is None
+    monkeypatch.setattr(function_app, "PDF_MAX_BYTES", 10)
+    resp, queue = soumettre(b"{" + b" " * 2_000_000 + b"}")
+    assert resp.status_code == 413 and queue.get() is None
+    assert statut("../../autre-conteneur").status_code == 404
+
+
+@pytest.mark.skipif(not azurite_disponible(), reason="Azurite n'est pas démarré")
+def test_parcours_complet_avec_azurite(monkeypatch):
+    """Soumission, traitement par le déclencheur de file puis lecture du résultat"""
+    monkeypatch.setenv("AzureWebJobsStorage", "UseDevelopmentStorage=true")
+    monkeypatch.setattr(function_app, "_job_store", None)
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    monkeypatch.setattr(function_app, "AZURE_OPENAI_ENDPOINT", "https://stub.openai.local")
+
+    resp, queue = soumettre(json.dumps({"email": "Commande CMD20250042, livraison le 12/10/2025"}).encode())
+    assert resp.status_code == 202
+    job_id = json.loads(resp.get_body())["job_id"]
+    assert queue.get() == job_id and resp.headers["Location"] == f"/api/analyze_jobs/{job_id}"
+    assert json.loads(statut(job_id).get_body())["statut"] == "en_attente"
+
+    async def traiter():
+        monkeypatch.setattr(function_app, "_openai_client", httpx.AsyncClient(transport=stub_openai.transport()))
+        monkeypatch.setattr(function_app, "_openai_client_loop", asyncio.get_running_loop())
+        await function_app.process_job(func.QueueMessage(body=job_id))
+
+    asyncio.run(traiter())
+    document = json.loads(statut(job_id).get_body())
+    assert document["statut"] == "termine" and document["status_code"] == 200
+    assert document["resultat"]["ID_commande"] == "CMD20250042"
+    assert function_app.get_job_store().load_payload(job_id) is None
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'envoi de l'email et des PDF en multipart/form-data (parties binaires, sans base64)
+"""
+
+import asyncio
+import json
+import os
+import tracemalloc
+
+import azure.functions as func
+import fitz
+import httpx
+import pytest
+
+import function_app
+import stub_openai
+from function_app import ResultCache
+
+
+def pdf_de_test(texte, piece_jointe=0):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), texte)
+    if piece_jointe:
+        doc.embfile_add("annexe.bin", os.urandom(piece_jointe))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def requete_multipart(champs, fichiers):
+    """HttpRequest multipart/form-data construite comme l'enverrait un client HTTP"""
+    construite = httpx.Request("POST", "http://localhost/api/analyze_email_and_pdf", data=champs, files=fichiers)
+    return func.HttpRequest(method="POST", url="/api/analyze_email_and_pdf",
+                            headers={"Content-Type": construite.headers["Content-Type"]}, body=construite.read())
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    """Stub OpenAI qui garde les messages utilisateur reçus"""
+    recus = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        recus.append(body["messages"][-1]["content"])
+        return httpx.Response(200, json=stub_openai.repondre(body))
+
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    monkeypatch.setattr(function_app, "DETERMINISTIC_TIER", False)
+    monkeypatch.setattr(function_app, "OPENAI_ROUTER", None)
+    monkeypatch.setattr(function_app, "AZURE_OPENAI_ENDPOINT", "https://stub.openai.local")
+    monkeypatch.setattr(function_app, "_openai_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return recus
+
+
+def appeler(req):
+    async def scenario():
+        function_app._openai_client_loop = asyncio.get_running_loop()
+        return await function_app.main(req)
+    return asyncio.run(scenario())
+
+
+def test_email_et_plusieurs_pdf(prompts):
+    """Chaque PDF joint en binaire est analysé et ajouté au prompt"""
+    req = requete_multipart(
+        {"email": "Bonjour, voir les BC joints. Livraison le 12/10/2025.", "sender_email": "contact@ajdir.ma"},
+        [("pdf", ("bc1.pdf", pdf_de_test("Bon de commande BSK2506CF0383"), "application/pdf")),
+         ("pdf", ("bc2.pdf", pdf_de_test("Annexe : conditions de livraison"), "application/pdf"))],
+    )
+    resp = appeler(req)
+    assert resp.status_code == 200
+    assert json.loads(resp.get_body())["ID_commande"] == "BSK2506CF0383"
+    assert prompts[0].count("PIECE_JOINTE_PDF:") == 2
+    assert "BSK2506CF0383" in prompts[0] and "conditions de livraison" in prompts[0]
+
+
+def test_piece_jointe_illisible_ignoree(prompts):
+    """Une pièce jointe qui n'est pas un PDF est ignorée, l'email est analysé quand même"""
+    req = requete_multipart({"email": "Commande CMD20250042 livrée le 12/10/2025"},
+                            [("pdf", ("photo.jpg", b"\xff\xd8\xff" + b"0" * 2000, "image/jpeg"))])
+    resp = appeler(req)
+    assert resp.status_code == 200
+    assert "PIECE_JOINTE_PDF" not in prompts[0]
+
+
+def test_gros_pdf_recopie_sur_disque(prompts, monkeypatch):
+    """Au-delà du seuil, la partie binaire est recopiée dans un fichier temporaire"""
+    monkeypatch.setattr(function_app, "PDF_SPOOL_THRESHOLD", 10_000)
+    fichiers = []
+    lire = function_app.read_pdf_part
+    monkeypatch.setattr(function_app, "read_pdf_part", lambda partie: fichiers.append(lire(partie)) or fichiers[-1])
+    req = requete_multipart({"email": "BC joint"},
+                            [("pdf", ("bc.pdf", pdf_de_test("Bon de commande CMD20250042", 50_000), "application/pdf"))])
+    assert appeler(req).status_code == 200
+    assert isinstance(fichiers[0].source, str) and "CMD20250042" in prompts[0]
+
+
+def test_limites(prompts, monkeypatch):
+    """Trop de pièces jointes ou une pièce jointe trop lourde : 413"""
+    monkeypatch.setattr(function_app, "PDF_MAX_FILES", 2)
+    pdf = pdf_de_test("Bon de commande CMD20250042")
+    req = requete_multipart({"email": "BC joints"}, [("pdf", (f"bc{i}.pdf", pdf, "application/pdf")) for i in range(3)])
+    assert appeler(req).status_code == 413
+
+    monkeypatch.setattr(function_app, "PDF_MAX_BYTES", len(pdf) - 1)
+    req = requete_multipart({"email": "BC joint"}, [("pdf", ("bc.pdf", pdf, "application/pdf"))])
+    assert appeler(req).status_code == 413
+    assert not prompts
+
+
+def test_decoupage_sans_copie(monkeypatch):
+    """Les en-têtes usuels ne passent pas par le module email ; les pièces jointes sont des vues sur le corps"""
+    class SansAnalyseur:
+        def parsebytes(self, entetes):
+            raise AssertionError(f"analyse lente des en-têtes : {entetes!r}")
+
+    monkeypatch.setattr(function_app, "_MULTIPART_HEADER_PARSER", SansAnalyseur())
+    pdf = pdf_de_test("Bon de commande CMD20250042")
+    req = requete_multipart({"email": "Livraison le 12/10/2025", "subject": "RE: BC"},
+                            [("pdf", ("bc1.pdf", pdf, "application/pdf")), ("pdf", ("bc2.pdf", pdf, "application/pdf"))])
+    champs, pieces_jointes = function_app.read_multipart_request(req)
+    assert champs == {"email": "Livraison le 12/10/2025", "subject": "RE: BC"}
+    assert [bytes(piece) for piece in pieces_jointes] == [pdf, pdf]
+    assert all(piece.obj is req.get_body() for piece in pieces_jointes)
+
+
+def test_petite_piece_jointe_copiee_une_seule_fois(monkeypatch):
+    """Sous le seuil, les morceaux de la partie sont assemblés en une seule copie"""
+    monkeypatch.setattr(function_app, "PDF_DECODE_CHUNK", 64 * 1024)
+    pdf = pdf_de_test("Bon de commande CMD20250042", 1_000_000)
+    partie = memoryview(b"--entete--" + pdf)[10:]
+    tracemalloc.start()
+    try:
+        document = function_app.read_pdf_part(partie)
+        pic = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert document.source == pdf and isinstance(document.source, bytes)
+    document.close()
+    assert pic < 1.05 * len(pdf)  # une copie, sans les réallocations de BytesIO
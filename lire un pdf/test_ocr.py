@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du repli OCR pour les pages scannées (sans couche texte)
+"""
+
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+import pytest
+
+import function_app
+from function_app import ParsedPdf, ResultCache, extract_text_from_pdf
+
+
+def pdf_scanne():
+    """Page 1 : texte ; page 2 : image d'un texte (scan) ; page 3 : blanche"""
+    source = fitz.open()
+    source.new_page().insert_text((72, 100), "BON DE COMMANDE BSK2506CF0383", fontsize=24)
+    image = source[0].get_pixmap(dpi=150).tobytes("png")
+    source.close()
+
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Conditions générales de vente")
+    doc.new_page().insert_image(fitz.Rect(0, 0, 595, 842), stream=image)
+    doc.new_page()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_seules_les_pages_scannees_sont_reconnues(monkeypatch):
+    """Triage des pages, pool borné et cache par empreinte d'image"""
+    appels = []
+
+    def ocr_factice(png, language, tessdata=None):
+        appels.append(language)
+        return "BON DE COMMANDE BSK2506CF0383"
+
+    monkeypatch.setattr(function_app, "PDF_OCR", True)
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=16))
+    monkeypatch.setattr(function_app, "ocr_page_image", ocr_factice)
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(function_app, "get_ocr_pool", lambda: pool)
+
+    data = pdf_scanne()
+    with ParsedPdf(data) as pdf:
+        texte = extract_text_from_pdf(pdf)
+        assert texte.splitlines() == ["Conditions générales de vente", "BON DE COMMANDE BSK2506CF0383"]
+        assert function_app.extract_order_id_from_pdf(pdf) == "BSK2506CF0383"
+    assert appels == ["fra"]  # ni la page texte ni la page blanche
+
+    # Document renvoyé : l'OCR est servi par le cache
+    cache_avant = function_app.OCR_STATS["cache"]
+    with ParsedPdf(data) as pdf:
+        assert "BSK2506CF0383" in extract_text_from_pdf(pdf)
+    assert appels == ["fra"] and function_app.OCR_STATS["cache"] == cache_avant + 1
+    pool.shutdown()
+
+
+@pytest.mark.skipif(shutil.which("tesseract") is None, reason="Tesseract n'est pas installé")
+def test_ocr_tesseract(monkeypatch):
+    """Reconnaissance réelle par Tesseract dans le pool de processus"""
+    monkeypatch.setattr(function_app, "PDF_OCR", True)
+    monkeypatch.setattr(function_app, "PDF_OCR_LANGUAGE", "eng")
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    try:
+        with ParsedPdf(pdf_scanne()) as pdf:
+            assert "BSK2506CF0383" in extract_text_from_pdf(pdf)
+    finally:
+        function_app.shutdown_ocr_pool()
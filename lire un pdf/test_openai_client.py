@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du client OpenAI asynchrone (pool de connexions partagé)
+"""
+
+import asyncio
+import json
+
+import azure.functions as func
+import httpx
+
+import function_app
+import stub_openai
+from function_app import ResultCache
+
+
+def reponse_openai(contenu):
+    """Construit une réponse chat/completions minimale"""
+    return {"choices": [{"message": {"role": "assistant", "content": contenu}}]}
+
+
+def test_client_partage_entre_appels(installer_client):
+    """Plusieurs appels simultanés utilisent le même client"""
+    appels = []
+
+    async def handler(request):
+        appels.append(request.url.path)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json=reponse_openai("{}"))
+
+    async def scenario():
+        installer_client(handler)
+        client = function_app.get_openai_client()
+        resultats = await asyncio.gather(*[function_app.query_azure_openai(f"email {i}") for i in range(10)])
+        assert function_app.get_openai_client() is client
+        return resultats
+
+    resultats = asyncio.run(scenario())
+    assert len(appels) == 10
+    assert all(r["choices"][0]["message"]["content"] == "{}" for r in resultats)
+
+
+def test_main_asynchrone(installer_client):
+    """Le handler asynchrone renvoie le JSON extrait par OpenAI"""
+    contenu = json.dumps({
+        "ID_commande": "BSK2506CF0383",
+        "nom_fournisseur": "IMPRIMERIE AJDIR",
+        "date_reception": "23/06/2025",
+        "date_livraison": "29/07/2025"
+    })
+
+    async def handler(request):
+        return httpx.Response(200, json=reponse_openai(contenu))
+
+    async def scenario():
+        installer_client(handler)
+        req = func.HttpRequest(
+            method="POST",
+            url="/api/analyze_email_and_pdf",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps({"email": "Fournisseur : IMPRIMERIE AJDIR\nCommande BSK2506CF0383",
+                             "sender_email": "contact@ajdir.ma"}).encode()
+        )
+        return await function_app.main(req)
+
+    resp = asyncio.run(scenario())
+    assert resp.status_code == 200
+    assert json.loads(resp.get_body())["ID_commande"] == "BSK2506CF0383"
+
+
+def test_ancien_client_ferme_au_changement_de_boucle(installer_client, monkeypatch):
+    """Le client d'une boucle terminée (connexion keep-alive encore ouverte) est fermé quand il est remplacé"""
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    serveur, url = stub_openai.demarrer_serveur(stub_openai.StubConfig(latence="fixe:1"))
+    try:
+        monkeypatch.setattr(function_app, "AZURE_OPENAI_ENDPOINT", url)
+        monkeypatch.setattr(function_app, "HEADERS", {"Content-Type": "application/json"})
+
+        async def appel():
+            await function_app.query_azure_openai("Commande BSK2506CF0383")
+            return function_app.get_openai_client()
+
+        premier = asyncio.run(appel())
+        assert not premier.is_closed
+
+        async def sur_une_nouvelle_boucle():
+            client = await appel()
+            await asyncio.gather(*function_app._closing_clients)
+            return client
+
+        second = asyncio.run(sur_une_nouvelle_boucle())
+        assert second is not premier and premier.is_closed
+        asyncio.run(second.aclose())
+    finally:
+        serveur.shutdown()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du routage des appels OpenAI entre plusieurs déploiements (latence, quota, écartement des déploiements en échec)
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import function_app
+import stub_openai
+from function_app import OpenAIBackend, OpenAIRouter, ResultCache, parse_openai_backends
+
+
+def configurer(monkeypatch, *backends, essais=3):
+    """Routeur de test, sans cache ; un délai de reprise long révèle toute attente inutile"""
+    monkeypatch.setattr(function_app, "OPENAI_ROUTER", OpenAIRouter(list(backends)))
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    monkeypatch.setattr(function_app, "HEADERS", {"Content-Type": "application/json", "api-key": "defaut"})
+    monkeypatch.setattr(function_app, "OPENAI_MAX_RETRIES", essais)
+    monkeypatch.setattr(function_app, "retry_delay", lambda response, attempt: 5.0)
+
+
+def executer(handler, coroutine_factory):
+    async def scenario():
+        function_app._openai_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        function_app._openai_client_loop = asyncio.get_running_loop()
+        try:
+            return await coroutine_factory()
+        finally:
+            await function_app._openai_client.aclose()
+    return asyncio.run(scenario())
+
+
+def stub_par_hote(comportements, appels):
+    """Stub chat/completions dont la réponse dépend de l'hôte : statut HTTP fixe ou latence en secondes"""
+    async def handler(request):
+        hote = request.url.host
+        appels.append((hote, request.headers.get("api-key")))
+        comportement = comportements[hote]
+        if isinstance(comportement, int):
+            return httpx.Response(comportement, headers={"retry-after": "5"}, json={"error": {"code": str(comportement)}})
+        await asyncio.sleep(comportement)
+        return httpx.Response(200, json=stub_openai.repondre(json.loads(request.content)))
+    return handler
+
+
+def deploiement(nom, **options):
+    return OpenAIBackend(nom, f"https://{nom}.openai.local", "gpt-4o", api_key=f"cle-{nom}", api_version="2024-02-01",
+                         **options)
+
+
+def test_bascule_sur_un_autre_deploiement_sans_attendre(monkeypatch):
+    """Un 429 ou un 503 est repris aussitôt sur un autre déploiement, avec sa propre clé"""
+    sature, panne, sain = deploiement("sature"), deploiement("panne"), deploiement("sain")
+    configurer(monkeypatch, sature, panne, sain)
+    appels = []
+    handler = stub_par_hote({"sature.openai.local": 429, "panne.openai.local": 503, "sain.openai.local": 0.0}, appels)
+
+    debut = time.monotonic()
+    resultat = executer(handler, lambda: function_app.query_azure_openai("Commande CMD20250042"))
+    assert time.monotonic() - debut < 1
+    assert "CMD20250042" in resultat["choices"][0]["message"]["content"]
+    assert appels == [("sature.openai.local", "cle-sature"), ("panne.openai.local", "cle-panne"),
+                      ("sain.openai.local", "cle-sain")]
+    # Le déploiement saturé reste en pause : les appels suivants vont directement au déploiement sain
+    assert sature.limiter.stats()["reponses_429"] == 1
+    assert function_app.get_openai_router().choose() in (panne, sain)
+
+
+def test_routage_vers_le_deploiement_le_plus_rapide(monkeypatch):
+    """Une fois les latences connues, les appels vont au déploiement le plus rapide"""
+    lent, rapide = deploiement("lent"), deploiement("rapide")
+    configurer(monkeypatch, lent, rapide)
+    appels = []
+    handler = stub_par_hote({"lent.openai.local": 0.05, "rapide.openai.local": 0.001}, appels)
+
+    async def sequence():
+        for i in range(12):
+            await function_app.query_azure_openai(f"Commande CMD2025{i:04d}")
+
+    executer(handler, sequence)
+    assert lent.calls == 1 and rapide.calls == 11
+    assert lent.stats()["latence_ms"] > rapide.stats()["latence_ms"]
+
+
+def test_deploiement_en_echec_ecarte(monkeypatch):
+    """Après le seuil d'échecs, un déploiement n'est plus appelé tant que son disjoncteur est ouvert"""
+    panne, sain = deploiement("panne"), deploiement("sain")
+    panne.circuit = function_app.CircuitBreaker(threshold=2, reset_timeout=30)
+    configurer(monkeypatch, panne, sain)
+    appels = []
+    handler = stub_par_hote({"panne.openai.local": 500, "sain.openai.local": 0.02}, appels)
+
+    async def sequence():
+        for i in range(6):
+            # La latence du déploiement sain le ferait sinon écarter au profit du déploiement en panne
+            panne.latency = None
+            await function_app.query_azure_openai(f"Commande CMD2025{i:04d}")
+
+    executer(handler, sequence)
+    assert panne.calls == 2 and sain.calls == 6
+    statistiques = function_app.collect_metrics()["openai"]["deploiements"]
+    assert statistiques["panne"]["disjoncteur"]["etat"] == "ouvert"
+    assert statistiques["panne"]["disponible"] is False and statistiques["sain"]["echecs"] == 0
+
+
+def test_configuration_json(monkeypatch):
+    """OPENAI_BACKENDS : clé directe ou lue dans une variable, quota propre à chaque déploiement"""
+    monkeypatch.setenv("CLE_SUEDE", "secret")
+    deploiements = parse_openai_backends(json.dumps([
+        {"nom": "france", "endpoint": "https://fr.openai.azure.com/", "deploiement": "gpt-4o", "cle": "k", "rpm": 60},
+        {"endpoint": "https://se.openai.azure.com", "deploiement": "gpt-4o", "cle_env": "CLE_SUEDE"},
+    ]))
+    assert [d.name for d in deploiements] == ["france", "deploiement-2"]
+    assert deploiements[0].url.startswith("https://fr.openai.azure.com/openai/deployments/gpt-4o/")
+    assert deploiements[0].limiter.stats()["rpm"] == 60 and deploiements[1].headers == {"api-key": "secret"}
+    with pytest.raises(ValueError):
+        parse_openai_backends('[{"nom": "sans endpoint"}]')
+
+
+def test_plusieurs_serveurs_stub(monkeypatch):
+    """Deux serveurs stub locaux de latences différentes : le plus rapide reçoit l'essentiel de la charge"""
+    serveurs = [stub_openai.demarrer_serveur(stub_openai.StubConfig(latence=latence)) for latence in ("fixe:60", "fixe:1")]
+    try:
+        lent, rapide = (OpenAIBackend(nom, url, "stub", api_version="2024-02-01")
+                        for nom, (_, url) in zip(("lent", "rapide"), serveurs))
+        configurer(monkeypatch, lent, rapide)
+        monkeypatch.setattr(function_app, "_openai_client", None)
+
+        async def sequence():
+            for i in range(10):
+                await function_app.query_azure_openai(f"Commande BSK2506CF{i:04d}")
+            await function_app._openai_client.aclose()
+
+        asyncio.run(sequence())
+        assert rapide.calls >= 8
+        assert serveurs[1][0].config.compteurs["requetes"] == rapide.calls
+    finally:
+        for serveur, _ in serveurs:
+            serveur.shutdown()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du moteur de recherche d'ID de commande compilé
+"""
+
+from benchmark_order_id import extract_order_id_cascade
+from function_app import match_order_id
+
+TEXTES = [
+    "Bon de commande BSK2506CF0383 du 23/06/2025",
+    "Référence TAC ETAC60JDF\nlivraison prévue",
+    "Commande BC2025-001 à livrer",
+    "Commande BC2025001 à livrer",
+    "Numéro 212011016 client",
+    "Article XX12 quantité 4",
+    "aucun identifiant ici",
+    "facture 2025 total 1500",
+]
+
+
+def test_memes_resultats_que_la_cascade():
+    """Sans ambiguïté, le moteur renvoie le même ID que l'ancienne cascade"""
+    for texte in TEXTES:
+        match = match_order_id(texte)
+        assert (match.value if match else None) == extract_order_id_cascade(texte), texte
+
+
+def test_preference_pour_l_id_ancre():
+    """À format égal, l'ID annoncé par "N° de commande" l'emporte sur le premier du texte"""
+    texte = "Devis CMD20240999 du 02/01/2025\nN° de commande : CMD20250001"
+    assert extract_order_id_cascade(texte) == "CMD20240999"
+    match = match_order_id(texte)
+    assert match.value == "CMD20250001"
+    assert match.anchor_distance is not None
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du mode de sortie structurée (response_format json_schema, instruction compacte)
+"""
+
+import asyncio
+import json
+
+import httpx
+
+import function_app
+from function_app import ResultCache
+
+
+def analyser(monkeypatch, contenu, texte="Commande passée, merci de confirmer la livraison."):
+    """Analyse un texte avec un stub qui renvoie `contenu` ; retourne (résultat, corps envoyé à OpenAI)"""
+    requetes = []
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    monkeypatch.setattr(function_app, "DETERMINISTIC_TIER", False)
+
+    async def handler(request):
+        requetes.append(json.loads(request.content))
+        return httpx.Response(200, json={"choices": [{"message": {"content": contenu}}],
+                                         "usage": {"prompt_tokens": 100, "completion_tokens": 20}})
+
+    async def scenario():
+        monkeypatch.setattr(function_app, "AZURE_OPENAI_ENDPOINT", "https://stub.openai.local")
+        monkeypatch.setattr(function_app, "_openai_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        monkeypatch.setattr(function_app, "_openai_client_loop", asyncio.get_running_loop())
+        return await function_app.analyze_user_content(texte)
+
+    return asyncio.run(scenario()), requetes[0]
+
+
+def test_mode_schema(monkeypatch):
+    """Schéma strict, température 0, max_tokens serré et instruction bien plus courte"""
+    monkeypatch.setattr(function_app, "OPENAI_OUTPUT_MODE", "schema")
+    avant = dict(function_app.OUTPUT_STATS["schema"])
+    contenu = json.dumps({"ID_commande": "CMD20250042", "nom_fournisseur": None,
+                          "date_reception": None, "date_livraison": "12/10/2025"})
+    resultat, body = analyser(monkeypatch, contenu)
+    assert resultat["ID_commande"] == "CMD20250042"
+    assert body["temperature"] == 0 and body["max_tokens"] == function_app.OPENAI_SCHEMA_MAX_TOKENS
+    schema = body["response_format"]["json_schema"]["schema"]
+    assert schema["required"] == list(function_app.EXTRACTION_FIELDS) and not schema["additionalProperties"]
+    instruction = body["messages"][0]["content"]
+    assert "#" not in instruction and len(instruction) * 4 < len(function_app.LONG_INSTRUCTION)
+    stats = function_app.OUTPUT_STATS["schema"]
+    assert stats["reponses"] == avant["reponses"] + 1
+    assert stats["prompt_tokens"] == avant["prompt_tokens"] + 100
+
+
+def test_echec_json_compte_en_mode_texte(monkeypatch):
+    """Le JSON commenté invité par LONG_INSTRUCTION est compté comme échec de parsing"""
+    monkeypatch.setattr(function_app, "OPENAI_OUTPUT_MODE", "texte")
+    avant = function_app.OUTPUT_STATS["texte"]["echecs_json"]
+    contenu = '{\n  "ID_commande": "CMD20250042",  # L\'ID de la commande extrait\n}'
+    resultat, body = analyser(monkeypatch, contenu)
+    assert "response_format" not in body and body["messages"][0]["content"] == function_app.LONG_INSTRUCTION
+    assert function_app.OUTPUT_STATS["texte"]["echecs_json"] == avant + 1
+    assert function_app.collect_metrics()["sortie_openai"]["texte"]["taux_echec_json"] > 0
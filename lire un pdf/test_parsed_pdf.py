@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'analyse unique du PDF partagée entre extracteurs
+"""
+
+import fitz
+
+from function_app import ParsedPdf, extract_order_id_from_pdf, extract_text_from_pdf
+
+
+def creer_pdf(pages):
+    """Crée un PDF en mémoire avec une page par texte fourni"""
+    doc = fitz.open()
+    for texte in pages:
+        page = doc.new_page()
+        if texte:
+            page.insert_text((72, 72), texte)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_texte_et_id_sur_le_meme_document():
+    """Le texte des pages est extrait une fois et réutilisé"""
+    pdf = ParsedPdf(creer_pdf(["Bon de commande BSK2506CF0383", "", "Conditions générales"]))
+    assert extract_order_id_from_pdf(pdf) == "BSK2506CF0383"
+    assert list(pdf._page_texts) == [0]
+    assert extract_text_from_pdf(pdf) == "Bon de commande BSK2506CF0383\nConditions générales"
+    assert sorted(pdf._page_texts) == [0, 1, 2]
+
+
+def test_arret_apres_la_premiere_page_prioritaire():
+    """Une annexe de 40 pages n'est pas lue si l'ID est en page 1"""
+    pdf = ParsedPdf(creer_pdf(["Commande TAC ETAC60JDF"] + ["Annexe CGV 2025 REF123456"] * 40))
+    assert extract_order_id_from_pdf(pdf) == "TAC ETAC60JDF"
+    assert len(pdf._page_texts) == 1
+
+
+def test_repli_sur_le_texte_complet():
+    """Sans format prioritaire, tout le document est analysé"""
+    pdf_bytes = creer_pdf(["Facture", "Commande CMD20250001"])
+    assert extract_order_id_from_pdf(pdf_bytes) == "CMD20250001"
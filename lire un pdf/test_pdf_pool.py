@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'extraction parallèle des pages sur le pool de processus
+"""
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import fitz
+import pytest
+
+import function_app
+from function_app import ParsedPdf, extract_text_from_pdf, load_pdf_texts_parallel
+
+
+def creer_pdf(nb_pages, prefixe):
+    doc = fitz.open()
+    for numero in range(nb_pages):
+        doc.new_page().insert_text((72, 72), f"{prefixe} page {numero + 1}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_texte_identique_et_dans_l_ordre(monkeypatch):
+    """Le texte rassemblé depuis le pool est celui de l'extraction séquentielle"""
+    monkeypatch.setattr(function_app, "PDF_POOL_WORKERS", 2)
+    monkeypatch.setattr(function_app, "PDF_POOL_PAGE_THRESHOLD", 3)
+    try:
+        data = creer_pdf(7, "BC")
+        sequentiel = "\n".join(f"BC page {numero}" for numero in range(1, 8))
+        assert extract_text_from_pdf(ParsedPdf(data)) == sequentiel
+
+        # Plusieurs documents répartis en même temps sur le pool
+        documents = [ParsedPdf(creer_pdf(4, f"DOC{i}")) for i in range(3)]
+        load_pdf_texts_parallel(documents)
+        for i, pdf in enumerate(documents):
+            assert len(pdf._page_texts) == 4
+            assert pdf.full_text.splitlines()[-1] == f"DOC{i} page 4"
+    finally:
+        function_app.shutdown_pdf_pool()
+
+
+def test_delai_propre_a_chaque_document(monkeypatch):
+    """Un document bloqué est abandonné à son délai ; le document suivant est tout de même extrait"""
+    class PoolBloque:
+        def __init__(self):
+            self.futures = []
+
+        def submit(self, fonction, source, start, stop):
+            future = Future()
+            if source is not documents[0].source:
+                future.set_result(fonction(source, start, stop))
+            self.futures.append(future)
+            return future
+
+    documents = [ParsedPdf(creer_pdf(2, "BLOQUE")), ParsedPdf(creer_pdf(2, "DOC"))]
+    pool = PoolBloque()
+    monkeypatch.setattr(function_app, "get_pdf_pool", lambda: pool)
+    monkeypatch.setattr(function_app, "PDF_POOL_WORKERS", 2)
+    with pytest.raises(FutureTimeoutError):
+        load_pdf_texts_parallel(documents, timeout=0.05)
+    assert pool.futures[0].cancelled()
+    assert not documents[0]._page_texts
+    assert documents[1].full_text == "DOC page 1\nDOC page 2"
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'assemblage du prompt avec budget de tokens et sélection des pages PDF
+"""
+
+import fitz
+
+from function_app import ParsedPdf, build_prompt_content
+
+
+def creer_pdf(pages):
+    doc = fitz.open()
+    for texte in pages:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 560, 800), texte, fontsize=7)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+CGV = ("Article 12 - Conditions générales de vente. Tout litige relève du tribunal de commerce. "
+       "Pénalités de retard applicables selon la clause 7. ") * 25
+
+
+def test_petit_pdf_inchange():
+    """Sous le budget, le contenu est identique à l'assemblage complet"""
+    pdf = ParsedPdf(creer_pdf(["Bon de commande BSK2506CF0383", "Livraison prévue le 29/07/2025"]))
+    contenu, stats = build_prompt_content("Bonjour", pdf, budget=1000)
+    assert contenu == "EMAIL:\nBonjour\n\nPIECE_JOINTE_PDF:\nBon de commande BSK2506CF0383\nLivraison prévue le 29/07/2025"
+    assert stats["pages_ecartees"] == 0 and stats["tokens_ecartes"] == 0
+
+
+def test_annexes_cgv_ecartees():
+    """Au-delà du budget, les pages utiles sont gardées et les CGV écartées"""
+    pages = ["Bon de commande N° BSK2506CF0383\nFournisseur : IMPRIMERIE AJDIR\nDate de commande : 23/06/2025"]
+    pages += [CGV] * 30
+    pages.insert(5, "Planning : livraison prévue le 29/07/2025, délai confirmé")
+    pdf = ParsedPdf(creer_pdf(pages))
+    contenu, stats = build_prompt_content("Voir BC joint", pdf, budget=1500)
+    assert "BSK2506CF0383" in contenu and "29/07/2025" in contenu
+    assert stats["tokens_envoyes"] <= 1500
+    assert stats["pages_gardees"] == 2 and stats["pages_ecartees"] == 30
+    assert stats["tokens_ecartes"] > 0
+
+
+def test_long_email_garde_les_pages_du_pdf():
+    """Un fil de discussion plus long que le budget n'évince pas la page du PDF qui porte l'ID de commande"""
+    email = "Bonjour, merci de confirmer la livraison.\n> Message précédent cité, sans référence.\n" * 400
+    pdf = ParsedPdf(creer_pdf(["Bon de commande N° BSK2506CF0383\nFournisseur : IMPRIMERIE AJDIR"] + [CGV] * 5))
+    contenu, stats = build_prompt_content(email, pdf, budget=1500)
+    assert "BSK2506CF0383" in contenu and contenu.startswith("EMAIL:\nBonjour")
+    assert stats["pages_gardees"] >= 1 and stats["tokens_envoyes"] <= 1500
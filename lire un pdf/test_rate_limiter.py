@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du limiteur de débit et du disjoncteur OpenAI contre un stub local qui renvoie des 429 scriptés
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import function_app
+from function_app import CircuitBreaker, CircuitOpenError, RateLimiter, TokenBucket
+
+
+def stub_scripte(script, appels):
+    """Stub chat/completions : rejoue la liste de (statut, en-têtes), puis répond 200"""
+    def handler(request):
+        appels.append(time.monotonic())
+        if script:
+            statut, entetes = script.pop(0)
+            return httpx.Response(statut, headers=entetes, json={"error": {"code": str(statut)}})
+        return httpx.Response(200, json={"choices": [{"message": {"content": "{}"}}]})
+    return handler
+
+
+def executer(installer_client, handler, coroutine_factory):
+    async def scenario():
+        installer_client(handler)
+        return await coroutine_factory()
+    return asyncio.run(scenario())
+
+
+def configurer(monkeypatch, seuil=5, reprise=30, mode="fail", essais=3):
+    """Limiteur et disjoncteur neufs pour le test, restaurés ensuite"""
+    monkeypatch.setattr(function_app, "OPENAI_RATE_LIMITER", RateLimiter())
+    monkeypatch.setattr(function_app, "OPENAI_CIRCUIT", CircuitBreaker(seuil, reprise, mode))
+    monkeypatch.setattr(function_app, "OPENAI_MAX_RETRIES", essais)
+
+
+def test_retry_after_respecte(monkeypatch, installer_client):
+    """Les 429 sont repris après le délai indiqué par retry-after-ms"""
+    configurer(monkeypatch)
+    appels = []
+    handler = stub_scripte([(429, {"retry-after-ms": "150"}), (429, {"retry-after": "0.1"})], appels)
+    resultat = executer(installer_client, handler, lambda: function_app.query_azure_openai("429 scriptés"))
+    assert resultat["choices"][0]["message"]["content"] == "{}"
+    assert len(appels) == 3
+    assert appels[1] - appels[0] >= 0.14 and appels[2] - appels[1] >= 0.09
+    assert function_app.OPENAI_RATE_LIMITER.stats()["reponses_429"] == 2
+
+
+def test_disjoncteur_echec_immediat(monkeypatch, installer_client):
+    """Une fois ouvert, le disjoncteur échoue sans appeler le point de terminaison"""
+    configurer(monkeypatch, seuil=2, essais=2)
+    appels = []
+    handler = stub_scripte([(429, {"retry-after-ms": "10"})] * 2, appels)
+
+    async def deux_appels():
+        with pytest.raises(httpx.HTTPStatusError):
+            await function_app.query_azure_openai("saturation 1")
+        with pytest.raises(CircuitOpenError):
+            await function_app.query_azure_openai("saturation 2")
+
+    executer(installer_client, handler, deux_appels)
+    assert len(appels) == 2
+    assert function_app.OPENAI_CIRCUIT.stats()["etat"] == "ouvert"
+
+
+def test_disjoncteur_file_d_attente(monkeypatch, installer_client):
+    """En mode "queue", l'appel attend la fin de l'ouverture puis passe"""
+    configurer(monkeypatch, seuil=1, reprise=0.2, mode="queue", essais=1)
+    appels = []
+    handler = stub_scripte([(503, {})], appels)
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await function_app.query_azure_openai("indisponible 1")
+        debut = time.monotonic()
+        resultat = await function_app.query_azure_openai("indisponible 2")
+        return resultat, time.monotonic() - debut
+
+    resultat, attente = executer(installer_client, handler, scenario)
+    assert resultat["choices"][0]["message"]["content"] == "{}"
+    assert attente >= 0.15
+    assert function_app.OPENAI_CIRCUIT.stats()["etat"] == "ferme"
+
+
+def test_seau_a_jetons():
+    """Au-delà de la capacité, le délai d'attente suit le débit configuré"""
+    seau = TokenBucket(per_minute=600, capacity=1)
+    assert seau.reserve(1) == 0
+    assert seau.reserve(1) == pytest.approx(0.1, abs=0.02)
+
+
+def test_appel_test_illisible_libere_le_disjoncteur(monkeypatch, installer_client):
+    """Une réponse 200 non JSON pendant l'appel test rouvre le disjoncteur au lieu de le bloquer"""
+    configurer(monkeypatch, seuil=1, reprise=0.1, essais=1)
+    reponses = [httpx.Response(503), httpx.Response(200, text="<html>Proxy</html>")]
+    appels = []
+
+    def handler(request):
+        appels.append(request)
+        return reponses.pop(0) if reponses else httpx.Response(200, json={"choices": [{"message": {"content": "{}"}}]})
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await function_app.query_azure_openai("proxy 1")
+        await asyncio.sleep(0.15)
+        with pytest.raises(ValueError):
+            await function_app.query_azure_openai("proxy 2")
+        assert function_app.OPENAI_CIRCUIT.stats()["etat"] == "ouvert"
+        await asyncio.sleep(0.15)
+        return await function_app.query_azure_openai("proxy 3")
+
+    resultat = executer(installer_client, handler, scenario)
+    assert resultat["choices"][0]["message"]["content"] == "{}"
+    assert len(appels) == 3 and function_app.OPENAI_CIRCUIT.stats()["etat"] == "ferme"
+
+
+def test_retry_after_plafonne(monkeypatch):
+    """Un Retry-After du serveur ne dépasse pas OPENAI_BACKOFF_MAX"""
+    monkeypatch.setattr(function_app, "OPENAI_BACKOFF_MAX", 30.0)
+    assert function_app.retry_delay(httpx.Response(429, headers={"retry-after": "86400"}), 0) == 30.0
+    assert function_app.retry_delay(httpx.Response(429, headers={"retry-after-ms": "150"}), 0) == 0.15
+
+
+def test_annulation_en_attente_du_quota_libere_le_disjoncteur(monkeypatch, installer_client):
+    """Un appel test annulé pendant l'attente du limiteur laisse un autre appel tester le service"""
+    configurer(monkeypatch, seuil=1, reprise=0.05, essais=1)
+    appels = []
+    handler = stub_scripte([(503, {})], appels)
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await function_app.query_azure_openai("quota 1")
+        await asyncio.sleep(0.1)
+        function_app.OPENAI_RATE_LIMITER.pause(0.3)  # l'appel test attendra le quota
+        tache = asyncio.create_task(function_app.query_azure_openai("quota 2"))
+        await asyncio.sleep(0.05)
+        tache.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tache
+        assert function_app.OPENAI_CIRCUIT.available
+        return await function_app.query_azure_openai("quota 3")
+
+    resultat = executer(installer_client, handler, scenario)
+    assert resultat["choices"][0]["message"]["content"] == "{}"
+    assert len(appels) == 2 and function_app.OPENAI_CIRCUIT.stats()["etat"] == "ferme"
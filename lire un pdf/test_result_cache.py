@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du cache de résultats d'extraction (LRU mémoire + SQLite)
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import azure.functions as func
+import httpx
+
+import function_app
+from function_app import ResultCache
+
+
+def test_lru_et_ttl():
+    """Éviction LRU et expiration des entrées"""
+    cache = ResultCache(maxsize=2, ttl=0.2)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+    cache.set("c", {"v": 3})  # "b" est le moins récemment utilisé
+    assert cache.get("b") is None
+    assert cache.get("c") == {"v": 3}
+    time.sleep(0.25)
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2
+
+
+def test_niveau_persistant():
+    """Une entrée écrite dans SQLite survit à une nouvelle instance"""
+    with tempfile.TemporaryDirectory() as tmp:
+        chemin = os.path.join(tmp, "cache.sqlite")
+        ResultCache(maxsize=4, ttl=60, sqlite_path=chemin).set("cle", {"ID_commande": "BSK2506CF0383"})
+        cache = ResultCache(maxsize=4, ttl=60, sqlite_path=chemin)
+        assert cache.get("cle") == {"ID_commande": "BSK2506CF0383"}
+        assert cache.get("cle") == {"ID_commande": "BSK2506CF0383"}
+        stats = cache.stats()
+        assert stats["hits_persistant"] == 1 and stats["hits_memoire"] == 1
+
+
+def test_renvoi_identique_sans_appel_openai(installer_client):
+    """Un email renvoyé à l'identique ne déclenche pas de second appel OpenAI"""
+    appels = []
+    contenu = json.dumps({"ID_commande": "TAC ETAC60JDF", "nom_fournisseur": "IMPRIMERIE AJDIR",
+                          "date_reception": None, "date_livraison": "15/10/2025"})
+
+    async def handler(request):
+        appels.append(1)
+        return httpx.Response(200, json={"choices": [{"message": {"content": contenu}}]})
+
+    async def envoyer():
+        installer_client(handler)
+        req = func.HttpRequest(
+            method="POST",
+            url="/api/analyze_email_and_pdf",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps({"email": "Fournisseur : AJDIR\nLivraison prévue pour le 15/10/2025 (cache)"}).encode()
+        )
+        premiere = await function_app.main(req)
+        seconde = await function_app.main(req)
+        return premiere, seconde
+
+    premiere, seconde = asyncio.run(envoyer())
+    assert len(appels) == 1
+    assert premiere.get_body() == seconde.get_body()
+    assert function_app.collect_metrics()["cache"]["hits"] >= 1
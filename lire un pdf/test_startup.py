@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du démarrage à froid : imports différés de PyMuPDF, httpx et dateutil
+"""
+
+import os
+import subprocess
+import sys
+
+DOSSIER = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPT = """
+import sys
+import function_app
+lourds = ("fitz", "pymupdf", "httpx", "dateutil.parser")
+print("charges:" + ",".join(m for m in lourds if m in sys.modules))
+function_app.extract_delivery_date_intelligent("Livraison prévue le 12/10/2025")
+print("charges:" + ",".join(m for m in lourds if m in sys.modules))
+function_app.fitz.open().close()
+print("charges:" + ",".join(m for m in lourds if m in sys.modules))
+"""
+
+
+def modules_charges(mode):
+    env = dict(os.environ, STARTUP_MODE=mode)
+    sortie = subprocess.run([sys.executable, "-c", SCRIPT], cwd=DOSSIER, env=env,
+                            capture_output=True, text=True, check=True)
+    lignes = [ligne[len("charges:"):] for ligne in sortie.stdout.splitlines() if ligne.startswith("charges:")]
+    return [set(filter(None, ligne.split(","))) for ligne in lignes]
+
+
+def test_imports_differes():
+    """Import du module sans PyMuPDF ni httpx ; chacun est chargé à sa première utilisation"""
+    demarrage, apres_date, apres_pdf = modules_charges("lazy")
+    assert demarrage == set()
+    assert apres_date == set()  # les dates numériques n'ont pas besoin de dateutil
+    assert {"fitz", "pymupdf"} <= apres_pdf and "httpx" not in apres_pdf
+
+
+def test_mode_eager():
+    """STARTUP_MODE=eager charge tout au démarrage, comme avant"""
+    assert {"fitz", "httpx", "dateutil.parser"} <= modules_charges("eager")[0]
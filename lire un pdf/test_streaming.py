@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la lecture en flux (SSE) des réponses OpenAI, arrêtée dès que l'objet JSON est complet
+"""
+
+import asyncio
+import json
+
+import azure.functions as func
+import httpx
+
+import function_app
+import stub_openai
+from function_app import JsonObjectScanner, ResultCache
+
+
+def test_objet_json_decoupe_au_hasard():
+    """Accolades et guillemets échappés dans les chaînes ne trompent pas le suivi"""
+    texte = 'Voici le JSON : {"nom_fournisseur": "A \\"{B}\\" C", "ID_commande": {"n": 1}} et merci !'
+    for taille in (1, 3, 7, len(texte)):
+        scanner = JsonObjectScanner()
+        for debut in range(0, len(texte), taille):
+            if scanner.feed(texte[debut:debut + taille]):
+                break
+        assert scanner.complete
+        assert json.loads(scanner.text) == {"nom_fournisseur": 'A "{B}" C', "ID_commande": {"n": 1}}
+    scanner = JsonObjectScanner()
+    scanner.feed('{"ID_commande": "BSK')
+    assert not scanner.complete and scanner.text == '{"ID_commande": "BSK'
+
+
+def test_flux_ferme_apres_l_objet(monkeypatch):
+    """Le bavardage qui suit le JSON n'est pas lu : le flux est fermé dès l'accolade finale"""
+    monkeypatch.setattr(function_app, "OPENAI_STREAM", True)
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    envoyes = []
+    requetes = []
+
+    async def evenements(reponse):
+        for evenement in stub_openai.evenements_sse(reponse, bavardage=" bla" * 500, taille=4):
+            envoyes.append(evenement)
+            yield evenement
+
+    async def handler(request):
+        body = json.loads(request.content)
+        requetes.append(body)
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"},
+                              content=evenements(stub_openai.repondre(body)))
+
+    async def scenario():
+        monkeypatch.setattr(function_app, "AZURE_OPENAI_ENDPOINT", "https://stub.openai.local")
+        monkeypatch.setattr(function_app, "_openai_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        monkeypatch.setattr(function_app, "_openai_client_loop", asyncio.get_running_loop())
+        req = func.HttpRequest(
+            method="POST",
+            url="/api/analyze_email_and_pdf",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps({"email": "Commande CMD20250042 expédiée, livraison le 12/10/2025"}).encode()
+        )
+        return await function_app.main(req)
+
+    resp = asyncio.run(scenario())
+    assert requetes[0]["stream"] is True
+    assert resp.status_code == 200
+    assert json.loads(resp.get_body())["date_livraison"] == "12/10/2025"
+    assert len(envoyes) < 100  # le bavardage représente plus de 500 événements
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du serveur stub Azure OpenAI et du générateur de charge
+"""
+
+import asyncio
+import random
+
+import azure.functions as func
+import httpx
+
+import function_app
+import load_generator
+import stub_openai
+from function_app import ResultCache
+
+
+def brancher_sur(monkeypatch, url):
+    """Client OpenAI du module dirigé vers le serveur stub, sans cache ni attente entre tentatives"""
+    monkeypatch.setattr(function_app, "AZURE_OPENAI_ENDPOINT", url)
+    monkeypatch.setattr(function_app, "AZURE_DEPLOYMENT_NAME", "stub")
+    monkeypatch.setattr(function_app, "API_VERSION", "2024-02-01")
+    monkeypatch.setattr(function_app, "HEADERS", {"Content-Type": "application/json", "api-key": "stub"})
+    monkeypatch.setattr(function_app, "RESULT_CACHE", ResultCache(maxsize=0))
+    monkeypatch.setattr(function_app, "retry_delay", lambda response, attempt: 0)
+    monkeypatch.setattr(function_app, "OPENAI_MAX_RETRIES", 5)
+    monkeypatch.setattr(function_app, "_openai_client", None)
+
+
+def test_latences_et_erreurs_injectees(monkeypatch):
+    """Les 429 injectés sont réessayés par query_azure_openai ; les mauvaises routes renvoient 404"""
+    assert stub_openai.tirer_latence("fixe:250", random.Random()) == 0.25
+    assert 0.1 <= stub_openai.tirer_latence("uniforme:100:200", random.Random()) <= 0.2
+    config = stub_openai.StubConfig(latence="fixe:1", taux_429=0.2, graine=1)
+    serveur, url = stub_openai.demarrer_serveur(config)
+    try:
+        brancher_sur(monkeypatch, url)
+
+        async def scenario():
+            reponses = await asyncio.gather(*[
+                function_app.query_azure_openai(f"Commande BSK2506CF{i:04d}, livraison le 12/10/2025")
+                for i in range(8)
+            ])
+            await function_app._openai_client.aclose()
+            return reponses
+
+        reponses = asyncio.run(scenario())
+        assert all("BSK2506CF" in r["choices"][0]["message"]["content"] for r in reponses)
+        assert config.compteurs["429"] > 0
+        assert config.compteurs["requetes"] == 8 + config.compteurs["429"]
+        assert httpx.post(f"{url}/autre", json={}).status_code == 404
+    finally:
+        serveur.shutdown()
+
+
+def test_generateur_de_charge(monkeypatch):
+    """Charge ouverte sur le handler branché sur le stub : rapport des percentiles et des statuts"""
+    serveur, url = stub_openai.demarrer_serveur(stub_openai.StubConfig(latence="fixe:5"))
+    try:
+        brancher_sur(monkeypatch, url)
+
+        async def handler(request):
+            req = func.HttpRequest(method="POST", url=str(request.url),
+                                   headers=dict(request.headers), body=request.content)
+            resp = await function_app.main(req)
+            return httpx.Response(resp.status_code, content=resp.get_body())
+
+        charges = load_generator.construire_charges(part_pdf=0.5)[:5]
+        resultats = asyncio.run(load_generator.generer_charge(
+            "http://function.local/api/analyze_email_and_pdf", rps=20, duree=1, charges=charges,
+            transport=httpx.MockTransport(handler)))
+        synthese = load_generator.rapport(resultats, 1)
+    finally:
+        serveur.shutdown()
+    assert synthese["requetes"] > 5
+    assert synthese["statuts"] == {"200": synthese["requetes"]}
+    assert synthese["p50_ms"] <= synthese["p95_ms"] <= synthese["p99_ms"]
+    assert load_generator.percentile([1, 2, 3, 4], 50) == 2
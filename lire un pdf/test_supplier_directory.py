@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'annuaire des fournisseurs (adresses, domaines, alias, correspondance approchée)
+"""
+
+import asyncio
+import json
+import os
+import time
+
+import function_app
+from function_app import SupplierDirectory, deterministic_extraction, prepare_email_content
+
+EXEMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fournisseurs.example.csv")
+
+
+def test_resolutions():
+    """Adresse exacte, domaine et sous-domaine, alias et nom approché"""
+    annuaire = SupplierDirectory.from_file(EXEMPLE)
+    assert annuaire.stats() == {"fournisseurs": 3, "emails": 3, "domaines": 3, "alias": 7}
+    assert annuaire.resolve("Commandes@Ajdir.ma") == ("IMPRIMERIE AJDIR", 0.99, "email")
+    assert annuaire.resolve("compta@mail.papeterie-du-nord.fr") == ("PAPETERIE DU NORD", 0.95, "domaine")
+    assert annuaire.resolve("atlas.emballage@gmail.com").name == "ATLAS EMBALLAGE"
+    assert annuaire.resolve("inconnu@gmail.com") is None  # domaine grand public
+    assert annuaire.resolve("Société Atlas Emballage").source == "alias"
+    approche = annuaire.resolve("IMPRIMMERIE AJDIR")
+    assert approche.name == "IMPRIMERIE AJDIR" and approche.source == "approche" and approche.confidence >= 0.8
+    assert annuaire.resolve("Transports Benali") is None
+
+
+def test_rechargement_et_tier_deterministe(tmp_path, monkeypatch):
+    """Le fichier modifié est rechargé ; le nom résolu dispense d'interroger OpenAI sur ce champ"""
+    chemin = tmp_path / "fournisseurs.json"
+    chemin.write_text(json.dumps([{"nom": "IMPRIMERIE AJDIR", "domaines": ["ajdir.ma"]}]), encoding="utf-8")
+    monkeypatch.setattr(function_app, "SUPPLIER_DIRECTORY", str(chemin))
+    monkeypatch.setattr(function_app, "SUPPLIER_REFRESH_INTERVAL", 0)
+    monkeypatch.setattr(function_app, "_supplier_directory", None)
+    monkeypatch.setattr(function_app, "_supplier_directory_mtime", None)
+
+    contenu = asyncio.run(prepare_email_content({"email": "Commande BSK2506CF0383"}, "bc@ajdir.ma"))
+    assert "Fournisseur : IMPRIMERIE AJDIR" in contenu
+    assert deterministic_extraction(contenu)["nom_fournisseur"] == ("IMPRIMERIE AJDIR", 0.95)
+
+    chemin.write_text(json.dumps([{"nom": "AJDIR IMPRESSION", "domaines": ["ajdir.ma"]}]), encoding="utf-8")
+    os.utime(chemin, ns=(time.time_ns(), time.time_ns() + 10**9))
+    texte = "Fournisseur : bc@ajdir.ma"
+    assert deterministic_extraction(texte)["nom_fournisseur"] == ("AJDIR IMPRESSION", 0.95)
+    assert function_app.collect_metrics()["annuaire_fournisseurs"]["fournisseurs"] == 1